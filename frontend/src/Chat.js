@@ -1,5 +1,4 @@
 import { useState, useRef } from "react";
-import axios from "axios";
 import "./Chat.css";
 
 // Helper: 解析產品 Summary 字串為鍵值對
@@ -21,6 +20,21 @@ const parseSummary = (summaryText) => {
     return details;
 };
 
+// Helper: 解析單一 SSE 事件區塊 ("event: x\ndata: {...}")
+const parseSseEvent = (raw) => {
+    let event = "message";
+    const dataLines = [];
+    raw.split("\n").forEach(line => {
+        if (line.startsWith("event:")) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith("data:")) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    if (dataLines.length === 0) return null;
+    return { event, data: JSON.parse(dataLines.join("\n")) };
+};
+
 // 元件: 產品卡片 (Product Card)
 const ProductCard = ({ product }) => {
     const details = parseSummary(product.Summary);
@@ -115,6 +129,37 @@ export default function Chat() {
     // const BACKEND_URL = "http://localhost:5002"; 
     const BACKEND_URL = "https://heteropolar-dessie-bottlelike.ngrok-free.dev"; 
     
+    const [conversationId, setConversationId] = useState(null);
+
+    // 更新最後一則訊息 (串流中的 bot 回覆)
+    const updateLastMessage = (update) => {
+        setMessages((m) => {
+            const copy = [...m];
+            copy[copy.length - 1] = update(copy[copy.length - 1]);
+            return copy;
+        });
+    };
+
+    function handleStreamEvent({ event, data }) {
+        if (event === "start") {
+            setConversationId(data.conversation_id);
+        } else if (event === "token") {
+            updateLastMessage((msg) => ({ ...msg, text: msg.text + data.token }));
+        } else if (event === "done") {
+            if (data.complete) {
+                updateLastMessage(() => ({
+                    role: "assistant",
+                    type: "final_consultation",
+                    data: { reply: data.reply, structured_data: data.structured_data }
+                }));
+            } else {
+                updateLastMessage((msg) => ({ ...msg, text: data.reply }));
+            }
+        } else if (event === "error") {
+            console.error("Chat Stream Error:", data.error);
+        }
+    }
+
     async function send() {
         if (!input.trim()) return;
 
@@ -123,36 +168,42 @@ export default function Chat() {
         inputRef.current?.focus(); 
 
         const userMsg = { role: "user", type: "chat", text: current };
-        setMessages((m) => [...m, userMsg]);
+        // 先放入一則空的 bot 訊息，token 到達時逐步補上
+        const botMsg = { role: "assistant", type: "chat", text: "" };
+        setMessages((m) => [...m, userMsg, botMsg]);
 
         try {
-            const res = await axios.post(`${BACKEND_URL}/chat`, {
-                message: current,
+            const res = await fetch(`${BACKEND_URL}/chat_stream`, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ message: current, conversation_id: conversationId }),
             });
+            if (!res.ok || !res.body) {
+                throw new Error(`HTTP ${res.status}`);
+            }
 
-            const data = res.data;
-            
-            if (data.complete) {
-                setMessages((m) => [
-                    ...m,
-                    { 
-                        role: "assistant", 
-                        type: "final_consultation", 
-                        data: { reply: data.reply, structured_data: data.structured_data } 
-                    },
-                ]);
-            } else {
-                setMessages((m) => [
-                    ...m,
-                    { role: "assistant", type: "chat", text: data.reply },
-                ]);
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                // SSE 事件以空行分隔，最後一段可能尚未接收完整
+                const events = buffer.split("\n\n");
+                buffer = events.pop();
+                events.forEach(raw => {
+                    const parsed = parseSseEvent(raw);
+                    if (parsed) handleStreamEvent(parsed);
+                });
             }
         } catch (error) {
             console.error("Chat API Error:", error);
-            setMessages((m) => [
-                ...m,
-                { role: "assistant", type: "chat", text: "抱歉，與後端服務連線失敗或發生錯誤。" },
-            ]);
+            updateLastMessage(() => (
+                { role: "assistant", type: "chat", text: "抱歉，與後端服務連線失敗或發生錯誤。" }
+            ));
         }
     }
 
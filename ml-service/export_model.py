@@ -0,0 +1,128 @@
+"""
+export_model.py
+
+將 joblib 的 sklearn Pipeline 匯出成不需要 pickle 的推論格式：
+    booster.ubj (或 booster.json)   XGBoost 原生模型格式
+    preprocess_spec.json            one-hot 類別、StandardScaler 平均/標準差、交互作用特徵、原始輸入對照表
+    model.onnx (選用，--onnx)       只含 booster，輸入為編碼後的特徵 (float32)，可在無 Python 的 runtime 執行
+
+服務端以 MODEL_PATH 指向匯出目錄 (或用 model_registry.py publish 發佈) 即可，
+載入時只需要 numpy + xgboost (light_inference.py)。
+
+    python export_model.py --model ../models/insurance_xgb_model.pkl --out ../models/export --onnx
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+from datetime import datetime, timezone
+from fast_predictor import FastPredictor
+from light_inference import SPEC_NAME, LightPredictor
+from lookup_table import DEFAULT_MODEL_PATH, file_sha256
+
+DEFAULT_EXPORT_DIR = DEFAULT_MODEL_PATH.parent / "export"
+ONNX_NAME = "model.onnx"
+
+
+def export_onnx(predictor, out_path, opset=None):
+    # 選用依賴 (requirements-onnx.txt)：onnxmltools + onnx (驗證另需 onnxruntime)
+    from onnxmltools import convert_xgboost
+    from onnxmltools.convert.common.data_types import FloatTensorType
+
+    # ONNX 沒有 iteration_range：early stopping 的模型先截到 best_iteration + 1 棵樹，
+    # 否則會多算 best_iteration 之後的樹，與 Pipeline 的預測不同
+    booster = predictor.booster
+    if predictor.iteration_range != (0, 0):
+        booster = booster[slice(*predictor.iteration_range)]
+    onnx_model = convert_xgboost(
+        booster,
+        initial_types=[("input", FloatTensorType([None, predictor.n_outputs]))],
+        target_opset=opset,
+    )
+    Path(out_path).write_bytes(onnx_model.SerializeToString())
+
+
+def verify(pipeline, export_dir, n_samples=2000, seed=42, onnx_path=None):
+    """隨機原始輸入比較 Pipeline 與匯出格式的預測差異 (log 空間)。"""
+    rng = np.random.default_rng(seed)
+    light = LightPredictor.load(export_dir)
+    regions = [c for cities in light.raw_spec["region_map"].values() for c in cities] + ["花蓮縣"]
+    records = [
+        {
+            "age": int(rng.integers(18, 80)),
+            "sex": str(rng.choice(["male", "female"])),
+            "bmi": round(float(rng.uniform(15, 45)), 1),
+            "children": int(rng.integers(0, 5)),
+            "smoker": str(rng.choice(["yes", "no"])),
+            "region": str(rng.choice(regions)),
+        }
+        for _ in range(n_samples)
+    ]
+
+    import pandas as pd
+
+    feature_rows = [light.build_features(r) for r in records]
+    expected = pipeline.predict(pd.DataFrame(feature_rows))
+    report = {"samples": n_samples, "max_abs_diff_log": float(np.abs(light.predict_features(feature_rows) - expected).max())}
+
+    if onnx_path is not None:
+        import onnxruntime as ort
+
+        X = np.empty((n_samples, light.n_outputs), dtype=np.float64)
+        for row, features in zip(X, feature_rows):
+            light.encode_into(features, row)
+        session = ort.InferenceSession(str(onnx_path), providers=["CPUExecutionProvider"])
+        onnx_pred = session.run(None, {"input": X.astype(np.float32)})[0].ravel()
+        # ONNX 以 float32 計算，只會與 float64 結果近似
+        report["onnx_max_abs_diff_log"] = float(np.abs(onnx_pred - expected).max())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the trained pipeline to a pickle-free format")
+    parser.add_argument("--model", default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--out", default=str(DEFAULT_EXPORT_DIR))
+    parser.add_argument("--format", choices=["ubj", "json"], default="ubj")
+    parser.add_argument("--onnx", action="store_true", help="also write model.onnx (pip install -r requirements-onnx.txt)")
+    parser.add_argument("--onnx-opset", type=int, default=None)
+    parser.add_argument("--verify-samples", type=int, default=2000, help="0 = skip verification")
+    args = parser.parse_args()
+
+    import joblib
+
+    pipeline = joblib.load(args.model)
+    predictor = FastPredictor.from_pipeline(pipeline)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    booster_name = f"booster.{args.format}"
+    predictor.booster.save_model(str(out / booster_name))
+
+    onnx_path = None
+    if args.onnx:
+        onnx_path = out / ONNX_NAME
+        export_onnx(predictor, onnx_path, args.onnx_opset)
+
+    spec = predictor.to_spec()
+    spec.update({
+        "booster": booster_name,
+        "booster_sha256": file_sha256(out / booster_name),
+        "onnx": ONNX_NAME if onnx_path else None,
+        "source_model_sha256": file_sha256(args.model),
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+    })
+    # spec 最後寫入：registry 以 spec 檔判斷匯出是否完成 / 是否有更新
+    tmp = out / f".{SPEC_NAME}.tmp"
+    tmp.write_text(json.dumps(spec, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, out / SPEC_NAME)
+    print(f"Exported to {out}: {booster_name}, {SPEC_NAME}" + (f", {ONNX_NAME}" if onnx_path else ""))
+
+    if args.verify_samples > 0:
+        report = verify(pipeline, out, args.verify_samples, onnx_path=onnx_path)
+        print("Verification vs pipeline:", json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
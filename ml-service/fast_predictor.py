@@ -0,0 +1,68 @@
+import numpy as np
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from light_inference import LightPredictor
+
+
+class FastPredictor(LightPredictor):
+    """
+    不經過 pandas 與 sklearn ColumnTransformer 的預測路徑：
+    從已訓練的 Pipeline 取出 OneHotEncoder / StandardScaler 的參數，
+    直接把特徵寫入預先配置的 NumPy array，再呼叫 XGBoost booster.inplace_predict。
+    編碼與推論實作在 LightPredictor (不依賴 sklearn)，這裡只負責從 Pipeline 取參數。
+    """
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """僅支援 (OneHotEncoder, StandardScaler) 組成的 ColumnTransformer；其他結構丟出 ValueError。"""
+        preprocessor = pipeline.named_steps["preprocess"]
+        regressor = pipeline.named_steps["regressor"]
+        if not isinstance(preprocessor, ColumnTransformer):
+            raise ValueError("preprocess step must be a ColumnTransformer")
+
+        onehot_specs = []
+        numeric_columns, means, scales = None, None, None
+        numeric_offset = None
+        offset = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if isinstance(transformer, str) and transformer == "drop":
+                continue
+            if isinstance(transformer, OneHotEncoder):
+                drop_idx = transformer.drop_idx_ if transformer.drop_idx_ is not None else [None] * len(columns)
+                for col, categories, dropped in zip(columns, transformer.categories_, drop_idx):
+                    positions = {}
+                    for i, category in enumerate(categories):
+                        if dropped is not None and i == dropped:
+                            continue
+                        positions[category] = offset
+                        offset += 1
+                    # 被 drop 的類別全部為 0
+                    if dropped is not None:
+                        positions.setdefault(categories[dropped], None)
+                    onehot_specs.append((col, positions))
+            elif isinstance(transformer, StandardScaler) and numeric_columns is None:
+                numeric_columns = list(columns)
+                n = len(numeric_columns)
+                means = transformer.mean_ if transformer.with_mean else np.zeros(n)
+                scales = transformer.scale_ if transformer.with_std else np.ones(n)
+                numeric_offset = offset
+                offset += n
+            else:
+                raise ValueError(f"Unsupported transformer: {name}")
+
+        if numeric_columns is None:
+            raise ValueError("StandardScaler step not found")
+
+        best_iteration = getattr(regressor, "best_iteration", None)
+        iteration_range = (0, best_iteration + 1) if best_iteration is not None else (0, 0)
+
+        return cls(
+            booster=regressor.get_booster(),
+            onehot_specs=onehot_specs,
+            numeric_columns=numeric_columns,
+            means=np.asarray(means, dtype=np.float64),
+            scales=np.asarray(scales, dtype=np.float64),
+            numeric_offset=numeric_offset,
+            n_outputs=offset,
+            iteration_range=iteration_range,
+        )
@@ -1,34 +1,166 @@
+import os
+import io
+import math
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
 from flask import Flask, request, jsonify
-import pandas as pd
 import numpy as np
-import joblib
 from pathlib import Path
+from micro_batcher import MicroBatcher
+from model_registry import ModelRegistry
+from lookup_table import DEFAULT_TABLE_PATH, PremiumTable
+from light_inference import SEX_MAP, SMOKER_MAP, REGION_MAP, DEFAULT_REGION
 
-BASE_DIR = Path(__file__).resolve().parent
-MODEL_PATH = BASE_DIR.parent / "models" / "insurance_xgb_model.pkl"
+# pandas 只在載入 joblib Pipeline 或讀取 CSV 批次時才 import；
+# 以匯出目錄服務時 worker 不需載入 pandas / sklearn
+if TYPE_CHECKING:
+    import pandas as pd
 
-model = joblib.load(MODEL_PATH)
+# 版本化模型 (models/registry/manifest.json)；沒有 manifest 時使用單一 MODEL_PATH
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", 5))  # 秒，0 = 不輪詢
+# gunicorn.conf.py 設為 0，改在 post_fork 於每個 worker 啟動 (master 不需要 watcher)
+MODEL_WATCH_AUTOSTART = os.getenv("MODEL_WATCH_AUTOSTART", "1") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # 未設定時 /admin/reload 一律拒絕
 
-app = Flask(__name__)
+registry = ModelRegistry()
+registry.reload()
+if MODEL_WATCH_AUTOSTART:
+    registry.start_watcher(MODEL_WATCH_INTERVAL)
+
+
+def predict_feature_rows(feature_rows: list, bundle=None) -> np.ndarray:
+    """build_features() 輸出的多筆特徵 → log(charges)。"""
+    bundle = bundle or registry.current
+    if bundle.fast_predictor is not None:
+        return bundle.fast_predictor.predict_features(feature_rows)
+    import pandas as pd
+
+    # ColumnTransformer 以欄位名稱選取，直接用特徵 dict 建 DataFrame 即可
+    return bundle.model.predict(pd.DataFrame(feature_rows))
+
+
+# 動態批次：並發的 /predict 合併為一次向量化預測 (預設關閉)
+batcher = None
+if os.getenv("PREDICT_BATCHING", "0") == "1":
+    batcher = MicroBatcher(
+        predict_feature_rows,
+        max_batch_size=int(os.getenv("PREDICT_BATCH_MAX_SIZE", 32)),
+        max_wait_ms=float(os.getenv("PREDICT_BATCH_MAX_WAIT_MS", 2))
+    )
+
+# 預先計算的保費表 (PREDICT_LOOKUP_TABLE=1 使用預設路徑，或直接指定 .npy 路徑)
+def load_premium_table(setting):
+    if setting in ("", "0"):
+        return None
+    table_path = DEFAULT_TABLE_PATH if setting == "1" else Path(setting)
+    try:
+        table = PremiumTable.load(table_path)
+    except Exception as e:
+        print(f"Lookup table disabled: {e}")
+        return None
+    if table.model_hash != registry.current.model_hash:
+        print("Lookup table disabled: built from a different model file")
+        return None
+    return table
+
+
+premium_table = load_premium_table(os.getenv("PREDICT_LOOKUP_TABLE", "0"))
+
+# ---------------------------
+# Quote cache (LRU + TTL)
+# ---------------------------
+# 預設關閉：BMI 只在 key 中四捨五入，同一格內的不同 BMI 會共用第一次算出的報價
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", 0))  # 0 = 關閉
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", 3600))  # 秒
+# orchestrator 送出的 BMI 為小數兩位，預設精度下其報價與 pipeline 完全相同
+QUOTE_CACHE_BMI_PRECISION = int(os.getenv("QUOTE_CACHE_BMI_PRECISION", 2))
+class QuoteCache:
+    """以正規化特徵 tuple 為 key 的預測快取；模型 hash 改變時整個清空。"""
+
+    def __init__(self, max_entries=QUOTE_CACHE_SIZE, ttl=QUOTE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.model_hash = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _sync_model(self, model_hash):
+        if model_hash != self.model_hash:
+            if self.model_hash is not None:
+                self.invalidations += 1
+            self._entries.clear()
+            self.model_hash = model_hash
+
+    def get(self, key, model_hash):
+        with self._lock:
+            self._sync_model(model_hash)
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
 
-SEX_MAP = {"male": 1, "female": 0}
-SMOKER_MAP = {"yes": 1, "no": 0}
+    def put(self, key, value, model_hash):
+        with self._lock:
+            self._sync_model(model_hash)
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
 
-REGION_MAP = {
-    "Taipei": ["台北市","新北市","桃園市","基隆市","宜蘭縣","新竹縣","新竹市","苗栗縣"],
-    "Taichung": ["台中市","彰化縣","南投縣","雲林縣","嘉義縣","嘉義市"],
-    "Tainan": ["台南市","高雄市","屏東縣"]
-}
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "model_hash": self.model_hash,
+            }
+
+
+quote_cache = QuoteCache() if QUOTE_CACHE_SIZE > 0 else None
+
+
+def quote_cache_key(features: dict) -> tuple:
+    # region 已經過 map_region；只有 key 中的 bmi 四捨五入，模型仍使用原始值
+    return (
+        features["age"], features["sex"], features["children"],
+        features["smoker"], features["region"],
+        round(features["bmi"], QUOTE_CACHE_BMI_PRECISION),
+    )
+
+app = Flask(__name__)
 
 REQUIRED_FEATURES = [
     "age", "sex", "bmi", "children", "smoker", "region"
 ]
+NUMERIC_FEATURES = ["age", "bmi", "children"]
+
+# /predict_batch 單次最多筆數
+MAX_BATCH_SIZE = int(os.getenv("PREDICT_MAX_BATCH_SIZE", 10000))
 
 def map_region(city: str) -> str:
     for region, cities in REGION_MAP.items():
         if city in cities:
             return region
-    return "Kaohsiung"
+    return DEFAULT_REGION
 
 
 def validate_input(data: dict):
@@ -37,8 +169,50 @@ def validate_input(data: dict):
         raise ValueError(f"Missing fields: {missing}")
 
 
-def preprocess(data: dict) -> pd.DataFrame:
-    df = pd.DataFrame([data])
+def validate_record(data: dict) -> dict:
+    """批次用的逐筆檢查：欄位齊全且數值欄位可轉為數字 (CSV 讀入的值皆為字串)。"""
+    if not isinstance(data, dict):
+        raise ValueError("Record must be a JSON object")
+    validate_input(data)
+
+    record = {f: data[f] for f in REQUIRED_FEATURES}
+    for f in NUMERIC_FEATURES:
+        try:
+            record[f] = float(record[f])
+        except (TypeError, ValueError):
+            raise ValueError(f"Field '{f}' must be numeric, got {record[f]!r}")
+        # float() 接受 "nan" / "inf"，這些值會產生 NaN 報價
+        if not math.isfinite(record[f]):
+            raise ValueError(f"Field '{f}' must be a finite number, got {data[f]!r}")
+    return record
+
+
+def build_features(data: dict) -> dict:
+    """單筆版的 preprocess()，輸出與其 DataFrame 欄位相同的 dict (fast path 使用)。"""
+    age = float(data["age"])
+    bmi = float(data["bmi"])
+    smoker = SMOKER_MAP.get(data["smoker"], 0)
+    return {
+        "age": age,
+        "sex": SEX_MAP.get(data["sex"], 0),
+        "bmi": bmi,
+        "children": float(data["children"]),
+        "smoker": smoker,
+        "region": map_region(data["region"]),
+        "bmi_smoker": bmi * smoker,
+        "age_smoker": age * smoker,
+        "bmi_age": bmi * age,
+    }
+
+
+def preprocess(data: dict) -> "pd.DataFrame":
+    return preprocess_records([data])
+
+
+def preprocess_records(records: list) -> "pd.DataFrame":
+    import pandas as pd
+
+    df = pd.DataFrame(records)
 
     df["sex"] = df["sex"].map(SEX_MAP).fillna(0).astype(int)
     df["smoker"] = df["smoker"].map(SMOKER_MAP).fillna(0).astype(int)
@@ -56,17 +230,171 @@ def predict():
         data = request.get_json(force=True)
         validate_input(data)
 
-        df = preprocess(data)
-        y_pred_log = model.predict(df)
+        # 整個請求使用同一個模型版本，熱更新不會影響進行中的請求
+        bundle = registry.current
+
+        # 查表模式：常數時間查詢，超出表格範圍時才繼續走模型推論
+        if premium_table is not None and premium_table.model_hash == bundle.model_hash:
+            y_pred_log = premium_table.lookup(build_features(data))
+            if y_pred_log is not None:
+                return jsonify({"predicted_charge": float(np.round(np.exp(y_pred_log), 0))})
+
+        cache_key = None
+        if quote_cache is not None:
+            cache_key = quote_cache_key(build_features(data))
+            cached = quote_cache.get(cache_key, bundle.model_hash)
+            if cached is not None:
+                return jsonify({"predicted_charge": cached})
+
+        if batcher is not None:
+            y_pred_log = np.array([batcher.submit(build_features(data))])
+        elif bundle.fast_predictor is not None:
+            y_pred_log = bundle.fast_predictor.predict_features([build_features(data)])
+        else:
+            df = preprocess(data)
+            y_pred_log = bundle.model.predict(df)
         y_pred = np.exp(y_pred_log)
+        charge = float(np.round(y_pred[0], 0))
+
+        # 批次執行時可能已切換到新模型，此時不寫入快取
+        if cache_key is not None and registry.current is bundle:
+            quote_cache.put(cache_key, charge, bundle.model_hash)
 
         return jsonify({
-            "predicted_charge": float(np.round(y_pred[0], 0))
+            "predicted_charge": charge
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
+def parse_batch_request() -> list:
+    """
+    支援三種輸入：
+    1. JSON：list 或 {"records": [...]}
+    2. JSON Lines：Content-Type application/x-ndjson，或上傳 .jsonl 檔
+    3. CSV：Content-Type text/csv，或上傳 .csv 檔 (multipart 欄位名稱 file)
+    """
+    upload = request.files.get("file")
+    if upload is not None:
+        raw = upload.read().decode("utf-8-sig")
+        name = (upload.filename or "").lower()
+        fmt = "jsonl" if name.endswith((".jsonl", ".ndjson")) else "csv"
+    else:
+        raw = request.get_data(as_text=True)
+        content_type = request.mimetype or ""
+        if content_type in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines"):
+            fmt = "jsonl"
+        elif content_type == "text/csv":
+            fmt = "csv"
+        else:
+            fmt = "json"
+
+    if fmt == "csv":
+        import pandas as pd
+
+        # 全部以字串讀入，由 validate_record 統一轉型與回報錯誤
+        df = pd.read_csv(io.StringIO(raw), dtype=str, keep_default_na=False)
+        return df.to_dict(orient="records")
+
+    if fmt == "jsonl":
+        records = []
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                # 保留位置，讓該列回報錯誤
+                records.append(e)
+        return records
+
+    payload = json.loads(raw)
+    if isinstance(payload, dict):
+        payload = payload.get("records")
+    if not isinstance(payload, list):
+        raise ValueError("Expected a list of records or {\"records\": [...]}")
+    return payload
+
+
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch():
+    try:
+        records = parse_batch_request()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    if len(records) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch size {len(records)} exceeds limit {MAX_BATCH_SIZE}"}), 413
+
+    # 逐筆檢查，只把合法的列送進模型
+    results = [None] * len(records)
+    valid_index, valid_records = [], []
+    for i, data in enumerate(records):
+        try:
+            if isinstance(data, Exception):
+                raise ValueError(f"Invalid JSON: {data}")
+            valid_records.append(validate_record(data))
+            valid_index.append(i)
+        except ValueError as e:
+            results[i] = {"index": i, "error": str(e)}
+
+    if valid_records:
+        try:
+            bundle = registry.current
+            if bundle.model is None:
+                # 匯出格式 (無 Pipeline) 直接走 LightPredictor
+                y_pred_log = predict_feature_rows([build_features(r) for r in valid_records], bundle)
+            else:
+                # 整批向量化前處理 + 單次 model.predict
+                y_pred_log = bundle.model.predict(preprocess_records(valid_records))
+            y_pred = np.round(np.exp(y_pred_log), 0)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+
+        for i, charge in zip(valid_index, y_pred):
+            results[i] = {"index": i, "predicted_charge": float(charge)}
+
+    return jsonify({
+        "results": results,
+        "count": len(records),
+        "error_count": len(records) - len(valid_records)
+    })
+
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    """
+    重新載入 manifest 的 current 版本，或以 {"version": "v2"} 切換版本。
+    切換版本會寫入 manifest，其他 worker 由 watcher 在下一次輪詢時跟進。
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "admin endpoint disabled: ADMIN_TOKEN is not set"}), 403
+    if request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "unauthorized"}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        version = data.get("version")
+        bundle = registry.activate(version) if version else registry.reload()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"model": bundle.info()})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    bundle = registry.current
+    stats = {
+        "model": bundle.info(),
+        "fast_path": bundle.fast_predictor is not None,
+        "lookup_table": premium_table is not None and premium_table.model_hash == bundle.model_hash
+    }
+    if batcher is not None:
+        stats["batcher"] = batcher.stats()
+    if quote_cache is not None:
+        stats["quote_cache"] = quote_cache.stats()
+    return jsonify(stats)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001, debug=False)
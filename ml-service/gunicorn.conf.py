@@ -0,0 +1,32 @@
+"""
+gunicorn 設定：
+    gunicorn -c gunicorn.conf.py flask_predict_price:app
+
+preload_app 讓模型只在 master 載入一次，fork 後各 worker 以 copy-on-write 共用同一份記憶體，
+不必每個 worker 各自 unpickle。
+"""
+
+import gc
+import os
+
+# 設定檔在 preload 應用程式之前載入：master 不啟動模型檔輪詢 thread，
+# 避免 fork 時 thread 正持有鎖 (見 post_fork)
+os.environ["MODEL_WATCH_AUTOSTART"] = "0"
+
+bind = os.getenv("BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+preload_app = True
+
+
+def when_ready(server):
+    # 將載入完成的物件移到 permanent generation，GC 不再掃描 (寫入) 它們，
+    # 避免 worker 因 GC 而複製共用的記憶體分頁
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # thread 不會跨 fork 保留，每個 worker 各自啟動模型檔輪詢
+    from flask_predict_price import MODEL_WATCH_INTERVAL, registry
+
+    registry.start_watcher(MODEL_WATCH_INTERVAL)
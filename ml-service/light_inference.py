@@ -0,0 +1,177 @@
+"""
+light_inference.py
+
+只依賴 numpy + xgboost 的推論模組：讀取 export_model.py 輸出的
+booster (UBJSON/JSON) 與前處理規格 (preprocess_spec.json)，不需要 sklearn、pandas 或 pickle。
+
+    from light_inference import LightPredictor
+    predictor = LightPredictor.load("../models/export")
+    predictor.predict([{"age": 35, "sex": "male", "bmi": 25.0, "children": 1, "smoker": "no", "region": "台北市"}])
+"""
+
+import json
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+
+SPEC_NAME = "preprocess_spec.json"
+
+# ---------------------------
+# 原始輸入 → 特徵 對照 (flask_predict_price 與匯出規格共用)
+# ---------------------------
+SEX_MAP = {"male": 1, "female": 0}
+SMOKER_MAP = {"yes": 1, "no": 0}
+
+REGION_MAP = {
+    "Taipei": ["台北市","新北市","桃園市","基隆市","宜蘭縣","新竹縣","新竹市","苗栗縣"],
+    "Taichung": ["台中市","彰化縣","南投縣","雲林縣","嘉義縣","嘉義市"],
+    "Tainan": ["台南市","高雄市","屏東縣"]
+}
+DEFAULT_REGION = "Kaohsiung"
+
+# 交互作用特徵：名稱 → 相乘的兩個欄位
+INTERACTIONS = {
+    "bmi_smoker": ("bmi", "smoker"),
+    "age_smoker": ("age", "smoker"),
+    "bmi_age": ("bmi", "age"),
+}
+
+
+def default_raw_spec():
+    return {
+        "sex_map": SEX_MAP,
+        "smoker_map": SMOKER_MAP,
+        "region_map": REGION_MAP,
+        "default_region": DEFAULT_REGION,
+        "interactions": {name: list(cols) for name, cols in INTERACTIONS.items()},
+    }
+
+
+class LightPredictor:
+    """
+    將特徵直接寫入預先配置的 NumPy array (one-hot + 標準化)，再呼叫 booster.inplace_predict。
+    編碼結果與 sklearn ColumnTransformer 逐位元一致。
+    """
+
+    def __init__(self, booster, onehot_specs, numeric_columns, means, scales, numeric_offset, n_outputs,
+                 iteration_range, raw_spec=None):
+        self.booster = booster
+        self.onehot_specs = onehot_specs        # [(欄位, {類別: 輸出位置})]
+        self.numeric_columns = numeric_columns  # StandardScaler 的輸入欄位順序
+        self.means = means
+        self.scales = scales
+        self.numeric_slice = slice(numeric_offset, numeric_offset + len(numeric_columns))
+        self.n_outputs = n_outputs
+        self.iteration_range = iteration_range
+        self.raw_spec = raw_spec or default_raw_spec()  # 原始輸入 → 特徵的對照表
+        self._local = threading.local()
+
+    # ---------------------------
+    # 載入 / 匯出規格
+    # ---------------------------
+    @classmethod
+    def load(cls, export_dir):
+        import xgboost as xgb
+
+        export_dir = Path(export_dir)
+        spec = json.loads((export_dir / SPEC_NAME).read_text(encoding="utf-8"))
+        raw = (export_dir / spec["booster"]).read_bytes()
+        if spec.get("booster_sha256") and hashlib.sha256(raw).hexdigest() != spec["booster_sha256"]:
+            raise ValueError(f"sha256 mismatch for {spec['booster']}")
+        booster = xgb.Booster()
+        booster.load_model(bytearray(raw))
+        return cls.from_spec(booster, spec)
+
+    @classmethod
+    def from_spec(cls, booster, spec):
+        numeric = spec["numeric"]
+        return cls(
+            booster=booster,
+            # JSON 的 key 只能是字串，類別以 [類別, 位置] 配對保存以保留原始型別
+            onehot_specs=[(o["column"], {c: pos for c, pos in o["positions"]}) for o in spec["onehot"]],
+            numeric_columns=numeric["columns"],
+            means=np.asarray(numeric["mean"], dtype=np.float64),
+            scales=np.asarray(numeric["scale"], dtype=np.float64),
+            numeric_offset=numeric["offset"],
+            n_outputs=spec["n_outputs"],
+            iteration_range=tuple(spec["iteration_range"]),
+            raw_spec=spec.get("raw"),
+        )
+
+    def to_spec(self):
+        return {
+            "n_outputs": self.n_outputs,
+            "onehot": [
+                {"column": col, "positions": [[getattr(c, "item", lambda: c)(), pos] for c, pos in positions.items()]}
+                for col, positions in self.onehot_specs
+            ],
+            "numeric": {
+                "columns": list(self.numeric_columns),
+                "mean": self.means.tolist(),
+                "scale": self.scales.tolist(),
+                "offset": self.numeric_slice.start,
+            },
+            "iteration_range": list(self.iteration_range),
+            "raw": self.raw_spec,
+        }
+
+    # ---------------------------
+    # 推論
+    # ---------------------------
+    def encode_into(self, features: dict, out: np.ndarray):
+        out[:] = 0.0
+        for col, positions in self.onehot_specs:
+            value = features[col]
+            if value not in positions:
+                raise ValueError(f"Found unknown categories [{value!r}] in column {col!r}")
+            pos = positions[value]
+            if pos is not None:
+                out[pos] = 1.0
+        numeric = out[self.numeric_slice]
+        for i, col in enumerate(self.numeric_columns):
+            numeric[i] = features[col]
+        # 與 StandardScaler.transform 相同的運算順序 (先減後除)，確保結果逐位元一致
+        numeric -= self.means
+        numeric /= self.scales
+
+    def _buffer(self, n_rows):
+        buf = getattr(self._local, "buf", None)
+        if buf is None or buf.shape[0] < n_rows:
+            buf = np.empty((n_rows, self.n_outputs), dtype=np.float64)
+            self._local.buf = buf
+        return buf[:n_rows]
+
+    def predict_features(self, feature_rows: list) -> np.ndarray:
+        """feature_rows 為 build_features() 的輸出；回傳 log(charges) 預測值。"""
+        X = self._buffer(len(feature_rows))
+        for row, features in zip(X, feature_rows):
+            self.encode_into(features, row)
+        return self.booster.inplace_predict(
+            X, iteration_range=self.iteration_range, predict_type="value", validate_features=False
+        )
+
+    def build_features(self, data: dict) -> dict:
+        """原始輸入 → 特徵，規則與 flask_predict_price.build_features 相同 (取自匯出的 raw 規格)。"""
+        raw = self.raw_spec
+        region = raw["default_region"]
+        for name, cities in raw["region_map"].items():
+            if data["region"] in cities:
+                region = name
+                break
+        features = {
+            "age": float(data["age"]),
+            "sex": raw["sex_map"].get(data["sex"], 0),
+            "bmi": float(data["bmi"]),
+            "children": float(data["children"]),
+            "smoker": raw["smoker_map"].get(data["smoker"], 0),
+            "region": region,
+        }
+        for name, (a, b) in raw["interactions"].items():
+            features[name] = features[a] * features[b]
+        return features
+
+    def predict(self, records: list) -> np.ndarray:
+        """原始輸入 → 預估保費 (TWD，四捨五入到整數)。"""
+        y_log = self.predict_features([self.build_features(r) for r in records])
+        return np.round(np.exp(y_log), 0)
@@ -0,0 +1,193 @@
+"""
+lookup_table.py
+
+預先以訓練好的 Pipeline 計算整個特徵空間的保費 (log) 並存成 memory-mapped NumPy 表，
+服務端 /predict 即可用常數時間查表 (BMI 線性內插) 取代 XGBoost 推論。
+
+建表 + 準確度報告：
+    python lookup_table.py --model ../models/insurance_xgb_model.pkl --out ../models/premium_table.npy
+"""
+
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+# 查表 (serving) 只需要 numpy；pandas 僅供建表與準確度報告
+if TYPE_CHECKING:
+    import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_MODEL_PATH = BASE_DIR.parent / "models" / "insurance_xgb_model.pkl"
+DEFAULT_TABLE_PATH = BASE_DIR.parent / "models" / "premium_table.npy"
+
+# 表格各軸 (順序即 ndarray 維度順序)
+AGES = np.arange(18, 101)
+SEXES = np.array([0, 1])          # female / male
+CHILDREN = np.arange(0, 11)
+SMOKERS = np.array([0, 1])        # no / yes
+REGIONS = ["Taipei", "Taichung", "Tainan", "Kaohsiung"]
+
+
+def meta_path(table_path):
+    return Path(table_path).with_suffix(".json")
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def features_frame(age, sex, bmi, children, smoker, region) -> "pd.DataFrame":
+    """與 preprocess() 相同的特徵欄位 (region 已是模型端的地區名稱)。"""
+    import pandas as pd
+
+    return pd.DataFrame({
+        "age": age, "sex": sex, "bmi": bmi, "children": children,
+        "smoker": smoker, "region": region,
+        "bmi_smoker": bmi * smoker,
+        "age_smoker": age * smoker,
+        "bmi_age": bmi * age,
+    })
+
+# ---------------------------
+# 查表 (serving)
+# ---------------------------
+class PremiumTable:
+    def __init__(self, table, bmi_min, bmi_step, model_hash=None):
+        self.table = table
+        self.bmi_min = bmi_min
+        self.bmi_step = bmi_step
+        self.n_bmi = table.shape[-1]
+        self.model_hash = model_hash
+        self.region_index = {r: i for i, r in enumerate(REGIONS)}
+
+    @classmethod
+    def load(cls, table_path):
+        meta = json.loads(meta_path(table_path).read_text(encoding="utf-8"))
+        table = np.load(table_path, mmap_mode="r")
+        return cls(table, meta["bmi_min"], meta["bmi_step"], meta.get("model_hash"))
+
+    def lookup(self, features: dict):
+        """
+        features 為 build_features() 的輸出；回傳 log(charges)。
+        超出表格範圍 (非整數年齡、孩子數 > 10、BMI 超出網格) 時回傳 None，由呼叫端改用模型推論。
+        """
+        age = features["age"]
+        children = features["children"]
+        if not (float(age).is_integer() and AGES[0] <= age <= AGES[-1]):
+            return None
+        if not (float(children).is_integer() and CHILDREN[0] <= children <= CHILDREN[-1]):
+            return None
+
+        pos = (features["bmi"] - self.bmi_min) / self.bmi_step
+        if pos < 0 or pos > self.n_bmi - 1:
+            return None
+
+        row = self.table[
+            int(age) - AGES[0], int(features["sex"]), int(children),
+            int(features["smoker"]), self.region_index[features["region"]]
+        ]
+        i = int(pos)
+        if i >= self.n_bmi - 1:
+            return float(row[-1])
+        frac = pos - i
+        return float(row[i] * (1.0 - frac) + row[i + 1] * frac)
+
+# ---------------------------
+# 建表 (offline)
+# ---------------------------
+def build_table(model, bmi_min, bmi_max, bmi_step, chunk_size=500_000):
+    bmis = bmi_min + np.arange(int(round((bmi_max - bmi_min) / bmi_step)) + 1) * bmi_step
+    shape = (len(AGES), len(SEXES), len(CHILDREN), len(SMOKERS), len(REGIONS), len(bmis))
+
+    grid = np.indices(shape).reshape(len(shape), -1)
+    age = AGES[grid[0]].astype(float)
+    sex = SEXES[grid[1]]
+    children = CHILDREN[grid[2]].astype(float)
+    smoker = SMOKERS[grid[3]]
+    region = np.array(REGIONS)[grid[4]]
+    bmi = bmis[grid[5]]
+
+    out = np.empty(grid.shape[1], dtype=np.float32)
+    for start in range(0, len(out), chunk_size):
+        sl = slice(start, start + chunk_size)
+        X = features_frame(age[sl], sex[sl], bmi[sl], children[sl], smoker[sl], region[sl])
+        out[sl] = model.predict(X)
+        print(f"scored {min(start + chunk_size, len(out))}/{len(out)}")
+    return out.reshape(shape)
+
+
+def accuracy_report(model, table: PremiumTable, n_samples, seed=42):
+    """在網格之間隨機取樣 (BMI 為連續值)，比較查表與即時推論的保費誤差與延遲。"""
+    rng = np.random.default_rng(seed)
+    age = rng.integers(AGES[0], AGES[-1] + 1, n_samples).astype(float)
+    sex = rng.integers(0, 2, n_samples)
+    children = rng.integers(0, CHILDREN[-1] + 1, n_samples).astype(float)
+    smoker = rng.integers(0, 2, n_samples)
+    region = np.array(REGIONS)[rng.integers(0, len(REGIONS), n_samples)]
+    bmi_max = table.bmi_min + (table.n_bmi - 1) * table.bmi_step
+    bmi = np.round(rng.uniform(table.bmi_min, bmi_max, n_samples), 2)
+
+    X = features_frame(age, sex, bmi, children, smoker, region)
+    live = np.exp(model.predict(X))
+
+    start = time.perf_counter()
+    looked_up = np.exp(np.array([table.lookup(row) for row in X.to_dict(orient="records")]))
+    lookup_us = (time.perf_counter() - start) / n_samples * 1e6
+
+    abs_err = np.abs(looked_up - live)
+    rel_err = abs_err / live
+    return {
+        "samples": n_samples,
+        "mae": float(abs_err.mean()),
+        "max_abs_error": float(abs_err.max()),
+        "mean_rel_error": float(rel_err.mean()),
+        "p99_rel_error": float(np.quantile(rel_err, 0.99)),
+        "max_rel_error": float(rel_err.max()),
+        "lookup_us_per_row": round(lookup_us, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the premium lookup table")
+    parser.add_argument("--model", default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--out", default=str(DEFAULT_TABLE_PATH))
+    parser.add_argument("--bmi-min", type=float, default=10.0)
+    parser.add_argument("--bmi-max", type=float, default=60.0)
+    parser.add_argument("--bmi-step", type=float, default=0.1)
+    parser.add_argument("--report-samples", type=int, default=20000)
+    args = parser.parse_args()
+
+    import joblib
+
+    model = joblib.load(args.model)
+    table = build_table(model, args.bmi_min, args.bmi_max, args.bmi_step)
+    np.save(args.out, table)
+
+    meta = {
+        "axes": ["age", "sex", "children", "smoker", "region", "bmi"],
+        "age_range": [int(AGES[0]), int(AGES[-1])],
+        "children_range": [int(CHILDREN[0]), int(CHILDREN[-1])],
+        "regions": REGIONS,
+        "bmi_min": args.bmi_min,
+        "bmi_step": args.bmi_step,
+        "shape": list(table.shape),
+        "model_hash": file_sha256(args.model),
+    }
+    served = PremiumTable(np.load(args.out, mmap_mode="r"), args.bmi_min, args.bmi_step, meta["model_hash"])
+    meta["accuracy"] = accuracy_report(model, served, args.report_samples)
+    meta_path(args.out).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    print(f"Table saved: {args.out} {table.shape} ({table.nbytes / 1e6:.1f} MB)")
+    print("Accuracy vs live inference:", json.dumps(meta["accuracy"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import time
+import queue
+import bisect
+import threading
+from concurrent.futures import Future
+
+
+class Histogram:
+    """固定 bucket 的累積直方圖 (與 Prometheus histogram 相同語意：le = 上界)。"""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後一格為 +Inf
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, running = {}, 0
+            for le, c in zip(self.buckets + ["+Inf"], self.counts):
+                running += c
+                cumulative[str(le)] = running
+            return {"buckets": cumulative, "sum": round(self.total, 6), "count": self.count}
+
+
+class MicroBatcher:
+    """
+    將並發的單筆請求合併成批次：第一筆到達後最多等待 max_wait_ms 或湊滿 max_batch_size，
+    以一次 predict_fn(items) 向量化計算，再把結果分別交回各呼叫端。
+    predict_fn 接收 list，回傳等長的序列。
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+
+        self.batch_size_hist = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.queue_delay_hist = Histogram([0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1])  # 秒
+
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # 延遲到第一次 submit 才啟動：gunicorn preload 後 fork 的 worker 不會繼承 master 的 thread
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, item, timeout=None):
+        """送出單筆並阻塞等待結果；predict_fn 的例外會在此重新丟出。"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future.result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            self.batch_size_hist.observe(len(batch))
+            for _, _, enqueued_at in batch:
+                self.queue_delay_hist.observe(started - enqueued_at)
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.predict_fn(items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize(),
+            "batch_size": self.batch_size_hist.snapshot(),
+            "queue_delay_seconds": self.queue_delay_hist.snapshot(),
+        }
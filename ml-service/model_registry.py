@@ -0,0 +1,251 @@
+"""
+model_registry.py
+
+版本化的模型目錄與熱更新。
+
+目錄結構 (MODEL_REGISTRY_DIR，預設 models/registry)：
+    manifest.json          {"current": "v2", "versions": {"v2": {"path": "v2/insurance_xgb_model.pkl", "sha256": "...", "created_at": "..."}}}
+    v1/insurance_xgb_model.pkl
+    v2/insurance_xgb_model.pkl
+
+沒有 manifest 時退回單一模型檔 (MODEL_PATH)。
+模型路徑也可以是 export_model.py 輸出的目錄 (booster + preprocess_spec.json)，
+此時不需要 joblib / sklearn Pipeline，直接以 LightPredictor 推論。
+
+發佈新版本 / 切換版本：
+    python model_registry.py publish path/to/insurance_xgb_model.pkl --version v3 --activate
+    python model_registry.py publish ../models/export --version v4 --activate
+    python model_registry.py activate v2
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+from light_inference import SPEC_NAME, LightPredictor
+from lookup_table import file_sha256
+
+BASE_DIR = Path(__file__).resolve().parent
+MODEL_PATH = Path(os.getenv("MODEL_PATH", BASE_DIR.parent / "models" / "insurance_xgb_model.pkl"))
+MODEL_REGISTRY_DIR = Path(os.getenv("MODEL_REGISTRY_DIR", BASE_DIR.parent / "models" / "registry"))
+MANIFEST_NAME = "manifest.json"
+
+
+def load_fast_predictor(pipeline):
+    # 無法支援的 Pipeline 結構時退回 pandas + sklearn 路徑
+    if os.getenv("PREDICT_FAST_PATH", "1") != "1":
+        return None
+    from fast_predictor import FastPredictor
+
+    try:
+        return FastPredictor.from_pipeline(pipeline)
+    except Exception as e:
+        print(f"Fast path disabled: {e}")
+        return None
+
+
+class ModelBundle:
+    """一個已載入、不可變的模型版本；請求開始時取用一次，整個請求都使用同一個 bundle。"""
+
+    __slots__ = ("version", "path", "model_hash", "model", "fast_predictor", "loaded_at")
+
+    def __init__(self, version, path, model_hash, model, fast_predictor):
+        self.version = version
+        self.path = path
+        self.model_hash = model_hash
+        self.model = model
+        self.fast_predictor = fast_predictor
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {
+            "version": self.version,
+            "path": str(self.path),
+            "sha256": self.model_hash,
+            "fast_path": self.fast_predictor is not None,
+            "loaded_at": datetime.fromtimestamp(self.loaded_at, timezone.utc).isoformat(),
+        }
+
+
+class ModelRegistry:
+    def __init__(self, root=MODEL_REGISTRY_DIR, legacy_path=MODEL_PATH):
+        self.root = Path(root)
+        self.legacy_path = Path(legacy_path)
+        self.current = None
+        self._reload_lock = threading.Lock()
+        self._signature = None
+        self._watcher = None
+
+    @property
+    def manifest_path(self):
+        return self.root / MANIFEST_NAME
+
+    def read_manifest(self):
+        if not self.manifest_path.exists():
+            return None
+        return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+
+    def resolve(self, version=None):
+        """回傳 (version, 模型路徑, manifest 記錄的 sha256 或 None)。"""
+        manifest = self.read_manifest()
+        if manifest is None:
+            if version not in (None, "legacy"):
+                raise ValueError(f"No model registry manifest at {self.manifest_path}")
+            return "legacy", self.legacy_path, None
+        version = version or manifest["current"]
+        if version not in manifest["versions"]:
+            raise ValueError(f"Unknown model version: {version}")
+        entry = manifest["versions"][version]
+        return version, self.root / entry["path"], entry.get("sha256")
+
+    def _stat_signature(self):
+        # manifest 與目前模型檔的 (mtime, size)；任一改變就重新載入
+        current = self.current.path if self.current else self.legacy_path
+        paths = [self.manifest_path, current / SPEC_NAME if current.is_dir() else current]
+        signature = []
+        for p in paths:
+            try:
+                st = os.stat(p)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def load(self, version=None):
+        version, path, expected_hash = self.resolve(version)
+        # 匯出目錄以 spec 檔的 hash 代表版本 (spec 內含 booster 的 sha256)
+        model_hash = file_sha256(path / SPEC_NAME if path.is_dir() else path)
+        if expected_hash and model_hash != expected_hash:
+            raise ValueError(f"sha256 mismatch for model version {version}")
+        if path.is_dir():
+            return ModelBundle(version, path, model_hash, None, LightPredictor.load(path))
+        # joblib / sklearn 只在載入 Pipeline 時才 import，匯出目錄不需要
+        import joblib
+
+        model = joblib.load(path)
+        return ModelBundle(version, path, model_hash, model, load_fast_predictor(model))
+
+    def reload(self, version=None):
+        """
+        在呼叫端的 thread 載入新版本，完成後才以單一參照指派切換。
+        載入期間 (與之後仍在執行) 的請求繼續使用舊 bundle，不會被阻塞。
+        """
+        with self._reload_lock:
+            bundle = self.load(version)
+            self.current = bundle
+            self._signature = self._stat_signature()
+        print(f"Model loaded: {bundle.version} ({bundle.model_hash[:12]})")
+        return bundle
+
+    def activate(self, version):
+        """
+        將 version 寫入 manifest 成為 current，並在本 process 立即載入。
+        其他 worker 由各自的 watcher 偵測到 manifest 改變後切換，所有 worker 最終一致。
+        """
+        with self._reload_lock:
+            # 先確認可載入，避免把壞掉的版本寫進 manifest
+            bundle = self.load(version)
+            activate(version, self.root)
+            self.current = bundle
+            self._signature = self._stat_signature()
+        print(f"Model activated: {bundle.version} ({bundle.model_hash[:12]})")
+        return bundle
+
+    def check_for_update(self):
+        if self._stat_signature() == self._signature:
+            return None
+        try:
+            return self.reload()
+        except Exception as e:
+            # 發佈到一半或檔案損毀：保留舊模型，下次輪詢再試
+            print(f"Model reload failed, keeping {self.current.version}: {e}")
+            self._signature = self._stat_signature()
+            return None
+
+    def start_watcher(self, interval):
+        """背景輪詢 manifest / 模型檔；fork 之後需在每個 worker 各自啟動。"""
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.check_for_update()
+
+        self._watcher = threading.Thread(target=run, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+# ---------------------------
+# 發佈 / 切換版本 (CLI)
+# ---------------------------
+def write_manifest(root, manifest):
+    # 先寫暫存檔再 os.replace，讀取端不會看到寫到一半的 manifest
+    tmp = Path(root) / f".{MANIFEST_NAME}.tmp"
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, Path(root) / MANIFEST_NAME)
+
+
+def publish(model_file, version, root=MODEL_REGISTRY_DIR, activate=False):
+    root = Path(root)
+    manifest_path = root / MANIFEST_NAME
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {"current": None, "versions": {}}
+    if version in manifest["versions"]:
+        raise ValueError(f"Version {version} already exists")
+
+    target_dir = root / version
+    target_dir.mkdir(parents=True, exist_ok=False)
+    target = target_dir / Path(model_file).name
+    if Path(model_file).is_dir():
+        shutil.copytree(model_file, target)
+        model_hash = file_sha256(target / SPEC_NAME)
+    else:
+        shutil.copy2(model_file, target)
+        model_hash = file_sha256(target)
+
+    manifest["versions"][version] = {
+        "path": f"{version}/{target.name}",
+        "sha256": model_hash,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    if activate or manifest["current"] is None:
+        manifest["current"] = version
+    write_manifest(root, manifest)
+    return manifest
+
+
+def activate(version, root=MODEL_REGISTRY_DIR):
+    manifest = json.loads((Path(root) / MANIFEST_NAME).read_text(encoding="utf-8"))
+    if version not in manifest["versions"]:
+        raise ValueError(f"Unknown model version: {version}")
+    manifest["current"] = version
+    write_manifest(root, manifest)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry")
+    parser.add_argument("--root", default=str(MODEL_REGISTRY_DIR))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_publish = sub.add_parser("publish", help="copy a model file (or export directory) into the registry as a new version")
+    p_publish.add_argument("model_file")
+    p_publish.add_argument("--version", required=True)
+    p_publish.add_argument("--activate", action="store_true")
+
+    p_activate = sub.add_parser("activate", help="make an existing version current")
+    p_activate.add_argument("version")
+
+    args = parser.parse_args()
+    if args.command == "publish":
+        manifest = publish(args.model_file, args.version, args.root, args.activate)
+    else:
+        manifest = activate(args.version, args.root)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
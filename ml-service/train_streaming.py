@@ -0,0 +1,285 @@
+"""
+train_streaming.py
+
+大型資料集的串流訓練：CSV / Parquet 逐 chunk 讀取，套用與 traning_xgboost.py 相同的
+sex / smoker / region 對照與交互作用特徵，再經由 XGBoost DataIter 建立
+QuantileDMatrix (記憶體內量化) 或 ExtMemQuantileDMatrix (外部記憶體，快取寫到磁碟)，
+訓練時的記憶體不會隨資料量成長。
+
+流程：
+    1. 第一次掃描：StandardScaler.partial_fit 累積平均 / 標準差
+    2. DataIter 每次 reset 重新讀檔，依 chunk 編號固定切出 train / valid / test
+    3. xgb.train + valid early stopping，包回與原本相同結構的 sklearn Pipeline
+    4. 以未參與訓練與 early stopping 的 test 部分計算 holdout 指標
+
+--memory external 需要 xgboost >= 3.0 (ExtMemQuantileDMatrix)。
+
+    python train_streaming.py --data ../dataset/claims.parquet --out ../models/insurance_xgb_model.pkl
+    python train_streaming.py --data big.csv --memory external --cache-dir /tmp/xgb-cache --params ../models/insurance_xgb_model.metrics.json
+"""
+
+import os
+import gc
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from pathlib import Path
+from datetime import datetime, timezone
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBRegressor
+import joblib
+from traning_xgboost import (
+    DEFAULT_DATA_PATH, DEFAULT_MODEL_PATH, DEFAULT_PARAMS, FEATURES, NUMERIC_FEATURES, REGION_MAP,
+    build_preprocessor, metrics_path, transform_frame,
+)
+
+# OneHotEncoder 的類別需事先固定，不能只看第一個 chunk
+REGION_CATEGORIES = sorted(set(REGION_MAP.values()))
+RAW_COLUMNS = ["age", "sex", "bmi", "children", "smoker", "region", "charges"]
+
+# ---------------------------
+# 逐 chunk 讀檔
+# ---------------------------
+def iter_chunks(path, chunk_size):
+    """回傳已前處理 (對照 + 交互作用特徵) 的 DataFrame chunk；無法轉換的列直接丟棄。"""
+    path = Path(path)
+    if path.suffix.lower() in (".parquet", ".pq"):
+        # 選用依賴：pyarrow
+        import pyarrow.parquet as pq
+
+        reader = (batch.to_pandas() for batch in
+                  pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=RAW_COLUMNS))
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_size, usecols=RAW_COLUMNS)
+
+    for chunk in reader:
+        chunk = transform_frame(chunk)
+        yield chunk.dropna(subset=FEATURES + ["charges"]), len(chunk)
+
+
+SUBSETS = ("train", "valid", "test")
+
+
+def split_labels(chunk_index, n_rows, valid_fraction, test_fraction, seed):
+    """每列的 SUBSETS 索引：[0, valid) → valid，[valid, valid + test) → test，其餘 train。"""
+    # 以 (seed, chunk 編號) 決定亂數，每次重新掃描時切分結果都相同
+    r = np.random.default_rng([seed, chunk_index]).random(n_rows)
+    labels = np.zeros(n_rows, dtype=np.int8)
+    labels[r < valid_fraction + test_fraction] = 2
+    labels[r < valid_fraction] = 1
+    return labels
+
+
+def fit_scaler(path, chunk_size):
+    """第一次掃描：累積 StandardScaler 的平均 / 變異數與列數。"""
+    scaler = StandardScaler()
+    rows, dropped = 0, 0
+    for chunk, raw_rows in iter_chunks(path, chunk_size):
+        dropped += raw_rows - len(chunk)
+        if len(chunk):
+            scaler.partial_fit(chunk[NUMERIC_FEATURES])
+            rows += len(chunk)
+    if rows == 0:
+        raise ValueError(f"No usable rows in {path}")
+    return scaler, rows, dropped
+
+
+def build_fitted_preprocessor(scaler, sample):
+    """與 traning_xgboost 相同的 ColumnTransformer，數值欄位改用串流累積的 scaler。"""
+    preprocessor = build_preprocessor(categories=[REGION_CATEGORIES])
+    preprocessor.fit(sample[FEATURES])
+    preprocessor.transformers_ = [
+        (name, scaler if name == "num" else transformer, columns)
+        for name, transformer, columns in preprocessor.transformers_
+    ]
+    return preprocessor
+
+# ---------------------------
+# XGBoost DataIter
+# ---------------------------
+class ChunkIter(xgb.DataIter):
+    """每次 next() 讀一個 chunk、轉成 float32 特徵矩陣交給 XGBoost；reset() 重新開檔。"""
+
+    def __init__(self, path, chunk_size, preprocessor, subset, valid_fraction, test_fraction, seed,
+                 cache_prefix=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.preprocessor = preprocessor
+        self.subset = SUBSETS.index(subset)  # "train" / "valid" / "test"
+        self.valid_fraction = valid_fraction
+        self.test_fraction = test_fraction
+        self.seed = seed
+        self.rows = 0
+        self._chunks = None
+        self._index = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        self._chunks = None
+        self._index = 0
+        self.rows = 0
+
+    def next_frame(self):
+        """回傳下一個非空的 (X, y)，讀完回傳 None。"""
+        if self._chunks is None:
+            self._chunks = iter_chunks(self.path, self.chunk_size)
+        for chunk, _ in self._chunks:
+            labels = split_labels(self._index, len(chunk), self.valid_fraction, self.test_fraction, self.seed)
+            self._index += 1
+            chunk = chunk[labels == self.subset]
+            if len(chunk):
+                X = self.preprocessor.transform(chunk[FEATURES]).astype(np.float32)
+                return X, np.log(chunk["charges"].to_numpy())
+        return None
+
+    def next(self, input_data):
+        frame = self.next_frame()
+        if frame is None:
+            return False
+        X, y = frame
+        self.rows += len(y)
+        input_data(data=X, label=y)
+        return True
+
+
+def build_dmatrices(args, preprocessor):
+    cache_prefix = None
+    if args.memory == "external":
+        Path(args.cache_dir).mkdir(parents=True, exist_ok=True)
+        cache_prefix = str(Path(args.cache_dir) / "train")
+    train_iter = ChunkIter(args.data, args.chunk_size, preprocessor, "train",
+                           args.valid_fraction, args.test_fraction, args.seed, cache_prefix)
+    valid_iter = ChunkIter(args.data, args.chunk_size, preprocessor, "valid",
+                           args.valid_fraction, args.test_fraction, args.seed,
+                           str(Path(args.cache_dir) / "valid") if cache_prefix else None)
+
+    if args.memory == "external":
+        dtrain = xgb.ExtMemQuantileDMatrix(train_iter, max_bin=args.max_bin)
+        dvalid = xgb.ExtMemQuantileDMatrix(valid_iter, max_bin=args.max_bin, ref=dtrain)
+    else:
+        dtrain = xgb.QuantileDMatrix(train_iter, max_bin=args.max_bin)
+        dvalid = xgb.QuantileDMatrix(valid_iter, max_bin=args.max_bin, ref=dtrain)
+    return dtrain, dvalid
+
+
+def holdout_metrics(booster, test_iter):
+    """
+    掃描 test 部分，以 TWD 計算 MAE / RMSE (逐 chunk 累加，不保留整份資料)。
+    test 列不參與訓練，也不用於 early stopping，指標不會因選擇 best_iteration 而偏樂觀。
+    """
+    test_iter.reset()
+    n, abs_sum, sq_sum, sq_log_sum = 0, 0.0, 0.0, 0.0
+    iteration_range = (0, booster.best_iteration + 1) if "best_iteration" in booster.attributes() else (0, 0)
+    while (frame := test_iter.next_frame()) is not None:
+        X, y_log = frame
+        pred_log = booster.inplace_predict(X, iteration_range=iteration_range)
+        diff = np.exp(pred_log) - np.exp(y_log)
+        n += len(y_log)
+        abs_sum += float(np.abs(diff).sum())
+        sq_sum += float((diff ** 2).sum())
+        sq_log_sum += float(((pred_log - y_log) ** 2).sum())
+    if n == 0:
+        return {}
+    return {
+        "rows": n,
+        "mae": abs_sum / n,
+        "rmse": float(np.sqrt(sq_sum / n)),
+        "rmse_log": float(np.sqrt(sq_log_sum / n)),
+    }
+
+
+def load_params(path):
+    """可直接讀 traning_xgboost.py 輸出的 *.metrics.json (在樣本上搜尋好的參數)。"""
+    if path is None:
+        return dict(DEFAULT_PARAMS)
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return dict(data.get("params", data))
+
+
+def to_pipeline(booster, preprocessor, params):
+    """包回與 traning_xgboost 相同的 Pipeline，服務端 / fast path / 匯出都不需改動。"""
+    regressor = XGBRegressor(**params, tree_method="hist")
+    regressor.load_model(bytearray(booster.save_raw("ubj")))
+    return Pipeline(steps=[("preprocess", preprocessor), ("regressor", regressor)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train on a large CSV/Parquet dataset in chunks")
+    parser.add_argument("--data", default=str(DEFAULT_DATA_PATH))
+    parser.add_argument("--out", default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--params", default=None, help="JSON file with XGBoost params (e.g. a *.metrics.json)")
+    parser.add_argument("--chunk-size", type=int, default=200_000)
+    parser.add_argument("--memory", choices=["quantile", "external"], default="quantile",
+                        help="quantile = in-memory QuantileDMatrix, external = ExtMemQuantileDMatrix with disk cache")
+    parser.add_argument("--cache-dir", default="xgb-cache")
+    parser.add_argument("--max-bin", type=int, default=256)
+    parser.add_argument("--valid-fraction", type=float, default=0.1, help="rows used for early stopping")
+    parser.add_argument("--test-fraction", type=float, default=0.1,
+                        help="rows held out for the reported metrics, 0 = skip them")
+    parser.add_argument("--max-estimators", type=int, default=3000)
+    parser.add_argument("--early-stopping-rounds", type=int, default=50)
+    parser.add_argument("--n-jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.memory == "external" and not hasattr(xgb, "ExtMemQuantileDMatrix"):
+        parser.error(f"--memory external requires xgboost>=3.0 (ExtMemQuantileDMatrix), found {xgb.__version__}")
+    if args.valid_fraction + args.test_fraction >= 1:
+        parser.error("--valid-fraction + --test-fraction must be < 1")
+
+    started = time.perf_counter()
+    scaler, rows, dropped = fit_scaler(args.data, args.chunk_size)
+    print(f"Scanned {rows} rows ({dropped} dropped)")
+
+    sample, _ = next(iter_chunks(args.data, min(args.chunk_size, 1000)))
+    preprocessor = build_fitted_preprocessor(scaler, sample)
+    del sample
+
+    dtrain, dvalid = build_dmatrices(args, preprocessor)
+    gc.collect()
+
+    params = load_params(args.params)
+    num_boost_round = args.max_estimators if args.early_stopping_rounds else params["n_estimators"]
+    train_params = {k: v for k, v in params.items() if k != "n_estimators"}
+    booster = xgb.train(
+        {**train_params, "tree_method": "hist", "max_bin": args.max_bin, "objective": "reg:squarederror",
+         "nthread": args.n_jobs, "seed": args.seed},
+        dtrain,
+        num_boost_round=num_boost_round,
+        evals=[(dvalid, "valid")],
+        early_stopping_rounds=args.early_stopping_rounds or None,
+        verbose_eval=100,
+    )
+    holdout = {}
+    if args.test_fraction > 0:
+        test_iter = ChunkIter(args.data, args.chunk_size, preprocessor, "test",
+                              args.valid_fraction, args.test_fraction, args.seed)
+        holdout = holdout_metrics(booster, test_iter)
+        print("Holdout (test split):", json.dumps(holdout))
+
+    model = to_pipeline(booster, preprocessor, {**params, "n_estimators": booster.num_boosted_rounds()})
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(model, out)
+
+    metrics = {
+        "model": out.name,
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+        "data": str(args.data),
+        "rows": {"total": rows, "dropped": dropped, "train": dtrain.num_row(), "valid": dvalid.num_row(),
+                 "test": holdout.get("rows", 0)},
+        "streaming": {"chunk_size": args.chunk_size, "memory": args.memory, "max_bin": args.max_bin},
+        "params": {**params, "n_estimators": booster.num_boosted_rounds()},
+        "best_iteration": int(booster.best_iteration) if "best_iteration" in booster.attributes() else None,
+        "holdout": holdout,
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+    }
+    metrics_path(out).write_text(json.dumps(metrics, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"模型已儲存 {out}")
+
+
+if __name__ == "__main__":
+    main()
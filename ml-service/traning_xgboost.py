@@ -1,117 +1,281 @@
+"""
+traning_xgboost.py
+
+訓練保費預測 Pipeline (OneHot + StandardScaler + XGBoost)。
+
+    # 預設：隨機搜尋 30 組參數 × 5-fold CV，以所有 CPU 平行評估
+    python traning_xgboost.py --data ../dataset/insurance.csv --out ../models/insurance_xgb_model.pkl
+
+    # 不搜尋，只訓練預設參數
+    python traning_xgboost.py --search none
+
+每組參數在每個 fold 上以驗證 fold 做 early stopping，取各 fold best_iteration 的平均作為最終樹數。
+最終模型以 train split 訓練、以 holdout test split 評估，指標寫入模型旁的 *.metrics.json。
+"""
+
+import os
+import json
+import time
+import argparse
 import pandas as pd
 import numpy as np
 from sklearn.compose import ColumnTransformer
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 from xgboost import XGBRegressor
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 import joblib
 from pathlib import Path
 
-# ------------------------------------------------------------
-# 1. 讀取資料
-# ------------------------------------------------------------
 BASE_DIR = Path(__file__).resolve().parent
-data_path = BASE_DIR.parent / "dataset" / "insurance.csv"
-df = pd.read_csv(data_path)
-
-# ------------------------------------------------------------
-# 2. 資料前處理
-# ------------------------------------------------------------
-
-# sex → male:1 / female:0
-df["sex"] = df["sex"].map({"male": 1, "female": 0})
+DEFAULT_DATA_PATH = BASE_DIR.parent / "dataset" / "insurance.csv"
+DEFAULT_MODEL_PATH = BASE_DIR.parent / "models" / "insurance_xgb_model.pkl"
 
-# smoker → yes:1 / no:0
-df["smoker"] = df["smoker"].map({"yes": 1, "no": 0})
+FEATURES = ["age", "sex", "bmi", "children", "smoker",
+            "region", "bmi_smoker", "age_smoker", "bmi_age"]
+CATEGORICAL_FEATURES = ["region"]
+NUMERIC_FEATURES = [col for col in FEATURES if col not in CATEGORICAL_FEATURES]
 
 # region → 模擬成台灣地區
-region_map = {
+REGION_MAP = {
     "northeast": "Taipei",
     "northwest": "Taichung",
     "southeast": "Tainan",
     "southwest": "Kaohsiung",
 }
-df["region"] = df["region"].map(region_map)
 
-# charges 換 TWD
-df["charges"] = (df["charges"] * 30)
+# 原本固定的參數 (--search none 使用，也作為搜尋的第一組候選)
+DEFAULT_PARAMS = {
+    "n_estimators": 1000,
+    "learning_rate": 0.03,
+    "max_depth": 6,
+    "subsample": 0.9,
+    "colsample_bytree": 0.8,
+    "reg_lambda": 2,
+    "min_child_weight": 1,
+}
 
 # ------------------------------------------------------------
-# 3. Feature Engineering
+# 1. 讀取資料 + 前處理
 # ------------------------------------------------------------
-df["bmi_smoker"] = df["bmi"] * df["smoker"]
-df["age_smoker"] = df["age"] * df["smoker"]
-df["bmi_age"] = df["bmi"] * df["age"]
+def transform_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # sex → male:1 / female:0
+    df["sex"] = df["sex"].map({"male": 1, "female": 0})
+    # smoker → yes:1 / no:0
+    df["smoker"] = df["smoker"].map({"yes": 1, "no": 0})
+    df["region"] = df["region"].map(REGION_MAP)
+    # charges 換 TWD
+    df["charges"] = (df["charges"] * 30)
 
-# ------------------------------------------------------------
-# 4. 設定 X, y（log-transform）
-# ------------------------------------------------------------
-X = df[["age", "sex", "bmi", "children", "smoker",
-        "region", "bmi_smoker", "age_smoker", "bmi_age"]]
+    # Feature Engineering
+    df["bmi_smoker"] = df["bmi"] * df["smoker"]
+    df["age_smoker"] = df["age"] * df["smoker"]
+    df["bmi_age"] = df["bmi"] * df["age"]
+    return df
 
-y = np.log(df["charges"])   # log-transform
 
-categorical_features = ["region"]
-numeric_features = [col for col in X.columns if col != "region"]
+def load_dataset(path):
+    """回傳 X 與 log-transform 後的 y。"""
+    df = transform_frame(pd.read_csv(path))
+    return df[FEATURES], np.log(df["charges"])
 
 # ------------------------------------------------------------
-# 5. Preprocessor（OneHot + StandardScaler）
+# 2. Pipeline（OneHot + StandardScaler + XGBoost）
 # ------------------------------------------------------------
-preprocess = ColumnTransformer(
-    transformers=[
-        ("cat", OneHotEncoder(drop="first"), categorical_features),
-        ("num", StandardScaler(), numeric_features)
-    ]
-)
+def build_preprocessor(categories="auto"):
+    return ColumnTransformer(
+        transformers=[
+            ("cat", OneHotEncoder(drop="first", categories=categories), CATEGORICAL_FEATURES),
+            ("num", StandardScaler(), NUMERIC_FEATURES)
+        ]
+    )
 
-# ------------------------------------------------------------
-# 6. XGBoost
-# ------------------------------------------------------------
-model = Pipeline(steps=[
-    ("preprocess", preprocess),
-    ("regressor", XGBRegressor(
-        n_estimators=1000,
-        learning_rate=0.03,
-        max_depth=6,
-        subsample=0.9,
-        colsample_bytree=0.8,
-        reg_lambda=2,
-        random_state=42
-    ))
-])
 
-# ------------------------------------------------------------
-# 7. 訓練 / 測試
-# ------------------------------------------------------------
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42
-)
+def build_regressor(params, seed=42, n_threads=None, early_stopping_rounds=None):
+    return XGBRegressor(
+        **params,
+        tree_method="hist",
+        n_jobs=n_threads,
+        early_stopping_rounds=early_stopping_rounds,
+        random_state=seed
+    )
 
-model.fit(X_train, y_train)
 
-# ------------------------------------------------------------
-# 8. 預測
-# ------------------------------------------------------------
-y_pred_log = model.predict(X_test)
-y_pred = np.exp(y_pred_log)       # 還原成 TWD
-y_true = np.exp(y_test)
+def build_pipeline(params, seed=42, n_threads=None):
+    return Pipeline(steps=[
+        ("preprocess", build_preprocessor()),
+        ("regressor", build_regressor(params, seed, n_threads))
+    ])
 
 # ------------------------------------------------------------
-# 9. 評估
+# 3. 參數搜尋（隨機搜尋 × k-fold CV，process pool 平行）
 # ------------------------------------------------------------
-mae = mean_absolute_error(y_true, y_pred)
-rmse = np.sqrt(mean_squared_error(y_true, y_pred))
-r2 = r2_score(y_test, y_pred_log)
-
-print("MAE:", mae)
-print("RMSE:", rmse)
-print("R² Score:", r2)
-#%%
+SEARCH_SPACE = {
+    "learning_rate": ("log_uniform", 0.01, 0.2),
+    "max_depth": ("int", 2, 8),
+    "subsample": ("uniform", 0.6, 1.0),
+    "colsample_bytree": ("uniform", 0.5, 1.0),
+    "reg_lambda": ("log_uniform", 0.1, 20.0),
+    "min_child_weight": ("log_uniform", 0.5, 20.0),
+}
+
+
+def sample_params(rng, max_estimators):
+    params = {"n_estimators": max_estimators}
+    for name, (kind, low, high) in SEARCH_SPACE.items():
+        if kind == "int":
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == "log_uniform":
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            params[name] = float(rng.uniform(low, high))
+    return params
+
+
+# 每個 worker process 只在啟動時接收一次資料
+_worker_data = {}
+
+
+def _init_worker(X, y, folds, early_stopping_rounds, n_threads, seed):
+    _worker_data.update(X=X, y=y, folds=folds, early_stopping_rounds=early_stopping_rounds,
+                        n_threads=n_threads, seed=seed)
+
+
+def evaluate_candidate(params):
+    """在每個 fold 上訓練 (驗證 fold 做 early stopping)，回傳 log 空間 RMSE 與 TWD MAE。"""
+    d = _worker_data
+    X, y = d["X"], d["y"]
+    rmses, maes, best_iterations = [], [], []
+    for train_idx, valid_idx in d["folds"]:
+        # 前處理只以 train fold 擬合，避免資訊外洩
+        preprocessor = build_preprocessor()
+        X_train = preprocessor.fit_transform(X.iloc[train_idx])
+        X_valid = preprocessor.transform(X.iloc[valid_idx])
+        y_train, y_valid = y.iloc[train_idx], y.iloc[valid_idx]
+
+        regressor = build_regressor(params, d["seed"], d["n_threads"], d["early_stopping_rounds"])
+        regressor.fit(X_train, y_train, eval_set=[(X_valid, y_valid)], verbose=False)
+
+        pred = regressor.predict(X_valid, iteration_range=(0, regressor.best_iteration + 1))
+        rmses.append(float(np.sqrt(mean_squared_error(y_valid, pred))))
+        maes.append(float(mean_absolute_error(np.exp(y_valid), np.exp(pred))))
+        best_iterations.append(int(regressor.best_iteration) + 1)
+    return {
+        "params": params,
+        "cv_rmse_log": float(np.mean(rmses)),
+        "cv_rmse_log_std": float(np.std(rmses)),
+        "cv_mae": float(np.mean(maes)),
+        "best_iterations": best_iterations,
+    }
+
+
+def run_search(X, y, candidates, cv, n_jobs, early_stopping_rounds, seed):
+    folds = list(KFold(n_splits=cv, shuffle=True, random_state=seed).split(X))
+    n_workers = max(1, min(n_jobs, len(candidates)))
+    # 每個 process 分到的 XGBoost thread 數，避免超額訂閱 CPU
+    n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    init_args = (X, y, folds, early_stopping_rounds, n_threads, seed)
+
+    pool = None
+    if n_workers > 1:
+        pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=init_args)
+    else:
+        _init_worker(*init_args)
+
+    results = []
+    try:
+        mapper = pool.map if pool is not None else map
+        for i, result in enumerate(mapper(evaluate_candidate, candidates), 1):
+            results.append(result)
+            print(f"[{i}/{len(candidates)}] cv_rmse_log={result['cv_rmse_log']:.5f}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
+
 # ------------------------------------------------------------
-# 10. 儲存模型
+# 4. 評估
 # ------------------------------------------------------------
+def evaluate(model, X_test, y_test):
+    y_pred_log = model.predict(X_test)
+    y_pred = np.exp(y_pred_log)       # 還原成 TWD
+    y_true = np.exp(y_test)
+    return {
+        "mae": float(mean_absolute_error(y_true, y_pred)),
+        "rmse": float(np.sqrt(mean_squared_error(y_true, y_pred))),
+        "r2_log": float(r2_score(y_test, y_pred_log)),
+    }
+
+
+def metrics_path(model_path):
+    return Path(model_path).with_suffix(".metrics.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the insurance premium model")
+    parser.add_argument("--data", default=str(DEFAULT_DATA_PATH))
+    parser.add_argument("--out", default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--search", choices=["random", "none"], default="random")
+    parser.add_argument("--n-iter", type=int, default=30, help="number of random search candidates")
+    parser.add_argument("--cv", type=int, default=5, help="number of CV folds")
+    parser.add_argument("--n-jobs", type=int, default=os.cpu_count() or 1, help="parallel worker processes")
+    parser.add_argument("--max-estimators", type=int, default=3000, help="upper bound before early stopping")
+    parser.add_argument("--early-stopping-rounds", type=int, default=50)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    X, y = load_dataset(args.data)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=args.test_size, random_state=args.seed
+    )
+
+    search_results = []
+    if args.search == "none":
+        best_params = dict(DEFAULT_PARAMS)
+    else:
+        rng = np.random.default_rng(args.seed)
+        candidates = [{**DEFAULT_PARAMS, "n_estimators": args.max_estimators}]
+        candidates += [sample_params(rng, args.max_estimators) for _ in range(args.n_iter - 1)]
+        # CV 只用 train split，holdout test split 留給最終評估
+        search_results = run_search(X_train, y_train, candidates, args.cv, args.n_jobs,
+                                    args.early_stopping_rounds, args.seed)
+        search_results.sort(key=lambda r: r["cv_rmse_log"])
+        best = search_results[0]
+        best_params = {**best["params"], "n_estimators": int(round(np.mean(best["best_iterations"])))}
+        print("Best params:", json.dumps(best_params))
+        print(f"CV RMSE (log): {best['cv_rmse_log']:.5f} ± {best['cv_rmse_log_std']:.5f}")
+
+    model = build_pipeline(best_params, args.seed)
+    model.fit(X_train, y_train)
+    holdout = evaluate(model, X_test, y_test)
+
+    print("MAE:", holdout["mae"])
+    print("RMSE:", holdout["rmse"])
+    print("R² Score:", holdout["r2_log"])
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(model, out)
+
+    metrics = {
+        "model": out.name,
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+        "data": str(args.data),
+        "rows": {"train": len(X_train), "test": len(X_test)},
+        "search": {"method": args.search, "n_iter": len(search_results), "cv": args.cv},
+        "params": best_params,
+        "holdout": holdout,
+        "top_candidates": search_results[:5],
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+    }
+    metrics_path(out).write_text(json.dumps(metrics, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"模型已儲存 {out}")
+
 
-joblib.dump(model, "/Users/shangguankun/Downloads/Cathay/model/insurance_xgb_model.pkl")
-print("模型已儲存 insurance_xgb_model.pkl")
+if __name__ == "__main__":
+    main()
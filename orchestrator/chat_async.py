@@ -0,0 +1,293 @@
+"""
+chat_async.py
+
+ASGI 版本的 orchestrator (與 chat_with_llama.py 相同的 API 與對話流程)。
+所有對 Ollama / ML / RAG 的呼叫都是非阻塞的，並共用同一個 httpx.AsyncClient，
+單一行程即可同時處理數百個對話。
+
+啟動方式：
+    uvicorn chat_async:app --host 0.0.0.0 --port 5002
+"""
+
+import os
+import uuid
+import asyncio
+import contextlib
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from llm_backend import create_async_backend
+from downstream import ml_client, rag_client
+from chat_core import (
+    CHAT_LLM_MODE,
+    ML_PREDICT_FALLBACK,
+    apply_extracted,
+    apply_fast_path,
+    build_chat_prompt,
+    build_final_consultation_prompt,
+    build_merged_prompt,
+    build_recommendation_payload,
+    build_recommendation_query,
+    build_slot_prompt,
+    check_complete,
+    conversation_store,
+    extract_json,
+    get_conversation,
+    sse_event,
+    transform_products,
+)
+
+# ---------------------------
+# 設定 (環境變數)
+# ---------------------------
+# 各下游服務的同時請求上限
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 8))
+ML_CONCURRENCY = int(os.getenv("ML_CONCURRENCY", 64))
+RAG_CONCURRENCY = int(os.getenv("RAG_CONCURRENCY", 32))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 200))
+
+# lifespan 啟動時建立
+http_client = None
+llm = None
+llm_limit = None
+ml_limit = None
+rag_limit = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global http_client, llm, llm_limit, ml_limit, rag_limit
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS
+        )
+    )
+    llm = create_async_backend(http_client)
+    llm_limit = asyncio.Semaphore(LLM_CONCURRENCY)
+    ml_limit = asyncio.Semaphore(ML_CONCURRENCY)
+    rag_limit = asyncio.Semaphore(RAG_CONCURRENCY)
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+
+# ---------------------------
+# 呼叫 Ollama
+# ---------------------------
+async def call_ollama(prompt_text):
+    async with llm_limit:
+        return await llm.generate(prompt_text)
+
+
+async def stream_ollama(prompt_text):
+    async with llm_limit:
+        async for token in llm.stream(prompt_text):
+            yield token
+
+# ---------------------------
+# ML Predict 呼叫
+# ---------------------------
+async def call_ml_predict(slots):
+    try:
+        async with ml_limit:
+            return await ml_client.async_post_json(http_client, "/predict", slots)
+    except Exception as e:
+        print(f"ML Predict Error: {e}")
+        return dict(ML_PREDICT_FALLBACK)
+
+# ---------------------------
+# Recommendation Service 呼叫
+# ---------------------------
+async def call_recommendation_service(user_query, age=None, smoker=None):
+    payload = build_recommendation_payload(user_query, age, smoker)
+    try:
+        async with rag_limit:
+            res = await rag_client.async_post_json(http_client, "/recommend_products", payload)
+        return res.get("products", [])
+    except Exception as e:
+        print(f"Recommendation Error: {e}")
+        return []
+
+# ---------------------------
+# 對話流程
+# ---------------------------
+async def load_conversation(conversation_id):
+    # Redis 等同步儲存放到 thread 執行，避免阻塞 event loop
+    return await asyncio.to_thread(get_conversation, conversation_id)
+
+
+async def save_conversation(conversation_id, current_slots):
+    await asyncio.to_thread(conversation_store.save, conversation_id, current_slots)
+
+
+async def llm_fill_slots(user_message, current_slots, llm_fields):
+    slot_prompt = build_slot_prompt(user_message, current_slots, llm_fields)
+    llm_extracted = extract_json(await call_ollama(slot_prompt)) or {}
+    apply_extracted(current_slots, {k: llm_extracted.get(k) for k in llm_fields})
+
+
+async def process_turn(user_message, current_slots):
+    """chat_with_llama.process_turn 的 async 版本，回傳 (complete, reply)。"""
+    llm_fields = apply_fast_path(user_message, current_slots)
+    if not llm_fields or CHAT_LLM_MODE == "sequential" or check_complete(current_slots):
+        if llm_fields:
+            await llm_fill_slots(user_message, current_slots, llm_fields)
+        return check_complete(current_slots), None
+
+    if CHAT_LLM_MODE == "merged":
+        merged_prompt = build_merged_prompt(user_message, current_slots, llm_fields)
+        merged_output = extract_json(await call_ollama(merged_prompt)) or {}
+        llm_extracted = merged_output.get("slots") or {}
+        apply_extracted(current_slots, {k: llm_extracted.get(k) for k in llm_fields})
+        complete = check_complete(current_slots)
+        reply = merged_output.get("reply")
+        if complete or not isinstance(reply, str) or not reply.strip():
+            return complete, None
+        return complete, reply.strip()
+
+    # speculative
+    speculative_prompt = build_chat_prompt(user_message, current_slots)
+    reply_task = asyncio.create_task(call_ollama(speculative_prompt))
+    try:
+        await llm_fill_slots(user_message, current_slots, llm_fields)
+    except BaseException:
+        # 抽取失敗 (或請求被取消) 時不留下仍在生成的 task
+        reply_task.cancel()
+        raise
+    complete = check_complete(current_slots)
+
+    if complete or build_chat_prompt(user_message, current_slots) != speculative_prompt:
+        # 取消 task 會關閉對 Ollama 的連線，Ollama 隨即停止生成
+        reply_task.cancel()
+        return complete, None
+    return complete, (await reply_task).strip()
+
+
+async def run_consultation(current_slots):
+    """資料收集完成後以 asyncio.gather 同時呼叫 ML 與 RAG，回傳 (預估價格, 推薦產品)。"""
+    slots_for_predict = {k: v["value"] for k, v in current_slots.items()}
+    user_query_summary = build_recommendation_query(slots_for_predict)
+
+    prediction, recommended_products = await asyncio.gather(
+        call_ml_predict(slots_for_predict),
+        call_recommendation_service(user_query_summary, slots_for_predict['age'], slots_for_predict['smoker'])
+    )
+
+    transformed_products = transform_products(recommended_products)
+    charge = prediction.get("predicted_charge", "N/A")
+    return charge, transformed_products
+
+# ---------------------------
+# Chat API
+# ---------------------------
+async def chat(request):
+    data = await request.json()
+    user_message = data.get("message", "")
+    conversation_id = data.get("conversation_id") or str(uuid.uuid4())
+
+    current_slots = await load_conversation(conversation_id)
+    complete, chat_reply = await process_turn(user_message, current_slots)
+    await save_conversation(conversation_id, current_slots)
+
+    if complete:
+        charge, transformed_products = await run_consultation(current_slots)
+        final_prompt = build_final_consultation_prompt(charge, transformed_products)
+        final_consultant_reply = (await call_ollama(final_prompt)).strip()
+
+        return JSONResponse({
+            "reply": final_consultant_reply,
+            "slots": {k: v["value"] for k, v in current_slots.items()},
+            "structured_data": {
+                "predicted_price": charge,
+                "recommendations": transformed_products
+            },
+            "complete": True,
+            "conversation_id": conversation_id
+        })
+
+    if chat_reply is None:
+        chat_prompt = build_chat_prompt(user_message, current_slots)
+        chat_reply = (await call_ollama(chat_prompt)).strip()
+
+    return JSONResponse({
+        "reply": chat_reply,
+        "slots": {k: v["value"] for k, v in current_slots.items()},
+        "complete": False,
+        "conversation_id": conversation_id
+    })
+
+# ---------------------------
+# Chat Streaming API (Server-Sent Events)
+# ---------------------------
+async def chat_stream(request):
+    data = await request.json()
+    user_message = data.get("message", "")
+    conversation_id = data.get("conversation_id") or str(uuid.uuid4())
+
+    async def generate():
+        yield sse_event("start", {"conversation_id": conversation_id})
+
+        current_slots = await load_conversation(conversation_id)
+        complete, chat_reply = await process_turn(user_message, current_slots)
+        await save_conversation(conversation_id, current_slots)
+
+        structured_data = None
+        if complete:
+            charge, transformed_products = await run_consultation(current_slots)
+            structured_data = {
+                "predicted_price": charge,
+                "recommendations": transformed_products
+            }
+            prompt = build_final_consultation_prompt(charge, transformed_products)
+        else:
+            prompt = build_chat_prompt(user_message, current_slots)
+
+        tokens = []
+        try:
+            if chat_reply is not None:
+                tokens.append(chat_reply)
+                yield sse_event("token", {"token": chat_reply})
+            else:
+                async for token in stream_ollama(prompt):
+                    tokens.append(token)
+                    yield sse_event("token", {"token": token})
+        except Exception as e:
+            print(f"LLM Streaming Error: {e}")
+            yield sse_event("error", {"error": str(e)})
+
+        result = {
+            "reply": "".join(tokens).strip(),
+            "slots": {k: v["value"] for k, v in current_slots.items()},
+            "complete": complete,
+            "conversation_id": conversation_id
+        }
+        if structured_data is not None:
+            result["structured_data"] = structured_data
+        yield sse_event("done", result)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat_stream", chat_stream, methods=["POST"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5002)
@@ -0,0 +1,269 @@
+"""
+chat_core.py
+
+chat_with_llama.py (Flask) 與 chat_async.py (ASGI) 共用的對話邏輯：
+槽位結構、prompt、JSON 抽取、槽位更新、諮詢查詢組裝與對話狀態儲存。
+只包含純函式與設定，不建立 web app、LLM 後端或 thread pool。
+"""
+
+import os
+import json
+import re
+from slot_extractor import extract_slots
+from conversation_store import create_store
+
+# 是否先以規則抽取槽位，省下大多數回合的 Slot-Filling LLM 呼叫
+SLOT_FAST_PATH = os.getenv("SLOT_FAST_PATH", "1") == "1"
+
+# 每回合的 LLM 呼叫方式：sequential / merged / speculative
+CHAT_LLM_MODE = os.getenv("CHAT_LLM_MODE", "sequential")
+
+# 用於儲存所有活躍對話的狀態 (CONVERSATION_STORE=memory / redis)。
+conversation_store = create_store()
+
+# 單一使用者槽位的標準結構 (初始化模板)
+SLOT_TEMPLATE = {
+    "age": {"value": None},
+    "sex": {"value": None},
+    "smoker": {"value": None},
+    "children": {"value": None},
+    "region": {"value": None},
+    "height": {"value": None},
+    "weight": {"value": None},
+    "bmi": {"value": None}
+}
+
+# ---------------------------
+# Slot-Filling Prompt 
+# ---------------------------
+SLOT_FIELD_SPECS = {
+    "age": "number",
+    "sex": "male/female",
+    "smoker": "yes/no",
+    "children": "number",
+    "region": "string (如 台北市、高雄市)",
+    "height": "number（公分）",
+    "weight": "number（公斤）"
+}
+
+def build_slot_prompt(user_message, current_slots, fields=None):
+    # fields: 只要求 LLM 抽取這些欄位 (規則抽取器已處理的欄位不再重複)
+    fields = fields or list(SLOT_FIELD_SPECS)
+    field_lines = "\n".join(f"{k}: {SLOT_FIELD_SPECS[k]}" for k in fields)
+    known_data = {k: v["value"] for k, v in current_slots.items()}
+    return f"""
+你是一個保險資料抽取助手，請從使用者訊息中提取以下欄位：
+
+{field_lines}
+
+⚠ 規則：
+1. 只能輸出純 JSON，不能加文字。
+2. 若使用者明確提供資訊，就填入。
+3. 若未提到任何欄位，請保持為 null。
+4. 不要自行詢問問題。
+
+使用者訊息: "{user_message}"
+目前資料: {json.dumps(known_data, ensure_ascii=False)}
+"""
+
+# ---------------------------
+# 自動計算 BMI
+# ---------------------------
+def compute_bmi_if_possible(current_slots):
+    h = current_slots["height"]["value"]
+    w = current_slots["weight"]["value"]
+
+    if h is None or w is None:
+        return None
+
+    try:
+        h_m = float(h) / 100.0
+        bmi = round(float(w) / (h_m ** 2), 2)
+        current_slots["bmi"]["value"] = bmi 
+        return bmi
+    except:
+        return None
+
+# ---------------------------
+# Chat Prompt 
+# ---------------------------
+def build_chat_prompt(user_message, current_slots):
+    known_data = {k: v["value"] for k, v in current_slots.items()}
+    missing = [k for k, v in known_data.items() if v is None and k not in ["bmi"]]
+
+    chinese_keys = {
+        "age": "年齡", "sex": "性別", "smoker": "是否吸菸",
+        "children": "孩子數量", "region": "居住地",
+        "height": "身高", "weight": "體重"
+    }
+    
+    if missing:
+        missing_chinese = [chinese_keys.get(k, k) for k in missing]
+        missing_prompt_text = f"你目前還缺少這些重要資訊：{', '.join(missing_chinese)}。"
+    else:
+        missing_prompt_text = "目前所有欄位資訊已收集完畢。"
+
+    return f"""
+你是一位友善、親切且專業的保險規劃助理。
+
+你已經知道使用者提供的資料是：
+{json.dumps(known_data, ensure_ascii=False, indent=2)}
+
+--- 任務要求 ---
+1. **語氣：** 使用自然、親切、口語化的語氣回覆使用者。
+2. **提問依據：** 你的提問必須基於以下你缺少的資訊：
+    {missing_prompt_text}
+3. **格式限制：** 你的回覆必須是 **一段連續的、純文本**。
+4. **禁止符號：** **嚴禁** 使用任何 Markdown 格式符號來列出問題，例如：**星號 (\*)、列點符號 (-)、數字編號等**。請使用自然語句提問。
+5. **不要重複** 已取得的資訊。
+
+請根據使用者訊息和缺少的資訊，生成一段自然的回覆。
+使用者訊息: "{user_message}"
+"""
+
+# ---------------------------
+# 合併 Prompt (一次生成同時抽取槽位與回覆)
+# ---------------------------
+def build_merged_prompt(user_message, current_slots, fields):
+    field_lines = "\n".join(f"{k}: {SLOT_FIELD_SPECS[k]}" for k in fields)
+    known_data = {k: v["value"] for k, v in current_slots.items()}
+    return f"""
+你是一位友善、親切且專業的保險規劃助理，同時負責從使用者訊息中抽取資料。
+
+請從使用者訊息中提取以下欄位：
+{field_lines}
+
+你已經知道使用者提供的資料是：
+{json.dumps(known_data, ensure_ascii=False, indent=2)}
+
+⚠ 規則：
+1. 只能輸出純 JSON，格式為 {{"slots": {{欄位: 值}}, "reply": "回覆文字"}}，不能加其他文字。
+2. slots：若使用者明確提供資訊就填入，未提到的欄位保持為 null，不要自行猜測。
+3. reply：結合目前資料與本次抽取結果，用自然、親切、口語化的繁體中文，詢問仍然缺少的資訊 (age, sex, smoker, children, region, height, weight)。
+4. reply 必須是一段連續的純文本，嚴禁使用 Markdown、列點符號或數字編號，也不要重複已取得的資訊。
+
+使用者訊息: "{user_message}"
+"""
+
+# ------------------------------------
+# 最終諮詢 Prompt
+# ------------------------------------
+def build_final_consultation_prompt(price, products):
+    """
+    生成最終的完整回覆：包含價格宣告與產品推薦引導，並嚴格控制輸出格式。
+    """
+
+    return f"""
+你是 **專業且友善的保險顧問 AI 助理**。
+
+--- 任務與輸出要求 (請嚴格遵守) ---
+1. **角色與語氣：** 專業、親切、自然、口語化，使用繁體中文。
+2. **輸出格式：** 最終輸出 **只能** 是一段連續的、直接給客戶看的文字回覆。
+3. **禁止輸出：** 嚴禁輸出任何分隔符、標題、列點符號、或任何形式的 **自我反思**、**解釋你的任務**、或 **重複 Prompt 內容**。
+
+--- 內容要求 (必須包含以下資訊) ---
+1. **開場/分析結果：** 感謝客戶提供的資訊，並告知系統已完成分析。
+2. **預估價格宣告：** 簡潔明確地告知預估年保費約為 **{price} 元**。
+3. **法律提醒：** 務必提醒客戶這只是基於模型的 **估計值**，**不具法律效力**，實際保費會根據最終核保結果和產品條款確定。
+4. **產品引導：** 告知客戶系統已經推薦了最適合的三款相關產品，可以點擊下方連結查看詳情。
+
+請根據上述要求，立即開始生成對客戶的完整文字回覆。
+"""
+
+# ---------------------------
+# 抽出 JSON
+# ---------------------------
+def extract_json(text):
+    try:
+        # 嘗試直接解析
+        if text.strip().startswith("{") and text.strip().endswith("}"):
+            return json.loads(text)
+        # 使用正則表達式尋找第一個和最後一個花括號之間的內容
+        match = re.search(r'\{[\s\S]*\}', text)
+        if match:
+            return json.loads(match.group(0))
+    except Exception as e:
+        print(f"JSON extraction failed: {e}")
+        return None
+    return None
+
+# ---------------------------
+# 諮詢 (ML + RAG) 的請求與回應
+# ---------------------------
+ML_PREDICT_FALLBACK = {"predicted_charge": "無法計算"}
+
+
+def build_recommendation_query(slots_for_predict):
+    """組合 RAG 查詢字串。"""
+    user_query_summary = f"客戶年齡 {slots_for_predict['age']}, 性別 {slots_for_predict['sex']}, BMI {slots_for_predict['bmi']}, {slots_for_predict['region']}人"
+    if slots_for_predict['smoker'] == 'yes':
+        user_query_summary += ", 有抽菸習慣"
+    return user_query_summary
+
+
+def build_recommendation_payload(user_query, age=None, smoker=None):
+    # 帶入客戶年齡，RAG 端會排除無法投保的商品；吸菸與否供 RAG 端重新排序 (有啟用時) 使用
+    payload = {"query": user_query, "top_k": 3}
+    if age is not None:
+        payload["age"] = age
+    if smoker in ("yes", "no"):
+        payload["smoker"] = smoker
+    return payload
+
+
+def transform_products(recommended_products):
+    """補上前端使用的 Summary / URL 欄位。"""
+    return [
+        {
+            **p,
+            "Summary": p.get("summary", p.get("Summary")),
+            "URL": p.get("url", p.get("URL"))
+        }
+        for p in recommended_products
+    ]
+
+# ---------------------------
+# 對話狀態與槽位更新
+# ---------------------------
+def get_conversation(conversation_id):
+    # 獲取或初始化該對話的槽位狀態 (修改後需呼叫 conversation_store.save 寫回)
+    current_slots = conversation_store.get(conversation_id)
+    if current_slots is None:
+        # 使用 json 往返進行深拷貝，確保每個對話都有獨立的槽位字典
+        current_slots = json.loads(json.dumps(SLOT_TEMPLATE))
+    return current_slots
+
+
+def apply_extracted(current_slots, extracted):
+    # 使用 current_slots 進行更新
+    for key in current_slots:
+        if key in extracted and extracted[key] is not None and extracted[key] != "null":
+            current_slots[key]["value"] = extracted[key]
+
+
+def check_complete(current_slots):
+    # 2. 自動計算 BMI
+    compute_bmi_if_possible(current_slots)
+
+    # 3. 檢查必填欄位
+    required_fields = ["age", "sex", "smoker", "children", "region", "bmi"]
+    return all(current_slots[k]["value"] is not None for k in required_fields)
+
+
+def apply_fast_path(user_message, current_slots):
+    """規則抽取並寫入槽位，回傳仍需交給 LLM 抽取的欄位 (不需要時為空 list)。"""
+    extracted, needs_llm = ({}, True)
+    if SLOT_FAST_PATH:
+        extracted, needs_llm = extract_slots(user_message)
+    apply_extracted(current_slots, extracted)
+
+    if not needs_llm:
+        return []
+    return [k for k in SLOT_FIELD_SPECS if k not in extracted]
+
+
+# ---------------------------
+# Server-Sent Events
+# ---------------------------
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
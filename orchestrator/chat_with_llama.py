@@ -1,201 +1,139 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import subprocess
-import json
-import requests
-import re
+import os
 import uuid 
 from concurrent.futures import ThreadPoolExecutor 
+from llm_backend import create_backend
+from downstream import ml_client, rag_client
+from chat_core import (
+    CHAT_LLM_MODE,
+    ML_PREDICT_FALLBACK,
+    apply_extracted,
+    apply_fast_path,
+    build_chat_prompt,
+    build_final_consultation_prompt,
+    build_merged_prompt,
+    build_recommendation_payload,
+    build_recommendation_query,
+    build_slot_prompt,
+    check_complete,
+    conversation_store,
+    extract_json,
+    get_conversation,
+    sse_event,
+    transform_products,
+)
 
 app = Flask(__name__)
 CORS(app)
 
-# 用於儲存所有活躍對話的狀態。
-conversation_store = {} 
-
-# 單一使用者槽位的標準結構 (初始化模板)
-SLOT_TEMPLATE = {
-    "age": {"value": None},
-    "sex": {"value": None},
-    "smoker": {"value": None},
-    "children": {"value": None},
-    "region": {"value": None},
-    "height": {"value": None},
-    "weight": {"value": None},
-    "bmi": {"value": None}
-}
+# LLM 後端：預設使用 keep-alive 的 Ollama HTTP API，失敗時退回 `ollama run`
+llm = create_backend()
 
-# ---------------------------
-# Slot-Filling Prompt 
-# ---------------------------
-def build_slot_prompt(user_message, current_slots):
-    known_data = {k: v["value"] for k, v in current_slots.items()}
-    return f"""
-你是一個保險資料抽取助手，請從使用者訊息中提取以下欄位：
-
-age: number
-sex: male/female
-smoker: yes/no
-children: number
-region: string (如 台北市、高雄市)
-height: number（公分）
-weight: number（公斤）
-
-⚠ 規則：
-1. 只能輸出純 JSON，不能加文字。
-2. 若使用者明確提供資訊，就填入。
-3. 若未提到任何欄位，請保持為 null。
-4. 不要自行詢問問題。
-
-使用者訊息: "{user_message}"
-目前資料: {json.dumps(known_data, ensure_ascii=False)}
-"""
-
-# ---------------------------
-# 自動計算 BMI
-# ---------------------------
-def compute_bmi_if_possible(current_slots):
-    h = current_slots["height"]["value"]
-    w = current_slots["weight"]["value"]
-
-    if h is None or w is None:
-        return None
-
-    try:
-        h_m = float(h) / 100.0
-        bmi = round(float(w) / (h_m ** 2), 2)
-        current_slots["bmi"]["value"] = bmi 
-        return bmi
-    except:
-        return None
-
-# ---------------------------
-# Chat Prompt 
-# ---------------------------
-def build_chat_prompt(user_message, current_slots):
-    known_data = {k: v["value"] for k, v in current_slots.items()}
-    missing = [k for k, v in known_data.items() if v is None and k not in ["bmi"]]
-
-    chinese_keys = {
-        "age": "年齡", "sex": "性別", "smoker": "是否吸菸",
-        "children": "孩子數量", "region": "居住地",
-        "height": "身高", "weight": "體重"
-    }
-    
-    if missing:
-        missing_chinese = [chinese_keys.get(k, k) for k in missing]
-        missing_prompt_text = f"你目前還缺少這些重要資訊：{', '.join(missing_chinese)}。"
-    else:
-        missing_prompt_text = "目前所有欄位資訊已收集完畢。"
-
-    return f"""
-你是一位友善、親切且專業的保險規劃助理。
-
-你已經知道使用者提供的資料是：
-{json.dumps(known_data, ensure_ascii=False, indent=2)}
-
---- 任務要求 ---
-1. **語氣：** 使用自然、親切、口語化的語氣回覆使用者。
-2. **提問依據：** 你的提問必須基於以下你缺少的資訊：
-    {missing_prompt_text}
-3. **格式限制：** 你的回覆必須是 **一段連續的、純文本**。
-4. **禁止符號：** **嚴禁** 使用任何 Markdown 格式符號來列出問題，例如：**星號 (\*)、列點符號 (-)、數字編號等**。請使用自然語句提問。
-5. **不要重複** 已取得的資訊。
-
-請根據使用者訊息和缺少的資訊，生成一段自然的回覆。
-使用者訊息: "{user_message}"
-"""
-
-# ------------------------------------
-# 最終諮詢 Prompt
-# ------------------------------------
-def build_final_consultation_prompt(price, products):
-    """
-    生成最終的完整回覆：包含價格宣告與產品推薦引導，並嚴格控制輸出格式。
-    """
-
-    return f"""
-你是 **專業且友善的保險顧問 AI 助理**。
-
---- 任務與輸出要求 (請嚴格遵守) ---
-1. **角色與語氣：** 專業、親切、自然、口語化，使用繁體中文。
-2. **輸出格式：** 最終輸出 **只能** 是一段連續的、直接給客戶看的文字回覆。
-3. **禁止輸出：** 嚴禁輸出任何分隔符、標題、列點符號、或任何形式的 **自我反思**、**解釋你的任務**、或 **重複 Prompt 內容**。
-
---- 內容要求 (必須包含以下資訊) ---
-1. **開場/分析結果：** 感謝客戶提供的資訊，並告知系統已完成分析。
-2. **預估價格宣告：** 簡潔明確地告知預估年保費約為 **{price} 元**。
-3. **法律提醒：** 務必提醒客戶這只是基於模型的 **估計值**，**不具法律效力**，實際保費會根據最終核保結果和產品條款確定。
-4. **產品引導：** 告知客戶系統已經推薦了最適合的三款相關產品，可以點擊下方連結查看詳情。
-
-請根據上述要求，立即開始生成對客戶的完整文字回覆。
-"""
+# speculative 模式 (CHAT_LLM_MODE) 先行生成回覆用的 thread pool
+llm_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_SPECULATIVE_WORKERS", 8)))
 
 # ---------------------------
 # 呼叫 Ollama
 # ---------------------------
 def call_ollama(prompt_text):
-    process = subprocess.Popen(
-        ["ollama", "run", "llama3.1:8b"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    out, err = process.communicate(prompt_text)
-    return out
-
-# ---------------------------
-# 抽出 JSON
-# ---------------------------
-def extract_json(text):
-    try:
-        # 嘗試直接解析
-        if text.strip().startswith("{") and text.strip().endswith("}"):
-            return json.loads(text)
-        # 使用正則表達式尋找第一個和最後一個花括號之間的內容
-        match = re.search(r'\{[\s\S]*\}', text)
-        if match:
-            return json.loads(match.group(0))
-    except Exception as e:
-        print(f"JSON extraction failed: {e}")
-        return None
-    return None
+    return llm.generate(prompt_text)
 
 # ---------------------------
 # ML Predict 呼叫
 # ---------------------------
 def call_ml_predict(slots):
     try:
-        res = requests.post(
-            "http://localhost:5001/predict",
-            json=slots,
-            timeout=5
-        )
-        res.raise_for_status()
-        return res.json()
+        return ml_client.post_json("/predict", slots)
     except Exception as e:
         print(f"ML Predict Error: {e}")
-        return {"predicted_charge": "無法計算"}
+        return dict(ML_PREDICT_FALLBACK)
 
 # ---------------------------
 # Recommendation Service 呼叫
 # ---------------------------
-def call_recommendation_service(user_query):
+def call_recommendation_service(user_query, age=None, smoker=None):
+    payload = build_recommendation_payload(user_query, age, smoker)
     try:
-        res = requests.post(
-            "http://localhost:5003/recommend_products",
-            json={"query": user_query, "top_k": 3},
-            timeout=5
-        )
-        res.raise_for_status()
-        if res.status_code == 200:
-            return res.json().get("products", [])
-        return []
+        res = rag_client.post_json("/recommend_products", payload)
+        return res.get("products", [])
     except Exception as e:
         print(f"Recommendation Error: {e}")
         return []
 
+# ---------------------------
+# 對話流程
+# ---------------------------
+def llm_fill_slots(user_message, current_slots, llm_fields):
+    slot_prompt = build_slot_prompt(user_message, current_slots, llm_fields)
+    slot_output = call_ollama(slot_prompt)
+    llm_extracted = extract_json(slot_output) or {}
+    apply_extracted(current_slots, {k: llm_extracted.get(k) for k in llm_fields})
+
+
+def process_turn(user_message, current_slots):
+    """
+    執行 Slot-Filling (規則 + LLM) 並計算 BMI，依 CHAT_LLM_MODE 決定 LLM 呼叫方式。
+    回傳 (complete, reply)。
+    reply 為已生成的追問回覆；為 None 時由呼叫端以 build_chat_prompt 生成。
+
+    - sequential: 先抽取槽位，再另外生成回覆
+    - merged: 一次生成同時輸出槽位 JSON 與追問回覆
+    - speculative: 抽取槽位的同時，以規則抽取後的狀態先行生成回覆；
+                   若 LLM 抽取改變了回覆的依據則捨棄該回覆
+    """
+    llm_fields = apply_fast_path(user_message, current_slots)
+    if not llm_fields or CHAT_LLM_MODE == "sequential" or check_complete(current_slots):
+        if llm_fields:
+            llm_fill_slots(user_message, current_slots, llm_fields)
+        return check_complete(current_slots), None
+
+    if CHAT_LLM_MODE == "merged":
+        merged_output = extract_json(call_ollama(build_merged_prompt(user_message, current_slots, llm_fields))) or {}
+        llm_extracted = merged_output.get("slots") or {}
+        apply_extracted(current_slots, {k: llm_extracted.get(k) for k in llm_fields})
+        complete = check_complete(current_slots)
+        reply = merged_output.get("reply")
+        if complete or not isinstance(reply, str) or not reply.strip():
+            return complete, None
+        return complete, reply.strip()
+
+    # speculative
+    speculative_prompt = build_chat_prompt(user_message, current_slots)
+    future_reply = llm_executor.submit(call_ollama, speculative_prompt)
+    try:
+        llm_fill_slots(user_message, current_slots, llm_fields)
+    except BaseException:
+        # 抽取失敗時不留下仍在排隊的生成工作
+        future_reply.cancel()
+        raise
+    complete = check_complete(current_slots)
+
+    if complete or build_chat_prompt(user_message, current_slots) != speculative_prompt:
+        # 槽位已改變：捨棄先行生成的回覆 (已送出的請求無法中斷，只是不採用)
+        future_reply.cancel()
+        return complete, None
+    return complete, future_reply.result().strip()
+
+
+def run_consultation(current_slots):
+    """資料收集完成後呼叫 ML 與 RAG，回傳 (預估價格, 推薦產品)。"""
+    slots_for_predict = {k: v["value"] for k, v in current_slots.items()}
+    user_query_summary = build_recommendation_query(slots_for_predict)
+
+    # A & B. 使用 ThreadPoolExecutor 進行並行呼叫 (ML Predict & RAG)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        future_price = executor.submit(call_ml_predict, slots_for_predict)
+        future_recom = executor.submit(call_recommendation_service, user_query_summary, slots_for_predict['age'], slots_for_predict['smoker'])
+        
+        prediction = future_price.result()
+        recommended_products = future_recom.result()
+
+    transformed_products = transform_products(recommended_products)
+    charge = prediction.get("predicted_charge", "N/A")
+    return charge, transformed_products
+
+
 # ---------------------------
 # Chat API
 # ---------------------------
@@ -208,59 +146,15 @@ def chat():
     if not conversation_id:
         conversation_id = str(uuid.uuid4())
     
-    # 獲取或初始化該對話的槽位狀態
-    if conversation_id not in conversation_store:
-        # 使用 .copy() 進行深拷貝，確保每個對話都有獨立的槽位字典
-        conversation_store[conversation_id] = json.loads(json.dumps(SLOT_TEMPLATE)) 
-    
-    current_slots = conversation_store[conversation_id] # 取得當前對話的狀態
-
-    # 1. Slot-Filling 
-    slot_prompt = build_slot_prompt(user_message, current_slots)
-    slot_output = call_ollama(slot_prompt)
-    extracted = extract_json(slot_output)
-
-    if extracted:
-        # 使用 current_slots 進行更新
-        for key in current_slots:
-            if key in extracted and extracted[key] is not None and extracted[key] != "null":
-                current_slots[key]["value"] = extracted[key]
-
-    # 2. 自動計算 BMI
-    compute_bmi_if_possible(current_slots)
-
-    # 3. 檢查必填欄位
-    required_fields = ["age", "sex", "smoker", "children", "region", "bmi"]
-    complete = all(current_slots[k]["value"] is not None for k in required_fields)
+    current_slots = get_conversation(conversation_id) # 取得當前對話的狀態
+    complete, chat_reply = process_turn(user_message, current_slots)
+    conversation_store.save(conversation_id, current_slots)
 
     # ---------------------------------------------------------
     # 4. 資料收集完成後的流程
     # ---------------------------------------------------------
     if complete:
-        slots_for_predict = {k: v["value"] for k, v in current_slots.items()}
-        
-        # 組合 RAG 查詢字串
-        user_query_summary = f"客戶年齡 {slots_for_predict['age']}, 性別 {slots_for_predict['sex']}, BMI {slots_for_predict['bmi']}, {slots_for_predict['region']}人"
-        if slots_for_predict['smoker'] == 'yes':
-            user_query_summary += ", 有抽菸習慣"
-
-        # A & B. 使用 ThreadPoolExecutor 進行並行呼叫 (ML Predict & RAG)
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_price = executor.submit(call_ml_predict, slots_for_predict)
-            future_recom = executor.submit(call_recommendation_service, user_query_summary)
-            
-            prediction = future_price.result()
-            recommended_products = future_recom.result()
-
-        transformed_products = []
-        for p in recommended_products:
-            transformed_products.append({
-                **p, 
-                "Summary": p.get("summary", p.get("Summary")), 
-                "URL": p.get("url", p.get("URL"))              
-                })
-        
-        charge = prediction.get("predicted_charge", "N/A")
+        charge, transformed_products = run_consultation(current_slots)
 
         # C. 單次 Llama 生成完整回覆
         final_prompt = build_final_consultation_prompt(charge, transformed_products)
@@ -279,8 +173,9 @@ def chat():
         })
         
     # 5. 資料尚未完成：繼續引導聊天
-    chat_prompt = build_chat_prompt(user_message, current_slots) 
-    chat_reply = call_ollama(chat_prompt).strip()
+    if chat_reply is None:
+        chat_prompt = build_chat_prompt(user_message, current_slots) 
+        chat_reply = call_ollama(chat_prompt).strip()
 
     return jsonify({
         "reply": chat_reply,
@@ -289,6 +184,67 @@ def chat():
         "conversation_id": conversation_id 
     })
 
+# ---------------------------
+# Chat Streaming API (Server-Sent Events)
+# ---------------------------
+@app.route("/chat_stream", methods=["POST"])
+def chat_stream():
+    """
+    與 /chat 相同的流程，但以 SSE 逐 token 回傳回覆：
+    start (conversation_id) → token (多次) → done (完整回覆、slots、structured_data)
+    """
+    data = request.json
+    user_message = data.get("message", "")
+
+    conversation_id = data.get("conversation_id")
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+
+    def generate():
+        yield sse_event("start", {"conversation_id": conversation_id})
+
+        current_slots = get_conversation(conversation_id)
+        complete, chat_reply = process_turn(user_message, current_slots)
+        conversation_store.save(conversation_id, current_slots)
+
+        structured_data = None
+        if complete:
+            charge, transformed_products = run_consultation(current_slots)
+            structured_data = {
+                "predicted_price": charge,
+                "recommendations": transformed_products
+            }
+            prompt = build_final_consultation_prompt(charge, transformed_products)
+        else:
+            prompt = build_chat_prompt(user_message, current_slots)
+
+        tokens = []
+        # merged / speculative 模式已生成好的回覆直接以單一 token 送出
+        token_source = [chat_reply] if chat_reply is not None else llm.stream(prompt)
+        try:
+            for token in token_source:
+                tokens.append(token)
+                yield sse_event("token", {"token": token})
+        except Exception as e:
+            print(f"LLM Streaming Error: {e}")
+            yield sse_event("error", {"error": str(e)})
+
+        result = {
+            "reply": "".join(tokens).strip(),
+            "slots": {k: v["value"] for k, v in current_slots.items()},
+            "complete": complete,
+            "conversation_id": conversation_id
+        }
+        if structured_data is not None:
+            result["structured_data"] = structured_data
+        yield sse_event("done", result)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ---------------------------
 # Run
 # ---------------------------
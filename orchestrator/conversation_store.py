@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+# ---------------------------
+# 設定 (環境變數)
+# ---------------------------
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory")  # memory / redis
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", 3600))  # 秒
+CONVERSATION_MAX_ENTRIES = int(os.getenv("CONVERSATION_MAX_ENTRIES", 10000))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# 槽位欄位順序 (compact 表示法以 tuple 依此順序儲存)
+SLOT_FIELDS = ("age", "sex", "smoker", "children", "region", "height", "weight", "bmi")
+
+
+# ---------------------------
+# Compact 槽位表示法
+# ---------------------------
+def pack_slots(current_slots):
+    """{"age": {"value": 35}, ...} → (35, ...)"""
+    return tuple(current_slots[k]["value"] for k in SLOT_FIELDS)
+
+
+def unpack_slots(values):
+    """(35, ...) → {"age": {"value": 35}, ...}，每次都回傳新的 dict。"""
+    return {k: {"value": v} for k, v in zip(SLOT_FIELDS, values)}
+
+
+class ConversationEntry:
+    __slots__ = ("values", "expires_at")
+
+    def __init__(self, values, expires_at):
+        self.values = values
+        self.expires_at = expires_at
+
+
+# ---------------------------
+# 介面
+# ---------------------------
+class ConversationStore:
+    """
+    對話槽位狀態的儲存介面。
+    get 回傳的槽位 dict 是副本，修改後必須呼叫 save 才會寫回。
+    """
+
+    def get(self, conversation_id):
+        """回傳槽位 dict；不存在或已過期時回傳 None。"""
+        raise NotImplementedError
+
+    def save(self, conversation_id, current_slots):
+        raise NotImplementedError
+
+    def delete(self, conversation_id):
+        raise NotImplementedError
+
+
+# ---------------------------
+# In-process LRU + TTL
+# ---------------------------
+class MemoryConversationStore(ConversationStore):
+    """單一行程內的 LRU + TTL 儲存，最多保留 max_entries 筆對話。"""
+
+    def __init__(self, ttl=CONVERSATION_TTL, max_entries=CONVERSATION_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                del self._entries[conversation_id]
+                return None
+            self._entries.move_to_end(conversation_id)
+            return unpack_slots(entry.values)
+
+    def save(self, conversation_id, current_slots):
+        entry = ConversationEntry(pack_slots(current_slots), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[conversation_id] = entry
+            self._entries.move_to_end(conversation_id)
+            self._evict()
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        # 先清掉過期的 (最久未使用的在最前面)，再依容量淘汰
+        now = time.monotonic()
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if oldest.expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest_id]
+
+
+# ---------------------------
+# Redis
+# ---------------------------
+class RedisConversationStore(ConversationStore):
+    """
+    以 Redis 儲存，多個 orchestrator worker 可共用對話狀態。
+    client 可傳入任何相容 redis-py 介面的物件 (如 fakeredis.FakeRedis)。
+    """
+
+    def __init__(self, client=None, url=REDIS_URL, ttl=CONVERSATION_TTL, prefix="conversation:"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, conversation_id):
+        return f"{self.prefix}{conversation_id}"
+
+    def get(self, conversation_id):
+        raw = self.client.get(self._key(conversation_id))
+        if raw is None:
+            return None
+        return unpack_slots(json.loads(raw))
+
+    def save(self, conversation_id, current_slots):
+        payload = json.dumps(pack_slots(current_slots), ensure_ascii=False)
+        self.client.set(self._key(conversation_id), payload, ex=self.ttl)
+
+    def delete(self, conversation_id):
+        self.client.delete(self._key(conversation_id))
+
+
+# ---------------------------
+# 建立儲存
+# ---------------------------
+def create_store(kind=CONVERSATION_STORE):
+    if kind == "redis":
+        return RedisConversationStore()
+    return MemoryConversationStore()
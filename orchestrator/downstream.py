@@ -0,0 +1,203 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# ---------------------------
+# 設定 (環境變數)
+# ---------------------------
+ML_SERVICE_URL = os.getenv("ML_SERVICE_URL", "http://localhost:5001").rstrip("/")
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL", "http://localhost:5003").rstrip("/")
+
+ML_TIMEOUT = float(os.getenv("ML_TIMEOUT", 5))
+RAG_TIMEOUT = float(os.getenv("RAG_TIMEOUT", 5))
+DOWNSTREAM_CONNECT_TIMEOUT = float(os.getenv("DOWNSTREAM_CONNECT_TIMEOUT", 1))
+DOWNSTREAM_POOL_SIZE = int(os.getenv("DOWNSTREAM_POOL_SIZE", 20))
+DOWNSTREAM_RETRIES = int(os.getenv("DOWNSTREAM_RETRIES", 2))
+DOWNSTREAM_BACKOFF = float(os.getenv("DOWNSTREAM_BACKOFF", 0.1))  # 秒
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))  # 秒
+
+# 這些狀態碼代表服務暫時不可用，值得重試
+RETRYABLE_STATUS = {502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+# ---------------------------
+# Circuit Breaker
+# ---------------------------
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次後進入 open，reset_timeout 秒內直接拒絕請求；
+    之後放行一個試探請求 (half-open)，成功則恢復 closed，失敗則重新 open。
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """放行時回傳 "closed" 或 "half_open" (本次為試探請求)，拒絕時回傳 None。"""
+        with self._lock:
+            if self.state == "closed":
+                return "closed"
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return "half_open"
+            # open，或 half-open 的試探請求尚未結束
+            return None
+
+    def allow(self):
+        return self.acquire() is not None
+
+    def abort_probe(self):
+        """試探請求以未分類的例外結束 (或被取消) 時視為失敗，避免 breaker 永遠停在 half_open。"""
+        with self._lock:
+            if self.state != "half_open":
+                return
+        self.record_failure()
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit breaker [{self.name}] opened")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+# ---------------------------
+# 共用 Session (連線池 + keep-alive)
+# ---------------------------
+def create_session(pool_size=DOWNSTREAM_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+shared_session = create_session()
+
+
+def backoff_delay(attempt, base=DOWNSTREAM_BACKOFF):
+    # Full jitter：在 [0, base * 2^attempt] 之間隨機等待，避免多個 worker 同時重試
+    return random.uniform(0, base * (2 ** attempt))
+
+# ---------------------------
+# 下游服務 Client
+# ---------------------------
+class DownstreamClient:
+    """
+    對單一下游服務的 JSON POST 呼叫：連線池、重試 (僅連線錯誤與 502/503/504)、circuit breaker。
+    逾時不重試，以免慢服務讓延遲倍增。breaker open 時直接丟出 CircuitOpenError。
+    """
+
+    def __init__(self, name, base_url, timeout, retries=DOWNSTREAM_RETRIES, session=None, breaker=None):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = (DOWNSTREAM_CONNECT_TIMEOUT, timeout)
+        self.retries = retries
+        self.session = session or shared_session
+        self.breaker = breaker or CircuitBreaker(name)
+
+    def _check_breaker(self):
+        """回傳 True 代表本次呼叫是 half-open 的試探請求。"""
+        state = self.breaker.acquire()
+        if state is None:
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        return state == "half_open"
+
+    def _should_retry(self, status_code, attempt):
+        """依回應狀態更新 breaker；回傳 True 代表應重試。4xx 代表服務本身正常。"""
+        if status_code < 500:
+            self.breaker.record_success()
+            return False
+        if status_code in RETRYABLE_STATUS and attempt < self.retries:
+            return True
+        self.breaker.record_failure()
+        return False
+
+    def post_json(self, path, payload):
+        probe = self._check_breaker()
+        try:
+            return self._post_json(path, payload)
+        except BaseException:
+            # ChunkedEncodingError、JSON 解析錯誤等未記錄結果的例外
+            if probe:
+                self.breaker.abort_probe()
+            raise
+
+    def _post_json(self, path, payload):
+        for attempt in range(self.retries + 1):
+            try:
+                res = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+            except requests.Timeout:
+                self.breaker.record_failure()
+                raise
+            except requests.ConnectionError:
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            if self._should_retry(res.status_code, attempt):
+                time.sleep(backoff_delay(attempt))
+                continue
+            res.raise_for_status()
+            return res.json()
+
+    async def async_post_json(self, http_client, path, payload):
+        """post_json 的 async 版本，使用呼叫端提供的 httpx.AsyncClient。"""
+        probe = self._check_breaker()
+        try:
+            return await self._async_post_json(http_client, path, payload)
+        except BaseException:
+            # 含 asyncio.CancelledError：被取消的試探請求也要讓 breaker 離開 half_open
+            if probe:
+                self.breaker.abort_probe()
+            raise
+
+    async def _async_post_json(self, http_client, path, payload):
+        import httpx
+
+        timeout = httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+        for attempt in range(self.retries + 1):
+            try:
+                res = await http_client.post(f"{self.base_url}{path}", json=payload, timeout=timeout)
+            except httpx.TimeoutException:
+                self.breaker.record_failure()
+                raise
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+
+            if self._should_retry(res.status_code, attempt):
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            res.raise_for_status()
+            return res.json()
+
+
+ml_client = DownstreamClient("ml-service", ML_SERVICE_URL, ML_TIMEOUT)
+rag_client = DownstreamClient("rag-service", RAG_SERVICE_URL, RAG_TIMEOUT)
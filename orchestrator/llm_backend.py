@@ -0,0 +1,263 @@
+import os
+import json
+import asyncio
+import subprocess
+import requests
+from requests.adapters import HTTPAdapter
+
+# ---------------------------
+# 設定 (環境變數)
+# ---------------------------
+LLM_BACKEND = os.getenv("LLM_BACKEND", "http")  # http / subprocess
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", 4096))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 3))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", 120))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 10))
+
+
+def normalize_host(host):
+    # Ollama 的 OLLAMA_HOST 允許省略 scheme (如 127.0.0.1:11434)
+    if not host.startswith(("http://", "https://")):
+        host = "http://" + host
+    return host.rstrip("/")
+
+
+# ---------------------------
+# Subprocess 後端 (fallback)
+# ---------------------------
+class SubprocessBackend:
+    """每次呼叫都啟動一個 `ollama run` 行程，僅作為 HTTP 不可用時的備援。"""
+
+    def __init__(self, model=OLLAMA_MODEL, timeout=OLLAMA_READ_TIMEOUT):
+        self.model = model
+        self.timeout = timeout
+
+    def generate(self, prompt_text):
+        process = subprocess.Popen(
+            ["ollama", "run", self.model],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        try:
+            out, err = process.communicate(prompt_text, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            out, err = process.communicate()
+        return out
+
+    def stream(self, prompt_text):
+        # CLI 模式無法逐 token 回傳，整段輸出視為單一 chunk
+        yield self.generate(prompt_text)
+
+
+# ---------------------------
+# HTTP 後端 (keep-alive 連線池)
+# ---------------------------
+class OllamaHTTPBackend:
+    """透過 Ollama server API (/api/generate) 生成，共用一個 keep-alive 的 Session。"""
+
+    def __init__(
+        self,
+        host=OLLAMA_HOST,
+        model=OLLAMA_MODEL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        num_ctx=OLLAMA_NUM_CTX,
+        connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+        read_timeout=OLLAMA_READ_TIMEOUT,
+        pool_size=OLLAMA_POOL_SIZE,
+        fallback=None
+    ):
+        self.url = f"{normalize_host(host)}/api/generate"
+        self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.timeout = (connect_timeout, read_timeout)
+        self.fallback = fallback
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _payload(self, prompt_text, stream):
+        return {
+            "model": self.model,
+            "prompt": prompt_text,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx}
+        }
+
+    def generate(self, prompt_text):
+        try:
+            res = self.session.post(
+                self.url,
+                json=self._payload(prompt_text, stream=False),
+                timeout=self.timeout
+            )
+            res.raise_for_status()
+            return res.json().get("response", "")
+        except requests.RequestException as e:
+            if self.fallback is None:
+                raise
+            print(f"Ollama HTTP Error, falling back to subprocess: {e}")
+            return self.fallback.generate(prompt_text)
+
+    def stream(self, prompt_text):
+        res = None
+        try:
+            res = self.session.post(
+                self.url,
+                json=self._payload(prompt_text, stream=True),
+                timeout=self.timeout,
+                stream=True
+            )
+            res.raise_for_status()
+        except requests.RequestException as e:
+            # 錯誤狀態碼時連線仍被串流回應占用，需釋放回連線池
+            if res is not None:
+                res.close()
+            if self.fallback is None:
+                raise
+            print(f"Ollama HTTP Error, falling back to subprocess: {e}")
+            yield from self.fallback.stream(prompt_text)
+            return
+
+        # Ollama 串流格式為 NDJSON，每行一個 {"response": "...", "done": bool}
+        with res:
+            for line in res.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                token = chunk.get("response", "")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    break
+
+
+# ---------------------------
+# Async 後端 (ASGI orchestrator 使用)
+# ---------------------------
+class AsyncSubprocessBackend:
+    """以 asyncio subprocess 執行 `ollama run`，不阻塞 event loop。"""
+
+    def __init__(self, model=OLLAMA_MODEL, timeout=OLLAMA_READ_TIMEOUT):
+        self.model = model
+        self.timeout = timeout
+
+    async def generate(self, prompt_text):
+        process = await asyncio.create_subprocess_exec(
+            "ollama", "run", self.model,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            out, err = await asyncio.wait_for(
+                process.communicate(prompt_text.encode("utf-8")), self.timeout
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            out, err = await process.communicate()
+        return out.decode("utf-8", errors="replace")
+
+    async def stream(self, prompt_text):
+        yield await self.generate(prompt_text)
+
+
+class AsyncOllamaHTTPBackend:
+    """OllamaHTTPBackend 的 async 版本，使用共用的 httpx.AsyncClient。"""
+
+    def __init__(
+        self,
+        client,
+        host=OLLAMA_HOST,
+        model=OLLAMA_MODEL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        num_ctx=OLLAMA_NUM_CTX,
+        read_timeout=OLLAMA_READ_TIMEOUT,
+        fallback=None
+    ):
+        import httpx
+
+        self._errors = (httpx.HTTPError,)
+        self.client = client
+        self.url = f"{normalize_host(host)}/api/generate"
+        self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.timeout = httpx.Timeout(read_timeout, connect=OLLAMA_CONNECT_TIMEOUT)
+        self.fallback = fallback
+
+    _payload = OllamaHTTPBackend._payload
+
+    async def generate(self, prompt_text):
+        try:
+            res = await self.client.post(
+                self.url,
+                json=self._payload(prompt_text, stream=False),
+                timeout=self.timeout
+            )
+            res.raise_for_status()
+            return res.json().get("response", "")
+        except self._errors as e:
+            if self.fallback is None:
+                raise
+            print(f"Ollama HTTP Error, falling back to subprocess: {e}")
+            return await self.fallback.generate(prompt_text)
+
+    async def stream(self, prompt_text):
+        request = self.client.build_request(
+            "POST", self.url,
+            json=self._payload(prompt_text, stream=True),
+            timeout=self.timeout
+        )
+        res = None
+        try:
+            res = await self.client.send(request, stream=True)
+            res.raise_for_status()
+        except self._errors as e:
+            if res is not None:
+                await res.aclose()
+            if self.fallback is None:
+                raise
+            print(f"Ollama HTTP Error, falling back to subprocess: {e}")
+            async for token in self.fallback.stream(prompt_text):
+                yield token
+            return
+
+        try:
+            async for line in res.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                token = chunk.get("response", "")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    break
+        finally:
+            await res.aclose()
+
+
+# ---------------------------
+# 建立後端
+# ---------------------------
+def create_backend(kind=LLM_BACKEND):
+    fallback = SubprocessBackend()
+    if kind == "subprocess":
+        return fallback
+    return OllamaHTTPBackend(fallback=fallback)
+
+
+def create_async_backend(client, kind=LLM_BACKEND):
+    fallback = AsyncSubprocessBackend()
+    if kind == "subprocess":
+        return fallback
+    return AsyncOllamaHTTPBackend(client, fallback=fallback)
@@ -0,0 +1,258 @@
+import re
+
+# ---------------------------
+# 城市詞庫
+# 與 ml-service/flask_predict_price.py 的 REGION_MAP 對齊 (輸出一律使用「台」)，
+# 另外補上 REGION_MAP 未列出、會落入 Kaohsiung 的縣市。
+# ---------------------------
+CITY_LEXICON = [
+    # Taipei
+    "台北市", "新北市", "桃園市", "基隆市", "宜蘭縣", "新竹縣", "新竹市", "苗栗縣",
+    # Taichung
+    "台中市", "彰化縣", "南投縣", "雲林縣", "嘉義縣", "嘉義市",
+    # Tainan
+    "台南市", "高雄市", "屏東縣",
+    # 其他 (模型端歸類為 Kaohsiung)
+    "花蓮縣", "台東縣", "澎湖縣", "金門縣", "連江縣",
+]
+
+# 省略「市 / 縣」時仍可唯一對應的簡稱；新竹、嘉義 縣市同名，不做猜測
+CITY_ALIASES = {
+    city[:-1]: city for city in CITY_LEXICON
+    if city[:-1] not in ("新竹", "嘉義")
+}
+CITY_ALIASES["馬祖"] = "連江縣"
+
+_city_bases = sorted({city[:-1] for city in CITY_LEXICON} | set(CITY_ALIASES), key=len, reverse=True)
+CITY_RE = re.compile(f"({'|'.join(map(re.escape, _city_bases))})([市縣]?)")
+
+# ---------------------------
+# 中文數字
+# ---------------------------
+CN_DIGITS = {"零": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4,
+             "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+CN_NUM = r"[零一二兩三四五六七八九十]+"
+NUM = rf"(\d{{1,3}}|{CN_NUM})"
+
+
+def cn_to_int(text):
+    """將 0~99 的中文數字 (如 三十五、十二、兩) 或阿拉伯數字轉為 int。"""
+    if text.isdigit():
+        return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        value = (CN_DIGITS.get(tens, 0) if tens else 1) * 10
+        return value + (CN_DIGITS.get(ones, 0) if ones else 0)
+    if len(text) == 1 and text in CN_DIGITS:
+        return CN_DIGITS[text]
+    return None
+
+# ---------------------------
+# 規則 (預先編譯)
+# ---------------------------
+AGE_RE = re.compile(rf"(?:年齡|年紀)\s*[:：]?\s*{NUM}\s*歲?|{NUM}\s*(?:歲|岁|years?\s*old)", re.I)
+
+# 年齡、抽菸前後出現家人稱謂 (如「我兒子5歲」「5歲的女兒」「我老公抽菸」) 時，不是投保人本人的資料
+THIRD_PARTY = r"兒子|女兒|小孩|孩子|小朋友|太太|老婆|先生|老公|爸|媽|父|母|爺|奶|哥|姐|姊|弟|妹"
+THIRD_PARTY_BEFORE_RE = re.compile(rf"(?:{THIRD_PARTY})[^，,。;；\s]*$")
+THIRD_PARTY_AFTER_RE = re.compile(rf"^\s*的?\s*(?:{THIRD_PARTY})")
+CLAUSE_SEP_RE = re.compile(r"[，,。;；\s]")
+
+# 「先生」多半指丈夫 (如「我先生40歲」)，不視為投保人本人的性別
+SEX_WORD_RE = re.compile(r"(男性|男生|\bmale\b)|(女性|女生|小姐|\bfemale\b)", re.I)
+SEX_CHAR_RE = re.compile(r"(?:^|(?<=[\s,，、。;；:：]))(?:性別\s*[:：]?\s*)?(男|女)(?=$|[\s,，、。;；])")
+
+NON_SMOKER_RE = re.compile(
+    r"(?:不|沒有|沒|無|不會|從不|非)\s*(?:抽|吸)\s*[菸煙烟]"
+    r"|(?:抽|吸)?\s*[菸煙烟]\s*[:：]?\s*(?:否|無|不|沒有)"
+    r"|不是[^，,。;；]*?(?:抽|吸)\s*[菸煙烟]者"
+    r"|non[-\s]?smoker",
+    re.I,
+)
+SMOKER_RE = re.compile(r"(?:有|會|常|在)?\s*(?:抽|吸)\s*[菸煙烟]|\bsmoker\b", re.I)
+# 判定為吸菸者前，附近若仍有否定詞 (如「戒菸」「以前抽菸現在沒有」) 就交給 LLM
+NEGATION_RE = re.compile(r"不|沒|無|否|非|戒|\bnot?\b|never", re.I)
+NEGATION_WINDOW = 4
+# 戒菸、過去吸菸等時態線索可能離吸菸字眼較遠，整句檢查
+QUIT_SMOKING_RE = re.compile(r"戒|以前|曾經|過去|quit", re.I)
+
+NO_CHILDREN_RE = re.compile(r"(?:沒有|沒|無|不生)\s*(?:小孩|孩子|子女|小朋友)")
+CHILDREN_RE = re.compile(rf"{NUM}\s*(?:個|名|位)?\s*(?:小孩|孩子|子女|小朋友|兒子|女兒)")
+
+HEIGHT_RE = re.compile(
+    r"(?:身高\s*[:：]?\s*)?(\d{3}(?:\.\d+)?)\s*(?:公分|cm|釐米)"
+    r"|身高\s*[:：]?\s*(\d{3}(?:\.\d+)?)"
+    r"|(?:身高\s*[:：]?\s*)?([12]\.\d{1,2})\s*(?:m|公尺|米)(?![a-z])",
+    re.I,
+)
+WEIGHT_RE = re.compile(
+    r"(?:體重\s*[:：]?\s*)?(\d{2,3}(?:\.\d+)?)\s*(?:公斤|kg|千克)"
+    r"|體重\s*[:：]?\s*(\d{2,3}(?:\.\d+)?)",
+    re.I,
+)
+
+# 移除已辨識片段後，殘留文字若仍含這些線索，代表可能有規則沒抓到的欄位
+HINT_RE = re.compile(
+    r"\d|[零一二兩三四五六七八九十]|[歲岁男女抽吸菸煙烟孩兒身高體重縣市]|male|smok|cm|kg",
+    re.I,
+)
+
+
+def _first_group(match):
+    return next(g for g in match.groups() if g is not None)
+
+
+def _to_number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+# ---------------------------
+# 各欄位抽取
+# ---------------------------
+def _is_third_party(text, match):
+    clause_start = max((m.end() for m in CLAUSE_SEP_RE.finditer(text, 0, match.start())), default=0)
+    return bool(
+        THIRD_PARTY_BEFORE_RE.search(text[clause_start:match.start()])
+        or THIRD_PARTY_AFTER_RE.search(text[match.end():])
+    )
+
+
+def _extract_age(text, spans):
+    for m in AGE_RE.finditer(text):
+        # 家人的年齡不採用，也不標記為已辨識，殘留的「歲」會讓 LLM 判斷
+        if _is_third_party(text, m):
+            continue
+        age = cn_to_int(_first_group(m))
+        if age is not None and 0 < age <= 120:
+            spans.append(m.span())
+            return age
+    return None
+
+
+def _extract_sex(text, spans):
+    found, hits = set(), []
+    for m in SEX_WORD_RE.finditer(text):
+        found.add("male" if m.group(1) else "female")
+        hits.append(m.span())
+    for m in SEX_CHAR_RE.finditer(text):
+        found.add("male" if m.group(1) == "男" else "female")
+        hits.append(m.span())
+    # 同時出現男、女時交給 LLM 判斷
+    if len(found) != 1:
+        return None
+    spans.extend(hits)
+    return found.pop()
+
+
+def _extract_smoker(text, spans):
+    # 家人的抽菸習慣不採用，也不標記為已辨識，殘留的「菸」會讓 LLM 判斷
+    for m in NON_SMOKER_RE.finditer(text):
+        if _is_third_party(text, m):
+            continue
+        spans.append(m.span())
+        return "no"
+    for m in SMOKER_RE.finditer(text):
+        if _is_third_party(text, m):
+            continue
+        window = text[max(0, m.start() - NEGATION_WINDOW):m.end() + NEGATION_WINDOW]
+        if NEGATION_RE.search(window) or QUIT_SMOKING_RE.search(text):
+            # 不標記為已辨識，殘留的「菸」會讓 needs_llm 成立
+            return None
+        spans.append(m.span())
+        return "yes"
+    return None
+
+
+def _extract_children(text, spans):
+    m = NO_CHILDREN_RE.search(text)
+    if m:
+        spans.append(m.span())
+        return 0
+    total, hits = None, []
+    for m in CHILDREN_RE.finditer(text):
+        n = cn_to_int(m.group(1))
+        if n is None or n > 20:
+            return None
+        # 「一個兒子兩個女兒」需加總
+        total = (total or 0) + n
+        hits.append(m.span())
+    spans.extend(hits)
+    return total
+
+
+def _extract_region(text, spans):
+    cities, hits = set(), []
+    for m in CITY_RE.finditer(text):
+        city = m.group(0) if m.group(0) in CITY_LEXICON else CITY_ALIASES.get(m.group(1))
+        if city is None:
+            # 「新竹」「嘉義」未指明縣市
+            return None
+        cities.add(city)
+        hits.append(m.span())
+    if len(cities) != 1:
+        return None
+    spans.extend(hits)
+    return cities.pop()
+
+
+def _extract_height(text, spans):
+    m = HEIGHT_RE.search(text)
+    if not m:
+        return None
+    value = float(_first_group(m))
+    if value < 3:  # 公尺
+        value = round(value * 100, 1)
+    if not 100 <= value <= 230:
+        return None
+    spans.append(m.span())
+    return _to_number(str(value))
+
+
+def _extract_weight(text, spans):
+    m = WEIGHT_RE.search(text)
+    if not m:
+        return None
+    value = float(_first_group(m))
+    if not 20 <= value <= 300:
+        return None
+    spans.append(m.span())
+    return _to_number(str(value))
+
+
+EXTRACTORS = {
+    "age": _extract_age,
+    "sex": _extract_sex,
+    "smoker": _extract_smoker,
+    "children": _extract_children,
+    "region": _extract_region,
+    "height": _extract_height,
+    "weight": _extract_weight,
+}
+
+# ---------------------------
+# 對外介面
+# ---------------------------
+def extract_slots(user_message):
+    """
+    以規則抽取槽位，只回傳有把握的欄位。
+
+    回傳 (extracted, needs_llm)：
+    - extracted: {欄位: 值}，格式與 LLM 抽取結果相同 (sex: male/female, smoker: yes/no)
+    - needs_llm: 移除已辨識片段後，訊息中仍有疑似槽位資訊，需要 LLM 補抽
+    """
+    text = user_message.replace("臺", "台")
+    spans = []
+    extracted = {}
+    for field, extractor in EXTRACTORS.items():
+        value = extractor(text, spans)
+        if value is not None:
+            extracted[field] = value
+
+    residual = list(text)
+    for start, end in spans:
+        residual[start:end] = [" "] * (end - start)
+    residual = "".join(residual)
+    # 未被採用的片段 (如「新竹」或同時提到兩個縣市) 會留在 residual 中
+    needs_llm = bool(HINT_RE.search(residual) or CITY_RE.search(residual))
+
+    return extracted, needs_llm
@@ -0,0 +1,89 @@
+import os
+import re
+
+# ---------------------------
+# 設定
+# ---------------------------
+CHUNKING_MODES = ("none", "field", "passage")
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", 200))   # MiniLM 上限 256 tokens，中文約一字一 token
+CHUNK_AGGREGATION = os.getenv("CHUNK_AGGREGATION", "max")      # max / sum
+CHUNK_OVERFETCH = int(os.getenv("CHUNK_OVERFETCH", 4))         # 向量搜尋取 top_k × N 個 chunk 再合併成商品
+
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[。；;！!？?\n])")
+
+# 欄位 chunk：(名稱, [(標籤, 欄位)])
+FIELD_GROUPS = [
+    ("overview", [("商品描述", "description")]),
+    ("benefits", [("保障內容", "benefits")]),
+    ("eligibility", [("投保年齡", "insured_age_label"), ("繳費期間", "payment_term"), ("原始年齡資訊", "age_raw_text")]),
+    ("amount", [("保額說明", "amount_raw_text")]),
+]
+
+
+def split_passages(text, max_chars=PASSAGE_MAX_CHARS):
+    """依句號 / 分號斷句，再把相鄰句子合併到不超過 max_chars；單句過長時硬切。"""
+    passages, current = [], ""
+    for sentence in SENTENCE_SPLIT_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) > max_chars:
+            passages.append(current)
+            current = ""
+        current += sentence
+    if current:
+        passages.append(current)
+    return passages
+
+
+def build_chunks(row, mode="passage"):
+    """
+    將一個商品拆成多個 (欄位, 文字) chunk；每個 chunk 都帶商品名稱，單獨 embedding 時仍有上下文。
+    field 模式每個欄位群組一個 chunk，passage 模式再把長欄位切成段落。
+    """
+    header = f"商品名稱：{row['title']}"
+    chunks = []
+    for field, columns in FIELD_GROUPS:
+        parts = [(label, row[col].strip()) for label, col in columns if row[col].strip()]
+        if not parts:
+            continue
+        if mode == "passage":
+            for label, value in parts:
+                for passage in split_passages(value):
+                    chunks.append((field, f"{header}\n{label}：{passage}"))
+        else:
+            body = "\n".join(f"{label}：{value}" for label, value in parts)
+            chunks.append((field, f"{header}\n{body}"))
+    # 只有名稱的商品至少保留一個 chunk
+    return chunks or [("overview", header)]
+
+# ---------------------------
+# 查詢：chunk 命中 → 商品分數
+# ---------------------------
+def aggregate_products(ids, docs, metas, distances, top_k, method=CHUNK_AGGREGATION):
+    """
+    以 metadata 的 product_id 合併 chunk (未分段的索引每個商品只有一筆，結果不變)。
+    max：取最相似的 chunk；sum：多個 chunk 同時命中的商品分數累加。
+    回傳依分數排序的 [(product_id, score, best_doc, best_meta, best_similarity)]；
+    sum 模式的 score 可能大於 1，best_similarity 為最相似 chunk 的相似度 (回應的 score)。
+    """
+    products = {}
+    for cid, doc, meta, distance in zip(ids, docs, metas, distances):
+        meta = meta or {}
+        pid = meta.get("product_id", cid)
+        similarity = max(0.0, float(1 - distance))
+        entry = products.get(pid)
+        if entry is None:
+            products[pid] = [pid, similarity, doc, meta, similarity]
+            continue
+        entry[1] = entry[1] + similarity if method == "sum" else max(entry[1], similarity)
+        if similarity > entry[4]:
+            entry[2], entry[3], entry[4] = doc, meta, similarity
+    ranked = sorted(products.values(), key=lambda e: e[1], reverse=True)[:top_k]
+    return [tuple(entry) for entry in ranked]
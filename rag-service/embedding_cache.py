@@ -0,0 +1,173 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+
+# ---------------------------
+# 設定
+# ---------------------------
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 4096))   # 0 = 停用記憶體快取
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")           # SQLite 檔案路徑，空字串 = 不使用磁碟層
+
+
+def normalize_query(query: str) -> str:
+    """全形/半形統一 (NFKC)、去頭尾空白、連續空白合併為一個。"""
+    return " ".join(unicodedata.normalize("NFKC", query).split())
+
+
+class EmbeddingCache:
+    """
+    查詢向量的兩層快取：記憶體 LRU → SQLite (重啟後仍保留) → encode_fn。
+    key 為正規化後的查詢文字加上模型名稱，換模型時不會誤用舊向量。
+    """
+
+    def __init__(self, encode_fn, model_name, max_entries=EMBED_CACHE_SIZE, disk_path=EMBED_CACHE_PATH):
+        self.encode_fn = encode_fn
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    def key(self, query: str) -> str:
+        text = f"{self.model_name}\n{normalize_query(query)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    # ---------------------------
+    # 記憶體層
+    # ---------------------------
+    def _memory_get(self, key):
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is not None:
+                self._entries.move_to_end(key)
+            return vec
+
+    def _memory_put(self, key, vec):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = vec
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # ---------------------------
+    # 磁碟層 (SQLite)
+    # ---------------------------
+    def _disk_get(self, key):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT dim, vec FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[1], dtype=np.float32, count=row[0])
+
+    def _disk_put(self, items):
+        """items 為 [(key, vec)]；同一批只 commit 一次。"""
+        if self._db is None or not items:
+            return
+        try:
+            with self._lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO query_embeddings (key, model, dim, vec) VALUES (?, ?, ?, ?)",
+                    [(key, self.model_name, len(vec), vec.tobytes()) for key, vec in items]
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            # 磁碟層只是加速，寫入失敗不影響回應
+            print(f"Embedding cache write failed: {e}")
+
+    # ---------------------------
+    # 查詢
+    # ---------------------------
+    def get(self, query: str) -> np.ndarray:
+        """回傳 float32 查詢向量 (唯讀，呼叫端不可修改)。"""
+        key = self.key(query)
+        vec = self._memory_get(key)
+        if vec is not None:
+            self.hits += 1
+            return vec
+
+        vec = self._disk_get(key)
+        if vec is not None:
+            self.disk_hits += 1
+            self._memory_put(key, vec)
+            return vec
+
+        self.misses += 1
+        started = time.perf_counter()
+        vec = np.asarray(self.encode_fn(query), dtype=np.float32)
+        self.encode_seconds += time.perf_counter() - started
+        vec.setflags(write=False)
+        self._memory_put(key, vec)
+        self._disk_put([(key, vec)])
+        return vec
+
+    def get_many(self, queries: list, batch_size=64) -> list:
+        """批次版 get()：未命中的查詢 (去重後) 以一次 encode_fn(list, batch_size=...) 計算。"""
+        keys = [self.key(q) for q in queries]
+        vectors = [None] * len(queries)
+        pending = OrderedDict()   # key → 第一個對應的查詢文字
+        for i, key in enumerate(keys):
+            vec = self._memory_get(key)
+            if vec is not None:
+                self.hits += 1
+            else:
+                vec = self._disk_get(key)
+                if vec is not None:
+                    self.disk_hits += 1
+                    self._memory_put(key, vec)
+            if vec is None:
+                pending.setdefault(key, queries[i])
+            vectors[i] = vec
+
+        if pending:
+            self.misses += len(pending)
+            started = time.perf_counter()
+            encoded = np.asarray(self.encode_fn(list(pending.values()), batch_size=batch_size), dtype=np.float32)
+            self.encode_seconds += time.perf_counter() - started
+            fresh = {}
+            for key, vec in zip(pending, encoded):
+                vec.setflags(write=False)
+                fresh[key] = vec
+                self._memory_put(key, vec)
+            self._disk_put(list(fresh.items()))
+            vectors = [vec if vec is not None else fresh[key] for vec, key in zip(vectors, keys)]
+        return vectors
+
+    def stats(self):
+        total = self.hits + self.disk_hits + self.misses
+        disk_entries = None
+        if self._db is not None:
+            with self._lock:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk_entries": disk_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / total, 4) if total else 0.0,
+            "memory_hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "encode_seconds": round(self.encode_seconds, 4),
+        }
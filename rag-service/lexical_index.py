@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import math
+import time
+import unicodedata
+import numpy as np
+from pathlib import Path
+from collections import Counter
+from product_rules import match_where
+
+# ---------------------------
+# 設定
+# ---------------------------
+BASE_DIR = Path(__file__).resolve().parent
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", str(BASE_DIR.parent / "data" / "index" / "bm25.npz"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+NGRAM_SIZES = (1, 2)       # 中文沒有空白斷詞：以單字 + 相鄰二字 (「醫療」「癌症」「終身」) 當作詞
+FETCH_PAGE_SIZE = 500
+WHERE_CACHE_SIZE = 256
+
+TOKEN_RE = re.compile(r"[\u3400-\u9fff]+|[a-z0-9]+")   # 中文 (NFKC 後相容字已轉為統一漢字) / 英數字
+
+
+def tokenize(text: str) -> list:
+    """NFKC + 小寫後切出中文字串與英數字詞；中文字串展開成字元 n-gram。"""
+    tokens = []
+    for run in TOKEN_RE.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if run.isascii():
+            tokens.append(run)
+            continue
+        for n in NGRAM_SIZES:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    商品層級的 BM25 反向索引。posting 以 CSR 陣列保存 (indptr / docs / weights)，
+    weight 在建立時就算好 idf × tf 正規化，查詢只需把幾個詞的 posting 加總。
+    """
+
+    def __init__(self, ids, documents, metadatas, k1=BM25_K1, b=BM25_B):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+        self.k1 = k1
+        self.b = b
+        self.built_at = time.time()
+        self._where_cache = {}
+
+        vocab = {}
+        counts = []
+        for doc in self.documents:
+            tf = Counter(tokenize(doc))
+            counts.append(tf)
+            for term in tf:
+                vocab.setdefault(term, len(vocab))
+        self._build(vocab, counts)
+
+    def _build(self, vocab, counts):
+        n_docs = len(counts)
+        lengths = np.array([sum(tf.values()) for tf in counts], dtype=np.float32)
+        avg_len = float(lengths.mean()) if n_docs else 0.0
+
+        postings = [[] for _ in range(len(vocab))]
+        for d, tf in enumerate(counts):
+            for term, freq in tf.items():
+                postings[vocab[term]].append((d, freq))
+
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        docs, weights = [], []
+        for t, plist in enumerate(postings):
+            idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for d, freq in plist:
+                norm = self.k1 * (1 - self.b + self.b * lengths[d] / avg_len) if avg_len else self.k1
+                docs.append(d)
+                weights.append(idf * freq * (self.k1 + 1) / (freq + norm))
+            indptr[t + 1] = len(docs)
+
+        self.vocab = vocab
+        self.indptr = indptr
+        self.docs = np.asarray(docs, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---------------------------
+    # 建立 / 保存
+    # ---------------------------
+    @classmethod
+    def from_collection(cls, collection, page_size=FETCH_PAGE_SIZE):
+        """從 Chroma 讀回所有文件；chunk 索引時以 product_id 合併，使用 metadata 中的完整商品文件。"""
+        products = {}
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            for entry_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                meta = meta or {}
+                pid = meta.get("product_id", entry_id)
+                if pid not in products:
+                    # 只保留商品層級的 metadata (不含 chunk 欄位與重複的全文)
+                    product_meta = {k: v for k, v in meta.items() if k not in ("field", "product_doc")}
+                    products[pid] = (meta.get("product_doc", doc), product_meta)
+            offset += len(page["ids"])
+        if not products:
+            raise ValueError("Collection is empty")
+        return cls(
+            list(products), [doc for doc, _ in products.values()], [meta for _, meta in products.values()]
+        )
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 與向量 snapshot 相同：先寫暫存檔再 os.replace
+        tmp_npz = path.with_name(f".{path.stem}.tmp.npz")
+        np.savez(tmp_npz, indptr=self.indptr, docs=self.docs, weights=self.weights)
+        meta = {
+            "ids": self.ids, "documents": self.documents, "metadatas": self.metadatas,
+            "vocab": sorted(self.vocab, key=self.vocab.get), "k1": self.k1, "b": self.b,
+            "ngrams": list(NGRAM_SIZES), "built_at": self.built_at,
+        }
+        tmp_json = path.with_name(f".{path.stem}.tmp.json")
+        tmp_json.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_npz, path)
+        os.replace(tmp_json, path.with_suffix(".json"))
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        meta = json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+        if tuple(meta.get("ngrams", ())) != NGRAM_SIZES:
+            raise ValueError("Lexical index was built with a different tokenizer; rebuild it")
+        arrays = np.load(path)
+        # 兩個檔案分別 os.replace，重建途中讀取可能拿到新舊混合的版本
+        if len(arrays["indptr"]) != len(meta["vocab"]) + 1 or int(arrays["docs"].max(initial=-1)) >= len(meta["ids"]):
+            raise ValueError("Lexical index files do not match; rebuild in progress?")
+        index = cls.__new__(cls)
+        index.ids = meta["ids"]
+        index.documents = meta["documents"]
+        index.metadatas = meta["metadatas"]
+        index.k1, index.b = meta["k1"], meta["b"]
+        index.built_at = meta.get("built_at", time.time())
+        index._where_cache = {}
+        index.vocab = {term: t for t, term in enumerate(meta["vocab"])}
+        index.indptr = arrays["indptr"]
+        index.docs = arrays["docs"]
+        index.weights = arrays["weights"]
+        return index
+
+    # ---------------------------
+    # 查詢
+    # ---------------------------
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            # 同一個詞的 posting 中每個商品只出現一次，可直接 fancy-index 累加
+            scores[self.docs[start:end]] += self.weights[start:end]
+        return scores
+
+    def allowed_mask(self, where):
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True)
+        mask = self._where_cache.get(key)
+        if mask is None:
+            mask = np.array([match_where(meta, where) for meta in self.metadatas], dtype=bool)
+            if len(self._where_cache) >= WHERE_CACHE_SIZE:
+                self._where_cache.clear()
+            self._where_cache[key] = mask
+        return mask
+
+    def search(self, query: str, top_k=10, where=None):
+        """回傳 [(product_id, score, document, metadata)]，只包含至少命中一個詞的商品。"""
+        scores = self.scores(query)
+        mask = self.allowed_mask(where)
+        if mask is not None:
+            scores[~mask] = 0.0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.ids[i], float(scores[i]), self.documents[i], self.metadatas[i]) for i in hits]
+
+    def stats(self):
+        return {
+            "products": len(self.ids),
+            "terms": len(self.vocab),
+            "postings": int(len(self.docs)),
+            "built_at": self.built_at,
+        }
+
+# ---------------------------
+# 融合
+# ---------------------------
+def fuse(vector_hits, lexical_hits, top_k, method="rrf", rrf_k=60, lexical_weight=0.3):
+    """
+    合併向量與 BM25 的商品排序；兩者皆為 [(product_id, score, doc, meta)]，
+    向量結果可另帶相似度 (aggregate_products 的第五個欄位，chunk sum 合併時與 score 不同)。
+    rrf：Σ 1 / (rrf_k + 名次)，不受兩種分數尺度不同影響；
+    weighted：各自除以該次查詢的最高分後加權平均。
+    回傳 [(product_id, fused_score, doc, meta, vector_score, lexical_score)]，vector_score 為相似度。
+    """
+    fused = {}
+    for source, hits in (("vector", vector_hits), ("lexical", lexical_hits)):
+        best = max((hit[1] for hit in hits), default=0.0)
+        weight = lexical_weight if source == "lexical" else 1 - lexical_weight
+        for rank, (pid, score, doc, meta, *similarity) in enumerate(hits):
+            entry = fused.setdefault(pid, {"score": 0.0, "doc": doc, "meta": meta, "vector": None, "lexical": None})
+            entry[source] = similarity[0] if similarity else score
+            if method == "rrf":
+                entry["score"] += 1.0 / (rrf_k + rank + 1)
+            else:
+                entry["score"] += weight * (score / best if best > 0 else 0.0)
+    ranked = sorted(fused.items(), key=lambda item: item[1]["score"], reverse=True)[:top_k]
+    return [(pid, e["score"], e["doc"], e["meta"], e["vector"], e["lexical"]) for pid, e in ranked]
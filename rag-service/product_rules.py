@@ -0,0 +1,125 @@
+import re
+import json
+import math
+
+# 沒有年齡 / 保額規則的商品視為不限制 (不被過濾掉)
+AGE_UNBOUNDED = (0, 200)
+AMOUNT_UNBOUNDED = (0, 10 ** 12)
+
+AGE_RANGE_RE = re.compile(r"(\d+)\s*歲?\s*[~～\-至]\s*(\d+)\s*歲")
+
+
+def parse_json_list(value):
+    """Excel / CSV 中的 age_parsed、amount_rules 以 JSON 字串保存；空值回傳 []。"""
+    if isinstance(value, list):
+        return value
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return []
+    value = str(value).strip()
+    if not value:
+        return []
+    try:
+        parsed = json.loads(value)
+    except json.JSONDecodeError:
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+
+def age_range(age_parsed, insured_age_label=""):
+    """所有年期的年齡聯集 (任一年期可投保即符合)；沒有解析結果時退回投保年齡標籤的「X歲~Y歲」。"""
+    ranges = [(r["min_age"], r["max_age"]) for r in age_parsed
+              if r.get("min_age") is not None and r.get("max_age") is not None]
+    if not ranges:
+        ranges = [(int(a), int(b)) for a, b in AGE_RANGE_RE.findall(insured_age_label or "")]
+    if not ranges:
+        return AGE_UNBOUNDED
+    return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+
+def amount_range(amount_rules):
+    mins = [r["min_amount"] for r in amount_rules if r.get("min_amount") is not None]
+    maxs = [r["max_amount"] for r in amount_rules if r.get("max_amount") is not None]
+    return (min(mins) if mins else AMOUNT_UNBOUNDED[0]), (max(maxs) if maxs else AMOUNT_UNBOUNDED[1])
+
+
+def eligibility_metadata(row) -> dict:
+    """
+    寫入索引的投保條件 metadata。Chroma metadata 只接受純量，
+    因此存攤平的 min/max 供 where 過濾，原始規則另以 JSON 字串保存。
+    """
+    age_parsed = parse_json_list(row.get("age_parsed"))
+    amount_rules = parse_json_list(row.get("amount_rules"))
+    min_age, max_age = age_range(age_parsed, row.get("insured_age_label", ""))
+    min_amount, max_amount = amount_range(amount_rules)
+    return {
+        "min_age": int(min_age),
+        "max_age": int(max_age),
+        "min_amount": int(min_amount),
+        "max_amount": int(max_amount),
+        "age_parsed": json.dumps(age_parsed, ensure_ascii=False),
+        "amount_rules": json.dumps(amount_rules, ensure_ascii=False),
+    }
+
+# ---------------------------
+# 查詢條件
+# ---------------------------
+def parse_eligibility(data: dict):
+    """從請求取出 age / amount (保額)；未提供回傳 None，格式錯誤丟出 ValueError。"""
+    values = []
+    for field in ("age", "amount"):
+        value = data.get(field)
+        if value in (None, ""):
+            values.append(None)
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} must be a number")
+        if value < 0:
+            raise ValueError(f"{field} must be non-negative")
+        values.append(value)
+    return tuple(values)
+
+
+def build_where(age=None, amount=None):
+    """Chroma where 條件 (NumpyIndex 也支援同樣語法)；沒有條件時回傳 None。"""
+    clauses = []
+    if age is not None:
+        clauses += [{"min_age": {"$lte": age}}, {"max_age": {"$gte": age}}]
+    if amount is not None:
+        clauses += [{"min_amount": {"$lte": amount}}, {"max_amount": {"$gte": amount}}]
+    if not clauses:
+        return None
+    return {"$and": clauses}
+
+
+def match_where(meta: dict, where) -> bool:
+    """Chroma where 語法的子集合：$and / $or / $eq / $ne / $lt / $lte / $gt / $gte / $in。"""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(match_where(meta, w) for w in where["$and"])
+    if "$or" in where:
+        return any(match_where(meta, w) for w in where["$or"])
+    for field, cond in where.items():
+        value = (meta or {}).get(field)
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, target in cond.items():
+            if value is None:
+                return False
+            if op == "$eq" and not value == target:
+                return False
+            if op == "$ne" and not value != target:
+                return False
+            if op == "$lt" and not value < target:
+                return False
+            if op == "$lte" and not value <= target:
+                return False
+            if op == "$gt" and not value > target:
+                return False
+            if op == "$gte" and not value >= target:
+                return False
+            if op == "$in" and value not in target:
+                return False
+    return True
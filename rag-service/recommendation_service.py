@@ -1,8 +1,16 @@
 import os
+import json
+from pathlib import Path
 from flask import Flask, request, jsonify
 from chromadb import HttpClient
 from sentence_transformers import SentenceTransformer
 import torch
+from embedding_cache import EmbeddingCache
+from vector_index import VECTOR_INDEX, LocalVectorIndex
+from product_rules import build_where, parse_eligibility
+from chunking import CHUNK_AGGREGATION, CHUNK_OVERFETCH, aggregate_products
+from lexical_index import LEXICAL_INDEX_PATH, BM25Index, fuse
+from reranker import RERANK_MODE, Reranker, parse_rerank_context
 
 app = Flask(__name__)
 
@@ -10,6 +18,7 @@ app = Flask(__name__)
 CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
 CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
 COLLECTION_NAME = "insurance_products"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 
 try:
     client = HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
@@ -19,16 +28,148 @@ except Exception as e:
     print(f"Error connecting to ChromaDB: {e}")
     collection = None
 
+# 向量搜尋後端：chroma (HTTP) 或 numpy (程序內精確搜尋，定期從 Chroma 更新)
+search_index = collection
+local_index = None
+if VECTOR_INDEX == "numpy":
+    local_index = LocalVectorIndex(collection)
+    local_index.start_refresher()
+    search_index = local_index
+
+# 檢索模式：vector (只用 embedding) / hybrid (embedding + BM25 融合)；請求可用 "retrieval" 覆寫
+RETRIEVAL_MODES = ("vector", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf")            # rrf / weighted
+RRF_K = int(os.getenv("RRF_K", 60))
+LEXICAL_WEIGHT = float(os.getenv("LEXICAL_WEIGHT", 0.3))     # weighted 模式中 BM25 的權重
+
+def lexical_index_mtime():
+    # json 在 npz 之後才寫入，以它的修改時間判斷是否有新版索引
+    try:
+        return os.stat(Path(LEXICAL_INDEX_PATH).with_suffix(".json")).st_mtime
+    except OSError:
+        return None
+
+def load_lexical_index():
+    """載入 write_into_chromaDB.py 產生的 BM25 索引；檔案不存在時從 Chroma 建立。"""
+    try:
+        index = BM25Index.load(LEXICAL_INDEX_PATH)
+        print(f"BM25 index loaded: {len(index)} products")
+        return index
+    except (OSError, ValueError, KeyError) as e:
+        print(f"BM25 index not loaded from {LEXICAL_INDEX_PATH}: {e}")
+    if collection is None:
+        return None
+    try:
+        index = BM25Index.from_collection(collection)
+        print(f"BM25 index built from Chroma: {len(index)} products")
+        return index
+    except Exception as e:
+        print(f"Error building BM25 index: {e}")
+        return None
+
+lexical_index = load_lexical_index()
+lexical_loaded_mtime = lexical_index_mtime()
+
+def current_lexical_index():
+    """重新匯入目錄後 (索引檔更新) 自動換成新索引；載入失敗時沿用舊的。"""
+    global lexical_index, lexical_loaded_mtime
+    mtime = lexical_index_mtime()
+    if mtime is not None and mtime != lexical_loaded_mtime:
+        lexical_loaded_mtime = mtime
+        try:
+            lexical_index = BM25Index.load(LEXICAL_INDEX_PATH)
+            print(f"BM25 index reloaded: {len(lexical_index)} products")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reloading BM25 index: {e}")
+    return lexical_index
+
+# 重新排序 (選填)：RERANK_MODE=none 時預設關閉，但請求仍可用 "rerank": true 啟用 features 模式
+reranker = Reranker("features" if RERANK_MODE == "none" else RERANK_MODE)
+
 def load_model():
     device = "mps" if torch.backends.mps.is_available() else "cpu"
     print("Using device:", device)
-    return SentenceTransformer("all-MiniLM-L6-v2", device=device)
+    return SentenceTransformer(EMBEDDING_MODEL, device=device)
 
 model = load_model()
 
+# orchestrator 的查詢由固定模板產生，重複率高：快取查詢向量以省下 encode
+embedding_cache = EmbeddingCache(model.encode, EMBEDDING_MODEL)
+
+# 批次端點單次最多查詢數 / encode 的 batch size
+MAX_BATCH_QUERIES = int(os.getenv("RAG_MAX_BATCH_QUERIES", 1000))
+ENCODE_BATCH_SIZE = int(os.getenv("RAG_ENCODE_BATCH_SIZE", 64))
+
+def format_products(hits, rerank_scores=None):
+    """
+    [(product_id, score, doc, meta, ...)] → 回應用的商品清單；summary 使用完整商品文件。
+    回應的 score 一律是向量相似度 (0~1，hybrid 中只被 BM25 取回的商品為 0)；
+    hybrid 融合分數與 CHUNK_AGGREGATION=sum 的排序分數另以 fused_score 列出。
+    """
+    products = []
+    for i, (pid, score, doc, meta, *sources) in enumerate(hits):
+        fused_score = None
+        if len(sources) == 1:
+            # 向量檢索：(..., 最相似 chunk 的相似度)
+            similarity = sources.pop()
+            if CHUNK_AGGREGATION == "sum":
+                fused_score = score
+        else:
+            # hybrid：(..., vector_score, lexical_score)，score 為融合分數
+            similarity = sources[0] or 0.0
+            fused_score = score
+        product = {
+            "id": pid,
+            "score": round(similarity, 4),      # 取小數點後四位
+            "title": meta.get("title", "未命名保險產品"), 
+            "url": meta.get("url", "#"),        # 若無 URL 則給空連結
+            "summary": meta.get("product_doc", doc)
+        }
+        if fused_score is not None:
+            product["fused_score"] = round(fused_score, 4)
+        if sources:
+            # hybrid：分別列出向量相似度與 BM25 分數 (未被該路檢索到為 None)
+            vector_score, lexical_score = sources
+            product["vector_score"] = None if vector_score is None else round(vector_score, 4)
+            product["lexical_score"] = None if lexical_score is None else round(lexical_score, 4)
+        if rerank_scores is not None:
+            product["rerank_score"] = round(rerank_scores[i], 4)
+        products.append(product)
+    return products
+
+def candidate_count(top_k, context=None):
+    """重新排序時先取 N 個候選商品，否則只需 top_k 個。"""
+    return max(top_k, context["candidates"]) if context else top_k
+
+def rank_products(query, ids, docs, metas, distances, top_k, where=None, retrieval=RETRIEVAL_MODE, context=None):
+    """
+    向量搜尋結果 → 商品排序。chunk 索引時同一商品可能命中多個 chunk，先依 product_id 合併；
+    hybrid 模式再與同樣 where 條件下的 BM25 結果融合；有 context 時最後重新排序。
+    回傳 (商品清單, 重新排序說明或 None)。
+    """
+    n = candidate_count(top_k, context)
+    vector_hits = aggregate_products(ids, docs, metas, distances, n * CHUNK_OVERFETCH)
+    lexical = current_lexical_index() if retrieval == "hybrid" else None
+    if lexical is None:
+        hits = vector_hits[:n]
+    else:
+        lexical_hits = lexical.search(query, n * CHUNK_OVERFETCH, where)
+        hits = fuse(vector_hits, lexical_hits, n, FUSION_METHOD, RRF_K, LEXICAL_WEIGHT)
+    if context is None:
+        return format_products(hits[:top_k]), None
+    hits, scores, info = reranker.rerank(query, hits, top_k, context)
+    return format_products(hits, scores), info
+
+def parse_retrieval(data):
+    retrieval = data.get("retrieval") or RETRIEVAL_MODE
+    if retrieval not in RETRIEVAL_MODES:
+        raise ValueError(f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+    return retrieval
+
 @app.route("/recommend_products", methods=["POST"])
 def recommend_products():
-    if collection is None:
+    if search_index is None:
         return jsonify({"error": "Database connection failed"}), 503
 
     try:
@@ -39,44 +180,131 @@ def recommend_products():
         if not query:
             return jsonify({"error": "query is required"}), 400
 
-        # Query embedding
-        query_emb = model.encode(query).tolist()
+        # 投保年齡 / 保額 (選填)：不符合投保條件的商品在向量搜尋時就排除
+        try:
+            age, amount = parse_eligibility(data)
+            retrieval = parse_retrieval(data)
+            context = parse_rerank_context(data, age)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        where = build_where(age, amount)
 
-        # 查詢 Chroma
-        results = collection.query(
+        # Query embedding (LRU / SQLite 快取)
+        query_emb = embedding_cache.get(query).tolist()
+
+        # 查詢 Chroma (多取 chunk，合併成商品後才有 top_k 個不同商品)
+        results = search_index.query(
             query_embeddings=[query_emb],
-            n_results=top_k,
-            include=["documents", "metadatas", "distances"]
+            n_results=candidate_count(top_k, context) * CHUNK_OVERFETCH,
+            include=["documents", "metadatas", "distances"],
+            where=where
         )
 
         # 處理空結果的情況 
         if not results['ids']:
             return jsonify({"products": []})
 
-        ids = results["ids"][0]
-        docs = results["documents"][0]
-        metas = results["metadatas"][0]
-        distances = results["distances"][0]
-
-        products = []
-        for i in range(len(ids)):
-            meta = metas[i] or {}
-        
-            score = max(0.0, float(1 - distances[i])) 
-
-            products.append({
-                "id": ids[i],
-                "score": round(score, 4),           # 取小數點後四位
-                "title": meta.get("title", "未命名保險產品"), 
-                "url": meta.get("url", "#"),        # 若無 URL 則給空連結
-                "summary": docs[i]
-            })
-
+        products, rerank_info = rank_products(
+            query, results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0],
+            top_k, where, retrieval, context
+        )
+        if rerank_info is not None:
+            return jsonify({"products": products, "rerank": rerank_info})
         return jsonify({"products": products})
 
     except Exception as e:
         print(f"Error processing request: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/recommend_products_batch", methods=["POST"])
+def recommend_products_batch():
+    """
+    {"queries": ["...", {"query": "...", "age": 35}, ...], "top_k": 3, "age": 40}
+    所有查詢以一次 model.encode(list) 計算向量；相同投保條件 (age / amount) 的查詢
+    合併成一次多向量 collection.query。頂層的 age / amount (以及重新排序的 smoker /
+    rerank / rerank_candidates) 為各查詢的預設值。
+    """
+    if search_index is None:
+        return jsonify({"error": "Database connection failed"}), 503
+
+    data = request.get_json(silent=True) or {}
+    queries = data.get("queries")
+    top_k = data.get("top_k", 3)
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "queries must be a non-empty list"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"Batch size {len(queries)} exceeds limit {MAX_BATCH_QUERIES}"}), 413
+    try:
+        retrieval = parse_retrieval(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # 空白或格式錯誤的查詢逐筆回報錯誤，其餘照常查詢
+    results = [None] * len(queries)
+    valid_index, valid_queries, valid_where, valid_context = [], [], [], []
+    defaults = {field: data.get(field) for field in
+                ("age", "amount", "smoker", "rerank", "rerank_candidates") if field in data}
+    for i, item in enumerate(queries):
+        if isinstance(item, str):
+            item = {"query": item}
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("query is required")
+            query = item.get("query")
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError("query is required")
+            age, amount = parse_eligibility({**defaults, **item})
+            context = parse_rerank_context({**defaults, **item}, age)
+        except ValueError as e:
+            results[i] = {"index": i, "error": str(e)}
+            continue
+        valid_index.append(i)
+        valid_queries.append(query)
+        valid_where.append(build_where(age, amount))
+        valid_context.append(context)
+
+    if valid_queries:
+        try:
+            embeddings = embedding_cache.get_many(valid_queries, batch_size=ENCODE_BATCH_SIZE)
+            groups = {}
+            for pos, where in enumerate(valid_where):
+                groups.setdefault(json.dumps(where, sort_keys=True), []).append(pos)
+            for positions in groups.values():
+                response = search_index.query(
+                    query_embeddings=[embeddings[pos].tolist() for pos in positions],
+                    n_results=max(candidate_count(top_k, valid_context[pos]) for pos in positions) * CHUNK_OVERFETCH,
+                    include=["documents", "metadatas", "distances"],
+                    where=valid_where[positions[0]]
+                )
+                for j, pos in enumerate(positions):
+                    products, rerank_info = rank_products(
+                        valid_queries[pos], response["ids"][j], response["documents"][j],
+                        response["metadatas"][j], response["distances"][j],
+                        top_k, valid_where[pos], retrieval, valid_context[pos]
+                    ) if response["ids"] else ([], None)
+                    result = {"index": valid_index[pos], "products": products}
+                    if rerank_info is not None:
+                        result["rerank"] = rerank_info
+                    results[valid_index[pos]] = result
+        except Exception as e:
+            print(f"Error processing batch request: {e}")
+            return jsonify({"error": str(e)}), 500
+
+    return jsonify({
+        "results": results,
+        "count": len(queries),
+        "error_count": len(queries) - len(valid_queries)
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify({
+        "embedding_cache": embedding_cache.stats(),
+        "vector_index": local_index.stats() if local_index is not None else {"backend": "chroma"},
+        "lexical_index": lexical_index.stats() if lexical_index is not None else None,
+        "retrieval": {"mode": RETRIEVAL_MODE, "fusion": FUSION_METHOD},
+        "reranker": reranker.stats()
+    })
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5003, debug=False)
\ No newline at end of file
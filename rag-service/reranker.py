@@ -0,0 +1,190 @@
+import os
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from product_rules import AGE_UNBOUNDED
+
+# ---------------------------
+# 設定
+# ---------------------------
+RERANK_MODES = ("none", "features", "cross-encoder")
+RERANK_MODE = os.getenv("RERANK_MODE", "none")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 20))      # 重新排序前先取 N 個商品
+MAX_RERANK_CANDIDATES = 200
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 80))      # 超過即退回向量排序
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")   # 多語 (含中文)
+RERANK_BATCH_SIZE = 8      # cross-encoder 每批筆數；批次之間檢查時限
+
+# 各特徵的權重；relevance 為檢索分數 (cross-encoder 模式為其分數)
+RERANK_WEIGHTS = {"relevance": 0.6, "age": 0.2, "smoker": 0.2}
+
+# 吸菸者較需要的保障 (出現在商品文件中即加分)
+SMOKER_TERMS = ("癌", "重大疾病", "重大傷病", "心臟", "心血管", "中風", "肺", "呼吸")
+
+
+def parse_smoker(value):
+    """與 ML 服務相同的 "yes" / "no"，也接受布林值；未提供回傳 None。"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("yes", "true", "1"):
+        return True
+    if str(value).lower() in ("no", "false", "0"):
+        return False
+    raise ValueError("smoker must be yes or no")
+
+
+def parse_rerank_context(data: dict, age=None, mode=RERANK_MODE):
+    """
+    從請求取出重新排序的條件；未啟用時回傳 None。
+    rerank (true/false) 可覆寫預設 (RERANK_MODE=none 時請求仍可用 features 模式)，
+    rerank_candidates 為 N，smoker 為特徵輸入。
+    """
+    enabled = data.get("rerank")
+    if enabled is None:
+        enabled = mode != "none"
+    if not isinstance(enabled, bool):
+        raise ValueError("rerank must be true or false")
+    if not enabled:
+        return None
+
+    candidates = data.get("rerank_candidates", RERANK_CANDIDATES)
+    if isinstance(candidates, bool) or not isinstance(candidates, int) or not 1 <= candidates <= MAX_RERANK_CANDIDATES:
+        raise ValueError(f"rerank_candidates must be an integer between 1 and {MAX_RERANK_CANDIDATES}")
+    return {
+        "candidates": candidates,
+        "age": age,
+        "smoker": parse_smoker(data.get("smoker")),
+    }
+
+# ---------------------------
+# 特徵
+# ---------------------------
+def age_fit(meta, age):
+    """可投保 1、不可投保 0；未提供年齡或商品沒有年齡規則時為中性的 0.5。"""
+    low, high = meta.get("min_age"), meta.get("max_age")
+    if age is None or low is None or high is None or (low, high) == AGE_UNBOUNDED:
+        return 0.5
+    return 1.0 if low <= age <= high else 0.0
+
+
+def smoker_fit(doc, smoker):
+    if not smoker:
+        return 0.0
+    hits = sum(term in doc for term in SMOKER_TERMS)
+    return min(1.0, hits / 2)
+
+
+def feature_scores(hits, relevance, context):
+    age, smoker = context["age"], context["smoker"]
+    scores = []
+    for (_, _, doc, meta, *_), rel in zip(hits, relevance):
+        doc = meta.get("product_doc", doc)
+        scores.append(
+            RERANK_WEIGHTS["relevance"] * rel
+            + RERANK_WEIGHTS["age"] * age_fit(meta, age)
+            + RERANK_WEIGHTS["smoker"] * smoker_fit(doc, smoker)
+        )
+    return scores
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Reranker:
+    """
+    把檢索取回的 N 個候選商品重新排序。features 模式只用檢索分數 + 投保條件特徵 (微秒級)；
+    cross-encoder 模式先以 cross-encoder 重新評估相關度再加上特徵。
+    整個階段有硬性時限：超時 (或出錯) 就回傳原本的檢索排序，不讓回應變慢。
+    """
+
+    def __init__(self, mode=RERANK_MODE, budget_ms=RERANK_BUDGET_MS, model_name=RERANK_MODEL):
+        self.mode = mode
+        self.budget_ms = budget_ms
+        self.model = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.applied = 0
+        self.fallbacks = 0
+        self.applied_ms = 0.0
+
+        if mode == "cross-encoder":
+            try:
+                from sentence_transformers import CrossEncoder
+
+                self.model = CrossEncoder(model_name)
+                # 單一 worker：模型推論不並行，排隊的請求會因時限而退回檢索排序
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+                print(f"Cross-encoder loaded: {model_name}")
+            except Exception as e:
+                print(f"Error loading cross-encoder, using feature reranking: {e}")
+                self.mode = "features"
+
+    def _cross_encoder_relevance(self, query, hits, deadline):
+        pairs = [(query, meta.get("product_doc", doc)) for _, _, doc, meta, *_ in hits]
+        logits = []
+        for start in range(0, len(pairs), RERANK_BATCH_SIZE):
+            if time.perf_counter() > deadline:
+                raise BudgetExceeded()
+            logits.extend(float(x) for x in self.model.predict(pairs[start:start + RERANK_BATCH_SIZE]))
+        return [1 / (1 + math.exp(-x)) for x in logits]
+
+    def _score(self, query, hits, context, deadline):
+        if self.mode == "cross-encoder":
+            relevance = self._cross_encoder_relevance(query, hits, deadline)
+        else:
+            best = max((hit[1] for hit in hits), default=0.0)
+            relevance = [hit[1] / best if best > 0 else 0.0 for hit in hits]
+        if time.perf_counter() > deadline:
+            raise BudgetExceeded()
+        return feature_scores(hits, relevance, context)
+
+    def rerank(self, query, hits, top_k, context):
+        """
+        hits 為檢索排序的 [(product_id, score, doc, meta, ...)]。
+        回傳 (前 top_k 個 hits, 對應的重新排序分數或 None, 說明)。
+        """
+        started = time.perf_counter()
+        deadline = started + self.budget_ms / 1000
+        info = {"mode": self.mode, "candidates": len(hits), "applied": False}
+        with self._lock:
+            self.calls += 1
+        try:
+            if self._executor is not None:
+                # 在另一個 thread 推論，時間到就不再等 (推論會在下一批之前自行停止)
+                future = self._executor.submit(self._score, query, hits, context, deadline)
+                scores = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+            else:
+                scores = self._score(query, hits, context, deadline)
+        except (BudgetExceeded, FutureTimeout):
+            info["fallback"] = "budget"
+        except Exception as e:
+            print(f"Rerank error: {e}")
+            info["fallback"] = "error"
+        else:
+            order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)[:top_k]
+            info["applied"] = True
+            info["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            with self._lock:
+                self.applied += 1
+                self.applied_ms += info["elapsed_ms"]
+            return [hits[i] for i in order], [scores[i] for i in order], info
+
+        with self._lock:
+            self.fallbacks += 1
+        info["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return hits[:top_k], None, info
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "budget_ms": self.budget_ms,
+            "calls": self.calls,
+            "applied": self.applied,
+            "fallbacks": self.fallbacks,
+            "avg_ms": round(self.applied_ms / self.applied, 3) if self.applied else 0.0,
+        }
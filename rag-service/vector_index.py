@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from pathlib import Path
+from product_rules import match_where
+
+# ---------------------------
+# 設定
+# ---------------------------
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "chroma")                       # chroma / numpy
+VECTOR_INDEX_SNAPSHOT = os.getenv("VECTOR_INDEX_SNAPSHOT", "")           # 例如 ../data/index/products.npy
+VECTOR_INDEX_REFRESH = float(os.getenv("VECTOR_INDEX_REFRESH", 300))     # 秒，0 = 不重新整理
+FETCH_PAGE_SIZE = 500
+WHERE_CACHE_SIZE = 256     # 每種 where 條件符合的商品位置 (年齡種類有限，快取命中率高)
+
+
+def snapshot_meta_path(path):
+    return Path(path).with_suffix(".json")
+
+
+class NumpyIndex:
+    """
+    程序內的精確 cosine 搜尋：所有商品向量正規化後放在一個連續的 float32 矩陣，
+    查詢 = 一次矩陣乘法 + argpartition 取 top-k。
+    query() 的參數與回傳格式與 Chroma collection.query 相同，可直接替換。
+    """
+
+    def __init__(self, ids, documents, metadatas, embeddings, normalized=False):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError("embeddings must be a (n_products, dim) matrix")
+        if not normalized:
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = np.ascontiguousarray(matrix / np.where(norms == 0, 1.0, norms), dtype=np.float32)
+        # snapshot 存的是已正規化的矩陣，mmap 載入時直接使用
+        self.matrix = matrix
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+        self.built_at = time.time()
+        self._where_cache = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---------------------------
+    # 建立 / snapshot
+    # ---------------------------
+    @classmethod
+    def from_collection(cls, collection, page_size=FETCH_PAGE_SIZE):
+        ids, documents, metadatas, embeddings = [], [], [], []
+        offset = 0
+        while True:
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            ids += page["ids"]
+            documents += page["documents"]
+            metadatas += page["metadatas"]
+            embeddings.append(np.asarray(page["embeddings"], dtype=np.float32))
+            offset += len(page["ids"])
+        if not ids:
+            raise ValueError("Collection is empty")
+        return cls(ids, documents, metadatas, np.concatenate(embeddings))
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先寫暫存檔再 os.replace，避免其他 worker 讀到寫一半的 snapshot
+        tmp_npy = path.with_name(f".{path.stem}.tmp.npy")
+        np.save(tmp_npy, self.matrix)
+        meta = {"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas, "built_at": self.built_at}
+        tmp_json = path.with_name(f".{path.stem}.tmp.json")
+        tmp_json.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_npy, path)
+        os.replace(tmp_json, snapshot_meta_path(path))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        meta = json.loads(snapshot_meta_path(path).read_text(encoding="utf-8"))
+        matrix = np.load(path, mmap_mode="r" if mmap else None)
+        index = cls(meta["ids"], meta["documents"], meta["metadatas"], matrix, normalized=True)
+        index.built_at = meta.get("built_at", index.built_at)
+        return index
+
+    # ---------------------------
+    # 查詢
+    # ---------------------------
+    def top_k(self, scores, k):
+        """scores 為一維相似度；回傳由高到低的 k 個位置。"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    def allowed_rows(self, where):
+        """符合 where 的商品位置 (None = 全部)；先過濾再計算相似度，縮小要評分的候選集合。"""
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True)
+        rows = self._where_cache.get(key)
+        if rows is None:
+            rows = np.array([i for i, meta in enumerate(self.metadatas) if match_where(meta, where)], dtype=np.int64)
+            if len(self._where_cache) >= WHERE_CACHE_SIZE:
+                self._where_cache.clear()
+            self._where_cache[key] = rows
+        return rows
+
+    def query(self, query_embeddings, n_results=10, include=None, where=None):
+        Q = np.asarray(query_embeddings, dtype=np.float32)
+        if Q.ndim == 1:
+            Q = Q[None, :]
+        norms = np.linalg.norm(Q, axis=1, keepdims=True)
+        Q = Q / np.where(norms == 0, 1.0, norms)
+
+        rows = self.allowed_rows(where)
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        scores = Q @ matrix.T      # (n_queries, n_candidates)
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row in scores:
+            order = self.top_k(row, n_results)
+            positions = order if rows is None else rows[order]
+            results["ids"].append([self.ids[i] for i in positions])
+            results["documents"].append([self.documents[i] for i in positions])
+            results["metadatas"].append([self.metadatas[i] for i in positions])
+            # 與 Chroma cosine space 相同：distance = 1 - cosine similarity
+            results["distances"].append([float(1.0 - row[i]) for i in order])
+        return results
+
+
+class LocalVectorIndex:
+    """
+    持有目前的 NumpyIndex 並定期從 Chroma 重新建立 (以單一參照指派切換)。
+    啟動時若有 snapshot 先以 mmap 載入，不必等 Chroma；重建成功後會覆寫 snapshot。
+    """
+
+    def __init__(self, collection, snapshot_path=VECTOR_INDEX_SNAPSHOT, refresh_interval=VECTOR_INDEX_REFRESH):
+        self.collection = collection
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self.last_error = None
+        self._refresh_lock = threading.Lock()
+        self._watcher = None
+
+        if snapshot_path and Path(snapshot_path).exists():
+            try:
+                self.index = NumpyIndex.load(snapshot_path)
+                print(f"Vector index loaded from snapshot: {len(self.index)} products")
+            except Exception as e:
+                print(f"Error loading vector index snapshot: {e}")
+        if self.index is None:
+            self.refresh()
+
+    def refresh(self):
+        if self.collection is None:
+            return None
+        with self._refresh_lock:
+            try:
+                index = NumpyIndex.from_collection(self.collection)
+            except Exception as e:
+                # 保留舊索引，下次再試
+                self.last_error = str(e)
+                print(f"Error refreshing vector index: {e}")
+                return None
+            self.index = index
+            self.last_error = None
+            if self.snapshot_path:
+                try:
+                    index.save(self.snapshot_path)
+                except OSError as e:
+                    print(f"Error writing vector index snapshot: {e}")
+        print(f"Vector index refreshed: {len(index)} products")
+        return index
+
+    def start_refresher(self):
+        if self.refresh_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+
+        def run():
+            while True:
+                time.sleep(self.refresh_interval)
+                self.refresh()
+
+        self._watcher = threading.Thread(target=run, name="vector-index-refresh", daemon=True)
+        self._watcher.start()
+
+    def query(self, query_embeddings, n_results=10, include=None, where=None):
+        index = self.index
+        if index is None:
+            # 尚未建好索引 (Chroma 啟動較慢) 時直接查 Chroma
+            if self.collection is None:
+                raise RuntimeError("Vector index is not loaded")
+            return self.collection.query(
+                query_embeddings=query_embeddings, n_results=n_results, include=include, where=where
+            )
+        return index.query(query_embeddings, n_results, include, where)
+
+    def stats(self):
+        index = self.index
+        return {
+            "products": len(index) if index is not None else 0,
+            "dim": int(index.matrix.shape[1]) if index is not None else None,
+            "built_at": index.built_at if index is not None else None,
+            "refresh_interval": self.refresh_interval,
+            "snapshot": self.snapshot_path or None,
+            "last_error": self.last_error,
+        }
@@ -1,24 +1,76 @@
+"""
+write_into_chromaDB.py
+
+將商品目錄增量同步到 ChromaDB：
+    - ID 由商品 URL 的 hash 產生 (沒有 URL 時用商品名稱)，與列的順序無關
+    - 每個商品計算內容 hash (文件 + metadata + 模型名稱)，只重新 embedding 新增或有變動的商品
+    - 以固定大小的批次 upsert，目錄中已不存在的商品會被刪除
+    - --chunking field / passage：每個商品拆成多個欄位 / 段落 chunk 各自 embedding，
+      ID 為 {商品 ID}#{序號}，metadata 帶 product_id 供查詢時合併回商品
+    - 同步完成後重建商品層級的 BM25 索引 (中文字元 n-gram) 並寫到 --lexical-index，
+      供 recommendation_service 的 hybrid 檢索使用
+重複執行是冪等的：目錄沒有變動時不會 encode 也不會寫入。
+
+大型目錄以串流方式處理：逐 chunk 讀檔 → (多 process) 批次 encode → 經由有上限的 queue
+交給背景 thread upsert，encode 與寫入 Chroma 同時進行，最後回報 docs/sec。
+只有 CSV 會逐 chunk 讀取；Excel (.xlsx) 會先整份載入記憶體再切成 chunk，大型目錄請轉成 CSV。
+
+    python write_into_chromaDB.py --data ../data/insurance_sample.csv
+    python write_into_chromaDB.py --data catalog.csv --chunk-size 5000 --encode-workers 4
+    python write_into_chromaDB.py --chunking passage
+    python write_into_chromaDB.py --dry-run
+"""
+
+import os
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
 from chromadb import HttpClient
-from sentence_transformers import SentenceTransformer
 import pandas as pd
 from pathlib import Path
+from product_rules import eligibility_metadata
+from chunking import CHUNKING_MODES, build_chunks
+from lexical_index import LEXICAL_INDEX_PATH, BM25Index
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_DATA_PATH = BASE_DIR.parent / "data" / "insurance_sample.csv"
+
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
+COLLECTION_NAME = "insurance_products"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 256))        # 每次 upsert 的文件數 (商品或 chunk)
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 64))      # model.encode 的 batch size
+
+TEXT_COLUMNS = ["url", "title", "description", "insured_age_label", "payment_term",
+                "benefits", "age_raw_text", "amount_raw_text"]
 
 # ---------------------------
 # Load Excel
 # ---------------------------
-BASE_DIR = Path(__file__).resolve().parent
-data_path = BASE_DIR.parent / "data" / "insurance_sample.csv"
-df = pd.read_excel(data_path)
-
-# Replace NaN in URL & title to empty strings
-df["url"] = df["url"].fillna("").astype(str)
-df["title"] = df["title"].fillna("").astype(str)
-df["description"] = df["description"].fillna("").astype(str)
-df["insured_age_label"] = df["insured_age_label"].fillna("").astype(str)
-df["payment_term"] = df["payment_term"].fillna("").astype(str)
-df["benefits"] = df["benefits"].fillna("").astype(str)
-df["age_raw_text"] = df["age_raw_text"].fillna("").astype(str)
-df["amount_raw_text"] = df["amount_raw_text"].fillna("").astype(str)
+def fill_text_columns(df):
+    # Replace NaN in text columns with empty strings
+    for col in TEXT_COLUMNS:
+        if col not in df.columns:
+            df[col] = ""
+        df[col] = df[col].fillna("").astype(str)
+    return df
+
+
+def iter_catalog(path, chunk_size):
+    """逐 chunk 回傳目錄 DataFrame；CSV 串流讀取，Excel 無法分段讀取，整份讀入後再切段。"""
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            yield fill_text_columns(chunk)
+        return
+    df = pd.read_excel(path)
+    for start in range(0, len(df), chunk_size):
+        yield fill_text_columns(df.iloc[start:start + chunk_size].copy())
+
 
 def build_doc(row):
     return f"""
@@ -32,52 +84,272 @@ def build_doc(row):
 保額說明：{row['amount_raw_text']}
 """.strip()
 
-df["doc"] = df.apply(build_doc, axis=1)
 
-# ---------------------------
-# Connect to Chroma HTTP Server (Docker)
-# ---------------------------
-client = HttpClient(host="localhost", port=8000)
-
-# Create collection
-collection_name = "insurance_products"
-try:
-    collection = client.create_collection(
-        name=collection_name,
-        metadata={"hnsw:space": "cosine"}
+def product_id(row):
+    # URL 為商品的穩定識別；重新排序或插入新商品都不會改變其他商品的 ID
+    key = row["url"].strip() or row["title"].strip()
+    return "prod_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def content_hash(doc, metadata, chunking):
+    payload = json.dumps(
+        {"model": EMBEDDING_MODEL, "chunking": chunking, "doc": doc, "meta": metadata},
+        ensure_ascii=False, sort_keys=True
     )
-except:
-    collection = client.get_collection(collection_name)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_records(df, chunking="none"):
+    """
+    回傳 {商品 ID: {"hash", "url", "entries": [(entry ID, document, metadata)]}}；
+    同一 URL 出現多次時以第一筆為準。
+    """
+    records = {}
+    for _, row in df.iterrows():
+        if not (row["url"].strip() or row["title"].strip()):
+            continue
+        pid = product_id(row)
+        if pid in records:
+            print(f"Duplicate product {row['url'] or row['title']}: keeping the first row")
+            continue
+
+        doc = build_doc(row)
+        metadata = {
+            "title": row["title"],
+            "url": row["url"],
+            # 投保年齡 / 保額範圍，供 /recommend_products 依客戶年齡預先過濾
+            **eligibility_metadata(row)
+        }
+        digest = content_hash(doc, metadata, chunking)
+        metadata.update(product_id=pid, content_hash=digest)
+
+        if chunking == "none":
+            entries = [(pid, doc, metadata)]
+        else:
+            # chunk 只存片段文字，完整商品文件放在 metadata 供回傳 summary
+            entries = [
+                (f"{pid}#{n}", text, {**metadata, "field": field, "product_doc": doc})
+                for n, (field, text) in enumerate(build_chunks(row, chunking))
+            ]
+        records[pid] = {"hash": digest, "url": row["url"] or row["title"], "entries": entries}
+    return records
 
 # ---------------------------
-# Embedding model
+# 同步計畫
 # ---------------------------
-model = SentenceTransformer("all-MiniLM-L6-v2")
+def existing_products(collection, page_size=1000):
+    """
+    {商品 ID: {"hash", "ids"}}；以 metadata 的 product_id 把 chunk 歸回商品。
+    舊版寫入的資料沒有 content_hash / product_id，會被視為需要更新 / 刪除。
+    """
+    products = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for entry_id, meta in zip(page["ids"], page["metadatas"]):
+            meta = meta or {}
+            product = products.setdefault(meta.get("product_id", entry_id), {"hash": meta.get("content_hash"), "ids": set()})
+            product["ids"].add(entry_id)
+        offset += len(page["ids"])
+    return products
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 # ---------------------------
-# Insert into ChromaDB (HTTP)
+# Encode / 寫入 pipeline
 # ---------------------------
-ids = []
-documents = []
-metadatas = []
-
-for idx, row in df.iterrows():
-    product_id = f"prod_{idx}"
-
-    ids.append(product_id)
-    documents.append(row["doc"])
-    metadatas.append({
-        "title": row["title"],
-        "url": row["url"]
-    })
-
-embeds = model.encode(documents).tolist()
-
-collection.add(
-    ids=ids,
-    documents=documents,
-    metadatas=metadatas,
-    embeddings=embeds
-)
-
-print("success write", len(df), "items into ChromaDB!")
+class Encoder:
+    """SentenceTransformer 的包裝：workers > 1 時使用 multi-process pool；模型在第一次 encode 時才載入。"""
+
+    def __init__(self, workers=1, batch_size=ENCODE_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.model = None
+        self.pool = None
+        self.docs = 0
+        self.seconds = 0.0
+
+    def encode(self, documents):
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self.model = SentenceTransformer(EMBEDDING_MODEL)
+            if self.workers > 1:
+                self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+        started = time.perf_counter()
+        if self.pool is not None:
+            embeddings = self.model.encode_multi_process(documents, self.pool, batch_size=self.batch_size)
+        else:
+            embeddings = self.model.encode(documents, batch_size=self.batch_size)
+        self.seconds += time.perf_counter() - started
+        self.docs += len(documents)
+        return embeddings
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+class UpsertWriter:
+    """
+    背景 thread 依序執行 upsert / delete。queue 有上限：寫入跟不上時 put() 會阻塞 encode 端，
+    記憶體中最多只有 queue_size 批尚未寫入的向量。
+    """
+
+    def __init__(self, collection, queue_size=4):
+        self.collection = collection
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.upserted = 0
+        self.deleted = 0
+        self._thread = threading.Thread(target=self._run, name="chroma-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # 已失敗：只把 queue 清空，讓 put() 不會卡住
+            op, payload = item
+            try:
+                if op == "upsert":
+                    self.collection.upsert(**payload)
+                    self.upserted += len(payload["ids"])
+                else:
+                    self.collection.delete(ids=payload)
+                    self.deleted += len(payload)
+            except Exception as e:
+                self.error = e
+
+    def put(self, op, payload):
+        if self.error is not None:
+            raise self.error
+        self._queue.put((op, payload))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def sync(collection, data_path, chunk_size, batch_size=SYNC_BATCH_SIZE, encoder=None, queue_size=4,
+         dry_run=False, chunking="none"):
+    existing = existing_products(collection)
+    seen = set()
+    stats = {"products": 0, "upserted": 0, "deleted": 0, "unchanged": 0, "entries_upserted": 0}
+    writer = None if dry_run else UpsertWriter(collection, queue_size)
+    started = time.perf_counter()
+
+    try:
+        for chunk in iter_catalog(data_path, chunk_size):
+            records = build_records(chunk, chunking)
+            for pid in seen.intersection(records):
+                print(f"Duplicate product {records.pop(pid)['url']}: keeping the first row")
+            seen.update(records)
+
+            changed = [pid for pid, rec in records.items() if existing.get(pid, {}).get("hash") != rec["hash"]]
+            entries = [entry for pid in changed for entry in records[pid]["entries"]]
+            # 商品改版後 chunk 數變少 (或切換 chunking 模式) 時，多出來的舊 chunk 要刪除
+            stale = [
+                entry_id for pid in changed
+                for entry_id in existing.get(pid, {}).get("ids", set()) - {e[0] for e in records[pid]["entries"]}
+            ]
+            stats["products"] += len(records)
+            stats["unchanged"] += len(records) - len(changed)
+            stats["upserted"] += len(changed)
+            stats["entries_upserted"] += len(entries)
+            if dry_run:
+                continue
+
+            for batch in batched(entries, batch_size):
+                documents = [doc for _, doc, _ in batch]
+                embeddings = encoder.encode(documents)
+                writer.put("upsert", {
+                    "ids": [entry_id for entry_id, _, _ in batch],
+                    "documents": documents,
+                    "metadatas": [meta for _, _, meta in batch],
+                    "embeddings": embeddings.tolist(),
+                })
+            for batch in batched(stale, batch_size):
+                writer.put("delete", batch)
+            elapsed = time.perf_counter() - started
+            print(f"processed {stats['products']} products | encoded {encoder.docs} "
+                  f"({encoder.docs / elapsed if elapsed else 0:.1f} docs/sec)")
+
+        # 目錄中已不存在的商品 (只有整份目錄讀完才能判斷)
+        removed = [pid for pid in existing if pid not in seen]
+        stats["deleted"] = len(removed)
+        if not dry_run:
+            delete = [entry_id for pid in removed for entry_id in existing[pid]["ids"]]
+            for batch in batched(delete, batch_size):
+                writer.put("delete", batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    if encoder is not None and encoder.docs:
+        stats["encode_docs_per_sec"] = round(encoder.docs / encoder.seconds, 1)
+        stats["docs_per_sec"] = round(encoder.docs / stats["seconds"], 1)
+    return stats
+
+
+def connect_collection():
+    # Connect to Chroma HTTP Server (Docker)
+    client = HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    return client.get_or_create_collection(name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally sync the product catalog into ChromaDB")
+    parser.add_argument("--data", default=str(DEFAULT_DATA_PATH))
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows read from the source at a time")
+    parser.add_argument("--batch-size", type=int, default=SYNC_BATCH_SIZE, help="documents (products or chunks) per encode + upsert batch")
+    parser.add_argument("--encode-batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    parser.add_argument("--encode-workers", type=int, default=1, help="> 1 = SentenceTransformer multi-process pool")
+    parser.add_argument("--queue-size", type=int, default=4, help="encoded batches waiting to be upserted")
+    parser.add_argument("--chunking", choices=CHUNKING_MODES, default="none",
+                        help="index whole products, one chunk per field, or passage-level chunks")
+    parser.add_argument("--lexical-index", default=LEXICAL_INDEX_PATH,
+                        help="where to write the BM25 index ('' = skip)")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would change")
+    args = parser.parse_args()
+
+    collection = connect_collection()
+    encoder = None if args.dry_run else Encoder(args.encode_workers, args.encode_batch_size)
+    try:
+        stats = sync(collection, args.data, args.chunk_size, args.batch_size, encoder, args.queue_size,
+                     args.dry_run, args.chunking)
+    finally:
+        if encoder is not None:
+            encoder.close()
+
+    print(f"catalog: {stats['products']} products | new/changed: {stats['upserted']} | "
+          f"removed: {stats['deleted']} | unchanged: {stats['unchanged']}" + (" (dry run)" if args.dry_run else ""))
+    if "docs_per_sec" in stats:
+        print(f"encoded {stats['entries_upserted']} docs in {stats['seconds']}s: {stats['docs_per_sec']} docs/sec overall, "
+              f"{stats['encode_docs_per_sec']} docs/sec encoding")
+
+    if args.lexical_index and not args.dry_run:
+        # BM25 需要整份目錄的詞頻，從 Chroma 讀回 (含未變動的商品) 後整個重建
+        try:
+            lexical = BM25Index.from_collection(collection)
+        except ValueError as e:
+            print(f"Skipping BM25 index: {e}")
+            return
+        lexical.save(args.lexical_index)
+        info = lexical.stats()
+        print(f"BM25 index: {info['products']} products, {info['terms']} terms -> {args.lexical_index}")
+
+
+if __name__ == "__main__":
+    main()
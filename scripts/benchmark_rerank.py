@@ -0,0 +1,132 @@
+"""
+benchmark_rerank.py
+
+比較不同重新排序候選數 N 的品質 / 延遲取捨 (需先啟動 recommendation_service.py)：
+    - N = 0 代表不重新排序 (原本的檢索排序)，作為基準
+    - 品質：以關鍵字判定相關商品 (標題或摘要含任一 relevant_terms)，計算 precision@k 與 nDCG@k
+    - 延遲：每個請求的 client 端 p50 / p95，以及服務回報的重新排序耗時與退回檢索排序的比例
+    - 年齡：每個 N 各跑兩次 (--age-modes)
+        prefilter  送出 age，服務先以年齡規則排除不可投保的商品；候選商品皆可投保，
+                   年齡特徵只剩「有年齡規則 1 / 無規則 0.5」的差異，排序主要由相關度與吸菸特徵決定
+        none       不送 age，不做年齡預先過濾；年齡特徵為中性 0.5，
+                   量測的是沒有投保條件時 (例如對話尚未取得年齡) 重新排序的效果
+
+    python benchmark_rerank.py
+    python benchmark_rerank.py --candidates 0,10,20,50,100 --retrieval hybrid --repeat 5
+    python benchmark_rerank.py --age-modes none
+    python benchmark_rerank.py --queries eval_queries.jsonl
+
+--queries 為 JSONL，每行 {"query": "...", "relevant_terms": ["癌"], "age": 40, "smoker": "yes"}。
+"""
+
+import json
+import math
+import time
+import argparse
+import statistics
+import requests
+
+API_URL = "http://localhost:5003/recommend_products"
+
+DEFAULT_QUERIES = [
+    {"query": "我想找癌症保障、確診一次給付的保險", "relevant_terms": ["癌"], "age": 45, "smoker": "yes"},
+    {"query": "終身醫療保障，住院手術都能理賠", "relevant_terms": ["醫療", "住院"], "age": 35, "smoker": "no"},
+    {"query": "意外受傷骨折的保障", "relevant_terms": ["意外", "傷害"], "age": 28, "smoker": "no"},
+    {"query": "家庭經濟支柱需要的身故保障", "relevant_terms": ["壽險", "身故"], "age": 40, "smoker": "no"},
+    {"query": "有抽菸習慣，擔心心血管與中風", "relevant_terms": ["重大疾病", "重大傷病", "心", "中風"], "age": 55, "smoker": "yes"},
+    {"query": "小孩的醫療與意外保障", "relevant_terms": ["醫療", "意外"], "age": 5, "smoker": "no"},
+    {"query": "長期照顧、失能扶助", "relevant_terms": ["長期照顧", "長照", "失能"], "age": 60, "smoker": "no"},
+    {"query": "退休規劃，年金給付", "relevant_terms": ["年金", "退休"], "age": 50, "smoker": "no"},
+]
+
+
+def load_queries(path):
+    if not path:
+        return DEFAULT_QUERIES
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def is_relevant(product, terms):
+    text = f"{product.get('title', '')}\n{product.get('summary', '')}"
+    return any(term in text for term in terms)
+
+
+def ndcg(relevance, k):
+    dcg = sum(rel / math.log2(i + 2) for i, rel in enumerate(relevance[:k]))
+    ideal = sum(1 / math.log2(i + 2) for i in range(min(k, sum(relevance))))
+    return dcg / ideal if ideal else 0.0
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run(url, queries, candidates, top_k, retrieval, repeat, age_mode):
+    latencies, rerank_ms, precisions, ndcgs = [], [], [], []
+    applied = fallbacks = 0
+    session = requests.Session()
+    for item in queries:
+        payload = {
+            "query": item["query"], "top_k": top_k, "retrieval": retrieval,
+            "age": item.get("age") if age_mode == "prefilter" else None, "smoker": item.get("smoker"),
+            "rerank": candidates > 0,
+        }
+        if candidates > 0:
+            payload["rerank_candidates"] = candidates
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = session.post(url, json=payload, timeout=30)
+            latencies.append((time.perf_counter() - started) * 1000)
+            response.raise_for_status()
+            data = response.json()
+        # 品質只看最後一次 (每次結果相同，除非中途退回檢索排序)
+        relevance = [int(is_relevant(p, item["relevant_terms"])) for p in data.get("products", [])]
+        precisions.append(sum(relevance) / top_k)
+        ndcgs.append(ndcg(relevance, top_k))
+        info = data.get("rerank")
+        if info is not None:
+            if info["applied"]:
+                applied += 1
+                rerank_ms.append(info["elapsed_ms"])
+            else:
+                fallbacks += 1
+    return {
+        "age": age_mode,
+        "N": candidates,
+        f"P@{top_k}": round(statistics.mean(precisions), 3),
+        f"nDCG@{top_k}": round(statistics.mean(ndcgs), 3),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "rerank_ms": round(statistics.mean(rerank_ms), 2) if rerank_ms else None,
+        "fallback": f"{fallbacks}/{applied + fallbacks}" if candidates > 0 else "-",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quality/latency tradeoff of the reranking stage")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--queries", default="", help="JSONL evaluation set (default: built-in queries)")
+    parser.add_argument("--candidates", default="0,5,10,20,50", help="comma-separated N values; 0 = no reranking")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--retrieval", choices=["vector", "hybrid"], default="vector")
+    parser.add_argument("--repeat", type=int, default=3, help="requests per query (for latency percentiles)")
+    parser.add_argument("--age-modes", default="prefilter,none",
+                        help="prefilter = send age (eligibility filter), none = omit age")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    rows = [run(args.url, queries, int(n), args.top_k, args.retrieval, args.repeat, age_mode)
+            for age_mode in args.age_modes.split(",")
+            for n in args.candidates.split(",")]
+
+    print(f"{len(queries)} queries x {args.repeat} | retrieval={args.retrieval}")
+    columns = list(rows[0])
+    print(" | ".join(f"{c:>10}" for c in columns))
+    for row in rows:
+        print(" | ".join(f"{str(row[c]):>10}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
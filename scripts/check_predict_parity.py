@@ -0,0 +1,95 @@
+"""
+check_predict_parity.py
+
+以隨機輸入比較 ml-service 的各推論路徑與 sklearn Pipeline.predict：
+    - fast path (FastPredictor)：整批與逐筆，預期完全一致
+    - micro-batcher (PREDICT_BATCHING=1)：並發送出單筆，預期完全一致
+    - 查表模式 (PREDICT_LOOKUP_TABLE，需 --table)：BMI 內插為近似值，檢查相對誤差上限
+
+    python check_predict_parity.py --model ../models/insurance_xgb_model.pkl
+    python check_predict_parity.py --model ../models/insurance_xgb_model.pkl --table ../models/premium_table.npy
+
+任一路徑超出容許誤差時 exit code 為 1。
+"""
+
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ml-service"))
+
+from fast_predictor import FastPredictor  # noqa: E402
+from light_inference import REGION_MAP  # noqa: E402
+from lookup_table import PremiumTable  # noqa: E402
+from micro_batcher import MicroBatcher  # noqa: E402
+
+CITIES = [city for cities in REGION_MAP.values() for city in cities] + ["花蓮縣", "未知"]
+
+
+def random_records(n, seed):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "age": int(rng.integers(18, 101)),
+            "sex": str(rng.choice(["male", "female"])),
+            "bmi": float(np.round(rng.uniform(12, 55), 2)),
+            "children": int(rng.integers(0, 6)),
+            "smoker": str(rng.choice(["yes", "no"])),
+            "region": str(rng.choice(CITIES)),
+        }
+        for _ in range(n)
+    ]
+
+
+def report(name, diff, tolerance):
+    max_diff = float(np.max(diff)) if len(diff) else 0.0
+    ok = max_diff <= tolerance
+    print(f"{'OK  ' if ok else 'FAIL'} {name}: rows={len(diff)} max_diff={max_diff:.6g} (tolerance {tolerance:g})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the ml-service inference paths match Pipeline.predict")
+    parser.add_argument("--model", required=True, help="joblib pipeline (.pkl)")
+    parser.add_argument("--rows", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--atol", type=float, default=0.0, help="allowed abs diff in log(charges) for fast path / batcher")
+    parser.add_argument("--table", help="premium_table.npy built from the same model")
+    parser.add_argument("--table-rtol", type=float, default=0.02, help="allowed relative premium error for the lookup table")
+    args = parser.parse_args()
+
+    pipeline = joblib.load(args.model)
+    fast = FastPredictor.from_pipeline(pipeline)
+
+    features = [fast.build_features(r) for r in random_records(args.rows, args.seed)]
+    expected = pipeline.predict(pd.DataFrame(features))
+
+    ok = report("fast path (batch)", np.abs(fast.predict_features(features) - expected), args.atol)
+    single = np.array([fast.predict_features([f])[0] for f in features])
+    ok &= report("fast path (single row)", np.abs(single - expected), args.atol)
+
+    batcher = MicroBatcher(fast.predict_features, max_batch_size=32, max_wait_ms=2)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        batched = np.array(list(pool.map(batcher.submit, features)))
+    ok &= report("micro-batcher", np.abs(batched - expected), args.atol)
+    print(f"     batcher: {batcher.stats()['batch_size']['count']} batches")
+
+    if args.table:
+        table = PremiumTable.load(args.table)
+        looked_up = [table.lookup(f) for f in features]
+        in_range = np.array([v is not None for v in looked_up])
+        live = np.exp(expected[in_range])
+        table_charge = np.exp(np.array([v for v in looked_up if v is not None]))
+        ok &= report("lookup table (relative)", np.abs(table_charge - live) / live, args.table_rtol)
+        print(f"     lookup table: {int(in_range.sum())}/{len(features)} rows inside the grid")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
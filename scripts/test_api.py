@@ -52,3 +52,12 @@ for i, data in enumerate(test_data):
         print("-" * 50)
     except Exception as e:
         print(f"Test case {i+1} failed:", e)
+
+# -------------------------------
+# 4. 批次預測 /predict_batch
+# -------------------------------
+try:
+    response = requests.post(url.replace("/predict", "/predict_batch"), json=test_data, timeout=5)
+    print("Batch output:", response.json())
+except Exception as e:
+    print("Batch test failed:", e)
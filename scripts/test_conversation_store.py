@@ -0,0 +1,101 @@
+"""
+conversation_store 測試 (不需啟動 Redis，以 fakeredis 代替)：
+
+    pip install fakeredis
+    python test_conversation_store.py
+    pytest test_conversation_store.py
+"""
+
+import os
+import sys
+import time
+
+import fakeredis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "orchestrator"))
+
+from conversation_store import (  # noqa: E402
+    SLOT_FIELDS,
+    MemoryConversationStore,
+    RedisConversationStore,
+)
+
+
+def make_slots(**values):
+    return {k: {"value": values.get(k)} for k in SLOT_FIELDS}
+
+
+def check_round_trip(store):
+    assert store.get("missing") is None
+
+    slots = make_slots(age=35, sex="male", region="台北市", bmi=22.86)
+    store.save("c1", slots)
+    loaded = store.get("c1")
+    assert loaded == slots
+
+    # get 回傳副本，未呼叫 save 的修改不會寫回
+    loaded["age"]["value"] = 99
+    assert store.get("c1")["age"]["value"] == 35
+
+    store.delete("c1")
+    assert store.get("c1") is None
+
+
+def test_memory_round_trip():
+    check_round_trip(MemoryConversationStore())
+
+
+def test_memory_lru_eviction():
+    store = MemoryConversationStore(max_entries=2)
+    store.save("a", make_slots(age=1))
+    store.save("b", make_slots(age=2))
+    store.get("a")  # a 變成最近使用，b 成為最舊
+    store.save("c", make_slots(age=3))
+
+    assert len(store) == 2
+    assert store.get("b") is None
+    assert store.get("a")["age"]["value"] == 1
+    assert store.get("c")["age"]["value"] == 3
+
+
+def test_memory_ttl_expiry():
+    store = MemoryConversationStore(ttl=0.05)
+    store.save("a", make_slots(age=1))
+    assert store.get("a") is not None
+    time.sleep(0.1)
+    assert store.get("a") is None
+    assert len(store) == 0
+
+    # 過期的對話在下一次 save 時被清除，不佔容量
+    store.save("b", make_slots(age=2))
+    time.sleep(0.1)
+    store.save("c", make_slots(age=3))
+    assert len(store) == 1
+
+
+def test_redis_round_trip():
+    check_round_trip(RedisConversationStore(client=fakeredis.FakeRedis()))
+
+
+def test_redis_ttl_and_shared_state():
+    client = fakeredis.FakeRedis()
+    store = RedisConversationStore(client=client, ttl=60, prefix="test:")
+    store.save("a", make_slots(age=40, smoker="yes"))
+
+    assert 0 < client.ttl("test:a") <= 60
+    # 另一個 worker 使用同一個 Redis 即可讀到相同狀態
+    other = RedisConversationStore(client=client, ttl=60, prefix="test:")
+    assert other.get("a")["smoker"]["value"] == "yes"
+
+    client.expire("test:a", 1)
+    time.sleep(1.1)
+    assert store.get("a") is None
+
+
+if __name__ == "__main__":
+    test_memory_round_trip()
+    test_memory_lru_eviction()
+    test_memory_ttl_expiry()
+    test_redis_round_trip()
+    test_redis_ttl_and_shared_state()
+    print("conversation_store tests passed")
@@ -0,0 +1,285 @@
+"""
+downstream 的 circuit breaker 與重試策略測試：以假時鐘與假 session 模擬下游服務 (不需啟動 ml/rag-service)。
+
+    python test_downstream.py
+    pytest test_downstream.py
+
+假時鐘同時取代 time.sleep，重試的 backoff 不會真的等待。
+"""
+
+import os
+import sys
+import asyncio
+
+import httpx
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "orchestrator"))
+
+import downstream  # noqa: E402
+from downstream import CircuitBreaker, CircuitOpenError, DownstreamClient  # noqa: E402
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body if body is not None else {"ok": True}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"status {self.status_code}", response=self)
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """依序回傳 outcomes：int 為狀態碼，例外實例則直接丟出；最後一項會重複使用。"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, json=None, timeout=None):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+def with_fake_time(test):
+    def run():
+        real_time = downstream.time
+        downstream.time = FakeTime()
+        try:
+            test(downstream.time)
+        finally:
+            downstream.time = real_time
+    run.__name__ = test.__name__
+    return run
+
+
+def make_client(session, retries=2, failure_threshold=3, reset_timeout=30):
+    breaker = CircuitBreaker("test", failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+    return DownstreamClient("test", "http://stub", timeout=1, retries=retries, session=session, breaker=breaker)
+
+# ---------------------------
+# Circuit Breaker 狀態
+# ---------------------------
+@with_fake_time
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    # 成功會重設失敗計數
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+@with_fake_time
+def test_breaker_half_open_transitions(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+
+    # closed -> open -> half_open -> closed
+    breaker.record_failure()
+    assert breaker.acquire() is None
+    clock.advance(29)
+    assert breaker.acquire() is None
+    clock.advance(1)
+    assert breaker.acquire() == "half_open"
+    # 試探請求尚未結束時其他請求仍被拒絕
+    assert breaker.acquire() is None
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.acquire() == "closed"
+
+    # closed -> open -> half_open -> open (試探失敗重新計時)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.acquire() == "half_open"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.acquire() is None
+    clock.advance(30)
+    assert breaker.acquire() == "half_open"
+
+
+@with_fake_time
+def test_abort_probe(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    # 非 half_open 時不影響計數
+    breaker.abort_probe()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+    for _ in range(3):
+        breaker.record_failure()
+    clock.advance(30)
+    assert breaker.acquire() == "half_open"
+    breaker.abort_probe()
+    assert breaker.state == "open"
+    assert breaker.acquire() is None
+
+# ---------------------------
+# DownstreamClient 重試策略
+# ---------------------------
+@with_fake_time
+def test_retries_connection_errors_and_gateway_status(clock):
+    for outcome in (requests.ConnectionError("refused"), 502, 503, 504):
+        session = FakeSession(outcome, 200)
+        client = make_client(session)
+        assert client.post_json("/x", {}) == {"ok": True}
+        assert session.calls == 2, outcome
+        assert client.breaker.state == "closed"
+
+        # 重試用盡後記錄一次失敗並丟出
+        session = FakeSession(outcome)
+        client = make_client(session)
+        expected = requests.ConnectionError if isinstance(outcome, Exception) else requests.HTTPError
+        try:
+            client.post_json("/x", {})
+        except expected:
+            pass
+        else:
+            raise AssertionError(f"expected {expected.__name__} for {outcome!r}")
+        assert session.calls == client.retries + 1, outcome
+        assert client.breaker.failures == 1
+    assert clock.sleeps
+
+
+@with_fake_time
+def test_timeout_and_client_errors_are_not_retried(clock):
+    session = FakeSession(requests.Timeout("read timed out"), 200)
+    client = make_client(session)
+    try:
+        client.post_json("/x", {})
+    except requests.Timeout:
+        pass
+    else:
+        raise AssertionError("expected Timeout")
+    assert session.calls == 1
+    assert client.breaker.failures == 1
+
+    # 500 與 4xx 不重試；4xx 代表服務正常
+    for status, failures in ((500, 1), (400, 0)):
+        session = FakeSession(status, 200)
+        client = make_client(session)
+        try:
+            client.post_json("/x", {})
+        except requests.HTTPError:
+            pass
+        else:
+            raise AssertionError(f"expected HTTPError for {status}")
+        assert session.calls == 1
+        assert client.breaker.failures == failures
+
+
+@with_fake_time
+def test_client_breaker_open_and_probe(clock):
+    session = FakeSession(requests.Timeout("read timed out"))
+    client = make_client(session, failure_threshold=2)
+    for _ in range(2):
+        try:
+            client.post_json("/x", {})
+        except requests.Timeout:
+            pass
+    assert client.breaker.state == "open"
+
+    # open 時不呼叫下游
+    try:
+        client.post_json("/x", {})
+    except CircuitOpenError:
+        pass
+    else:
+        raise AssertionError("expected CircuitOpenError")
+    assert session.calls == 2
+
+    # 試探請求以未分類的例外結束時重新 open
+    clock.advance(30)
+    session.outcomes = [ValueError("bad json")]
+    try:
+        client.post_json("/x", {})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+    assert client.breaker.state == "open"
+    assert client.breaker.acquire() is None
+
+    # 試探成功則恢復 closed
+    clock.advance(30)
+    session.outcomes = [200]
+    assert client.post_json("/x", {}) == {"ok": True}
+    assert client.breaker.state == "closed"
+
+
+def test_async_retry_policy():
+    async def run():
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            outcome = outcomes[min(len(calls) - 1, len(outcomes) - 1)]
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return httpx.Response(outcome, json={"ok": True})
+
+        real_backoff = downstream.backoff_delay
+        downstream.backoff_delay = lambda attempt: 0
+        try:
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http_client:
+                for outcomes in ([httpx.ConnectError("refused"), 200], [503, 200]):
+                    calls.clear()
+                    client = make_client(None)
+                    assert await client.async_post_json(http_client, "/x", {}) == {"ok": True}
+                    assert len(calls) == 2
+
+                calls.clear()
+                outcomes = [httpx.ReadTimeout("read timed out"), 200]
+                client = make_client(None)
+                try:
+                    await client.async_post_json(http_client, "/x", {})
+                except httpx.TimeoutException:
+                    pass
+                else:
+                    raise AssertionError("expected TimeoutException")
+                assert len(calls) == 1
+                assert client.breaker.failures == 1
+        finally:
+            downstream.backoff_delay = real_backoff
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_breaker_opens_after_threshold()
+    test_breaker_half_open_transitions()
+    test_abort_probe()
+    test_retries_connection_errors_and_gateway_status()
+    test_timeout_and_client_errors_are_not_retried()
+    test_client_breaker_open_and_probe()
+    test_async_retry_policy()
+    print("downstream tests passed")
@@ -0,0 +1,149 @@
+"""
+llm_backend 的 HTTP 後端測試：以本機 http.server 模擬 Ollama /api/generate (不需啟動 Ollama)。
+
+    python test_llm_backend.py
+    pytest test_llm_backend.py
+
+prompt 為 "fail" 時 stub 回傳 500，用來測試錯誤狀態與 subprocess 備援。
+"""
+
+import os
+import sys
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "orchestrator"))
+
+from llm_backend import AsyncOllamaHTTPBackend, OllamaHTTPBackend  # noqa: E402
+
+TOKENS = ["您好", "，", "請問", "您的年齡？"]
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path != "/api/generate" or body["prompt"] == "fail":
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "model crashed"}')
+            return
+
+        self.send_response(200)
+        if body["stream"]:
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for token in TOKENS:
+                self.wfile.write(json.dumps({"response": token, "done": False}, ensure_ascii=False).encode() + b"\n")
+                self.wfile.flush()
+            self.wfile.write(b'{"response": "", "done": true}\n')
+        else:
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({"response": "".join(TOKENS), "done": True}, ensure_ascii=False).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class StubFallback:
+    def generate(self, prompt_text):
+        return "fallback"
+
+    def stream(self, prompt_text):
+        yield "fallback"
+
+
+class AsyncStubFallback:
+    async def generate(self, prompt_text):
+        return "fallback"
+
+    async def stream(self, prompt_text):
+        yield "fallback"
+
+
+class RecordingAsyncClient(httpx.AsyncClient):
+    """記錄 send() 回傳的 response，用來確認錯誤時串流回應有被關閉。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.responses = []
+
+    async def send(self, request, **kwargs):
+        response = await super().send(request, **kwargs)
+        self.responses.append(response)
+        return response
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}"
+
+
+def test_http_backend():
+    server, host = start_stub_server()
+    try:
+        backend = OllamaHTTPBackend(host=host)
+        assert backend.generate("hi") == "".join(TOKENS)
+        assert list(backend.stream("hi")) == TOKENS
+
+        for call in (backend.generate, lambda p: list(backend.stream(p))):
+            try:
+                call("fail")
+            except requests.HTTPError as e:
+                assert e.response.status_code == 500
+            else:
+                raise AssertionError("expected HTTPError for status 500")
+
+        backend.fallback = StubFallback()
+        assert backend.generate("fail") == "fallback"
+        assert list(backend.stream("fail")) == ["fallback"]
+    finally:
+        server.shutdown()
+
+
+def test_async_http_backend():
+    server, host = start_stub_server()
+
+    async def run():
+        async with RecordingAsyncClient() as client:
+            backend = AsyncOllamaHTTPBackend(client, host=host)
+            assert await backend.generate("hi") == "".join(TOKENS)
+            assert [t async for t in backend.stream("hi")] == TOKENS
+
+            try:
+                await backend.generate("fail")
+            except httpx.HTTPStatusError as e:
+                assert e.response.status_code == 500
+            else:
+                raise AssertionError("expected HTTPStatusError for status 500")
+            try:
+                [t async for t in backend.stream("fail")]
+            except httpx.HTTPStatusError as e:
+                assert e.response.status_code == 500
+            else:
+                raise AssertionError("expected HTTPStatusError for status 500")
+
+            backend.fallback = AsyncStubFallback()
+            assert await backend.generate("fail") == "fallback"
+            assert [t async for t in backend.stream("fail")] == ["fallback"]
+
+            # 所有串流回應 (包含錯誤狀態) 都已釋放連線
+            assert client.responses and all(r.is_closed for r in client.responses)
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_http_backend()
+    test_async_http_backend()
+    print("llm_backend HTTP tests passed")
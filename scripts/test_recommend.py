@@ -1,6 +1,7 @@
 import requests
 
 API_URL = "http://localhost:5003/recommend_products"
+BATCH_API_URL = "http://localhost:5003/recommend_products_batch"
 
 def test_recommend():
     payload = {
@@ -25,5 +26,33 @@ def test_recommend():
     except Exception as e:
         print("Exception:", e)
 
+def test_recommend_batch():
+    payload = {
+        "queries": [
+            "我想找醫療保障高、保障內容全面、預算大約8萬元的保險方案",
+            "癌症保障、終身保險",
+            ""  # 預期回報 error
+        ],
+        "top_k": 3
+    }
+
+    try:
+        response = requests.post(BATCH_API_URL, json=payload)
+
+        if response.status_code == 200:
+            data = response.json()
+            print("\n--- Batch Results ---")
+            for r in data.get("results", []):
+                if "error" in r:
+                    print(f"[{r['index']}] error: {r['error']}")
+                else:
+                    print(f"[{r['index']}] " + ", ".join(p.get("title") for p in r["products"]))
+        else:
+            print("Error response:", response.text)
+
+    except Exception as e:
+        print("Exception:", e)
+
 if __name__ == "__main__":
     test_recommend()
+    test_recommend_batch()
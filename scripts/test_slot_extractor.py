@@ -0,0 +1,58 @@
+"""
+slot_extractor 規則抽取的表格測試 (不需啟動任何服務)：
+
+    python test_slot_extractor.py
+    pytest test_slot_extractor.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "orchestrator"))
+
+from slot_extractor import extract_slots  # noqa: E402
+
+# (訊息, 預期抽取結果, 預期 needs_llm)
+CASES = [
+    ("35歲男生，住台北，不抽菸，沒有小孩，身高175公分體重70公斤",
+     {"age": 35, "sex": "male", "region": "台北市", "smoker": "no", "children": 0, "height": 175, "weight": 70}, False),
+    ("我有抽菸", {"smoker": "yes"}, False),
+    ("吸菸: 否", {"smoker": "no"}, False),
+    ("抽菸：無", {"smoker": "no"}, False),
+    ("抽菸: 無", {"smoker": "no"}, False),
+    ("我不是吸菸者", {"smoker": "no"}, False),
+    ("non-smoker", {"smoker": "no"}, False),
+    # 否定詞出現在吸菸字眼附近但不符合規則時，不可判為 yes
+    ("以前抽菸，現在已經戒了", {}, True),
+    ("抽菸的習慣沒有", {}, True),
+    # 未出現「菸」也要交給 LLM
+    ("我不抽", {}, True),
+    # 家人的年齡不是投保人的年齡
+    ("我兒子5歲", {}, True),
+    ("我有一個5歲的女兒", {}, True),
+    ("我太太40歲", {}, True),
+    ("我先生40歲", {}, True),
+    ("我今年35，先生也35歲", {}, True),
+    ("我老公抽菸", {}, True),
+    ("我太太抽菸", {}, True),
+    ("我兒子抽菸", {}, True),
+    ("我老公抽菸，我不抽菸", {"smoker": "no"}, True),
+    ("我35歲，兒子5歲", {"age": 35}, True),
+    ("年齡: 四十二", {"age": 42}, False),
+]
+
+
+def test_extract_slots():
+    failures = []
+    for message, expected, expected_needs_llm in CASES:
+        extracted, needs_llm = extract_slots(message)
+        if extracted != expected or needs_llm != expected_needs_llm:
+            failures.append(f"{message!r}: got {(extracted, needs_llm)}, expected {(expected, expected_needs_llm)}")
+    assert not failures, "\n".join(failures)
+
+
+if __name__ == "__main__":
+    for message, expected, expected_needs_llm in CASES:
+        extracted, needs_llm = extract_slots(message)
+        ok = extracted == expected and needs_llm == expected_needs_llm
+        print("OK  " if ok else "FAIL", message, extracted, needs_llm)
@@ -14,6 +14,7 @@ with the website's Terms of Service and robots.txt.
 from bs4 import BeautifulSoup
 import requests
 import re
+import json
 import pandas as pd
 import time
 import os
@@ -221,6 +222,13 @@ def main():
 
     df = pd.DataFrame(results)
 
+    # 結構化的年齡 / 保額規則以 JSON 字串保存 (Excel 無法存 list)，寫入 ChromaDB 時轉成 metadata
+    for col in ["age_parsed", "amount_rules"]:
+        if col in df.columns:
+            df[col] = df[col].apply(
+                lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, list) else ""
+            )
+
     keep_cols = [
         "title",
         "description",
@@ -229,7 +237,9 @@ def main():
         "payment_term",
         "benefits",
         "age_raw_text",
-        "amount_raw_text"
+        "amount_raw_text",
+        "age_parsed",
+        "amount_rules"
     ]
 
     df = df[[c for c in keep_cols if c in df.columns]]